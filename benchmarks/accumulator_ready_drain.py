@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Time RecordAccumulator.ready() and drain() with many partitions, few of
+which have records, as seen by the sender thread with linger_ms.
+
+Run from the repository root::
+
+    PYTHONPATH=. python benchmarks/accumulator_ready_drain.py
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+
+from kafka.cluster import ClusterMetadata
+from kafka.producer.record_accumulator import RecordAccumulator
+from kafka.protocol.metadata import MetadataResponse
+from kafka.structs import TopicPartition
+
+
+def cluster_metadata(num_partitions, num_brokers):
+    cluster = ClusterMetadata()
+    brokers = [(i, 'localhost', 9092 + i, None) for i in range(num_brokers)]
+    partitions = [(0, p, p % num_brokers, [p % num_brokers],
+                   [p % num_brokers])
+                  for p in range(num_partitions)]
+    cluster.update_metadata(MetadataResponse[1](
+        brokers, -1, [(0, 'topic', False, partitions)]))
+    return cluster
+
+
+def complete(accumulator, batches_by_node):
+    for batches in batches_by_node.values():
+        for batch in batches:
+            batch.done(0)
+            accumulator.deallocate(batch)
+
+
+def run(args):
+    cluster = cluster_metadata(args.partitions, args.brokers)
+    accumulator = RecordAccumulator(message_version=2, batch_size=1024,
+                                    buffer_memory=args.partitions * 2048,
+                                    linger_ms=args.linger_ms)
+    tps = [TopicPartition('topic', p) for p in range(args.partitions)]
+    # Partitions that had data once are known to the accumulator
+    for tp in tps:
+        accumulator.append(tp, 0, None, b'x', 0)
+    complete(accumulator,
+             accumulator.drain(cluster, list(range(args.brokers)), 1 << 30))
+
+    iterations = 0
+    start = time.time()
+    while iterations < args.iterations:
+        for i in range(args.active_partitions):
+            tp = tps[(iterations * args.active_partitions + i) % len(tps)]
+            accumulator.append(tp, 0, None, b'x' * 100, 0)
+        ready_nodes, _, _ = accumulator.ready(cluster)
+        complete(accumulator, accumulator.drain(cluster, ready_nodes, 1048576))
+        iterations += 1
+    elapsed = time.time() - start
+    print('{0:.1f} us per ready() and drain() with {1} of {2} partitions'
+          ' active'.format(elapsed / iterations * 1e6, args.active_partitions,
+                           args.partitions))
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark RecordAccumulator.ready() and drain().')
+    parser.add_argument(
+        '--partitions', type=int, default=20000)
+    parser.add_argument(
+        '--active-partitions', type=int, default=10,
+        help='partitions appended to before each ready()')
+    parser.add_argument(
+        '--brokers', type=int, default=3)
+    parser.add_argument(
+        '--linger-ms', type=int, default=5)
+    parser.add_argument(
+        '--iterations', type=int, default=1000)
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
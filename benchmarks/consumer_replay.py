@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Replay a recorded wire capture through KafkaConsumer.
+
+Record production traffic by passing ``wire_capture=WireCapture(filename)``
+to a KafkaConsumer, then run this script against the file to measure the
+client-side cost of processing exactly those broker responses, without a
+network or a broker.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import logging
+import time
+
+from kafka import KafkaConsumer
+from kafka.capture import WireReplay
+
+logging.basicConfig(level=logging.ERROR)
+
+try:
+    process_time = time.process_time
+except AttributeError:  # python 2
+    process_time = time.clock
+
+
+def run(args):
+    props = {}
+    for prop in args.consumer_config:
+        k, v = prop.split('=')
+        try:
+            v = int(v)
+        except ValueError:
+            pass
+        if v == 'None':
+            v = None
+        props[k] = v
+    props.setdefault('consumer_timeout_ms', 1000)
+
+    replay = WireReplay(args.capture, speed=args.speed)
+    consumer = KafkaConsumer(*args.topics, transport=replay, **props)
+
+    records = 0
+    start_wall, start_cpu = time.time(), process_time()
+    for _ in consumer:
+        records += 1
+    # consumer_timeout_ms is idle time, not processing time
+    wall = time.time() - start_wall - props['consumer_timeout_ms'] / 1000.0
+    cpu = process_time() - start_cpu
+    consumer.close()
+    replay.close()
+
+    print('Consumed {0} records in {1:.3f}s ({2:.3f}s cpu)'.format(records, wall, cpu))
+    if records:
+        print('{0:.1f} records/sec, {1:.2f} us cpu/record'.format(
+            records / max(wall, 1e-9), cpu * 1000000 / records))
+    print('{0} recorded responses were not replayed'.format(replay.remaining()))
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark KafkaConsumer against a recorded wire capture.')
+    parser.add_argument(
+        'capture', type=str,
+        help='Capture file written by kafka.capture.WireCapture')
+    parser.add_argument(
+        'topics', type=str, nargs='+',
+        help='Topics the recorded consumer subscribed to')
+    parser.add_argument(
+        '--speed', type=float, default=None,
+        help='Replay recorded latencies divided by this factor;'
+             ' default is as fast as possible')
+    parser.add_argument(
+        '--consumer-config', type=str, nargs='+', default=(),
+        help='kafka consumer related configuaration properties like '
+             'group_id,api_version etc..')
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
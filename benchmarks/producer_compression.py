@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Compare producer throughput for a range of compression_workers settings.
+
+Records are produced to the in-process fake broker from test/fake_broker.py,
+so no Kafka cluster is needed; run from the repository root::
+
+    PYTHONPATH=. python benchmarks/producer_compression.py --workers 0 1 2 4
+
+Compression only runs in parallel on machines with more than one cpu.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import random
+import string
+import time
+
+from kafka import KafkaProducer
+from test.fake_broker import FakeKafkaBroker
+
+
+def random_values(count, size):
+    # Compressible, but not trivially so
+    alphabet = string.ascii_letters[:8]
+    return [''.join(random.choice(alphabet) for _ in range(size)).encode()
+            for _ in range(count)]
+
+
+def run(args):
+    values = random_values(100, args.record_size)
+    broker = FakeKafkaBroker(num_partitions=args.partitions).open()
+    try:
+        for workers in args.workers:
+            producer = KafkaProducer(
+                bootstrap_servers=broker.bootstrap_server(),
+                compression_type=args.compression_type,
+                compression_workers=workers,
+                batch_size=args.batch_size, linger_ms=5,
+                buffer_memory=256 * 1024 * 1024)
+            producer.send(args.topic, b'warmup').get()
+
+            start = time.time()
+            for i in range(args.num_records):
+                producer.send(args.topic, values[i % len(values)],
+                              partition=i % args.partitions)
+            producer.flush()
+            elapsed = time.time() - start
+            producer.close()
+
+            print('compression_workers={0}: {1:.0f} records/sec'
+                  ' ({2:.2f} MB/sec)'.format(
+                      workers, args.num_records / elapsed,
+                      args.num_records * args.record_size / elapsed / 1e6))
+    finally:
+        broker.close()
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark KafkaProducer compression_workers.')
+    parser.add_argument(
+        '--workers', type=int, nargs='+', default=[0, 1, 2, 4],
+        help='compression_workers settings to compare')
+    parser.add_argument(
+        '--compression-type', type=str, default='gzip')
+    parser.add_argument(
+        '--num-records', type=int, default=20000)
+    parser.add_argument(
+        '--record-size', type=int, default=10000)
+    parser.add_argument(
+        '--batch-size', type=int, default=1048576)
+    parser.add_argument(
+        '--partitions', type=int, default=8)
+    parser.add_argument(
+        '--topic', type=str, default='kafka-python-benchmark-test')
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Compare producer throughput of one KafkaProducer and of a
+KafkaProducerPool with several producer processes.
+
+Records are produced to the in-process fake broker from test/fake_broker.py,
+so no Kafka cluster is needed; run from the repository root::
+
+    PYTHONPATH=. python benchmarks/producer_pool.py
+
+The pool only helps with more than one core available, e.g. with
+--compression-type gzip.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+
+from kafka import KafkaProducer, KafkaProducerPool
+from test.fake_broker import FakeKafkaBroker
+
+
+def produce(producer, args):
+    value = b'x' * args.record_size
+    producer.send(args.topic, b'warmup').get()
+    start = time.time()
+    for i in range(args.num_records):
+        producer.send(args.topic, value, partition=i % args.partitions)
+    producer.flush()
+    elapsed = time.time() - start
+    producer.close()
+    return args.num_records / elapsed
+
+
+def run(args):
+    broker = FakeKafkaBroker(num_partitions=args.partitions).open()
+    configs = {'bootstrap_servers': broker.bootstrap_server(),
+               'compression_type': args.compression_type,
+               'batch_size': args.batch_size, 'linger_ms': args.linger_ms}
+    try:
+        print('KafkaProducer: {0:.0f} records/sec'.format(
+            produce(KafkaProducer(**configs), args)))
+        for processes in args.processes:
+            pool = KafkaProducerPool(producer_processes=processes, **configs)
+            print('KafkaProducerPool, {0} processes: {1:.0f} records/sec'.format(
+                processes, produce(pool, args)))
+    finally:
+        broker.close()
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark KafkaProducerPool.')
+    parser.add_argument(
+        '--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument(
+        '--num-records', type=int, default=100000)
+    parser.add_argument(
+        '--record-size', type=int, default=100)
+    parser.add_argument(
+        '--batch-size', type=int, default=16384)
+    parser.add_argument(
+        '--linger-ms', type=int, default=5)
+    parser.add_argument(
+        '--compression-type', type=str, default=None)
+    parser.add_argument(
+        '--partitions', type=int, default=8)
+    parser.add_argument(
+        '--topic', type=str, default='kafka-python-benchmark-test')
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
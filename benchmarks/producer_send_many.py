@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Compare producer throughput of KafkaProducer.send() in a loop, with and
+without record_futures, and KafkaProducer.send_many().
+
+Records are produced to the in-process fake broker from test/fake_broker.py,
+so no Kafka cluster is needed; run from the repository root::
+
+    PYTHONPATH=. python benchmarks/producer_send_many.py
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+
+from kafka import KafkaProducer
+from test.fake_broker import FakeKafkaBroker
+
+
+def send_loop(producer, topic, records):
+    for key, value in records:
+        producer.send(topic, value, key=key)
+
+
+def send_many(producer, topic, records):
+    producer.send_many(topic, records)
+
+
+def send_many_futures(producer, topic, records):
+    producer.send_many(topic, records, record_futures=True)
+
+
+def run(args):
+    records = [(b'key-%d' % i if args.keys else None, b'x' * args.record_size)
+               for i in range(args.chunk_size)]
+    broker = FakeKafkaBroker(num_partitions=args.partitions).open()
+    try:
+        runs = [('send_loop', send_loop, {}),
+                ('send_loop_no_futures', send_loop, {'record_futures': False}),
+                ('send_many', send_many, {}),
+                ('send_many_futures', send_many_futures, {})]
+        for name, func, configs in runs:
+            producer = KafkaProducer(
+                bootstrap_servers=broker.bootstrap_server(),
+                batch_size=args.batch_size, linger_ms=args.linger_ms,
+                buffer_memory=256 * 1024 * 1024, **configs)
+            producer.send_many(args.topic, [(None, b'warmup')]).get()
+
+            start = time.time()
+            for _ in range(args.num_records // args.chunk_size):
+                func(producer, args.topic, records)
+            producer.flush()
+            elapsed = time.time() - start
+            producer.close()
+
+            print('{0}: {1:.0f} records/sec'.format(
+                name, args.num_records / elapsed))
+    finally:
+        broker.close()
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark KafkaProducer.send_many().')
+    parser.add_argument(
+        '--num-records', type=int, default=200000)
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000,
+        help='records per send_many() call')
+    parser.add_argument(
+        '--record-size', type=int, default=100)
+    parser.add_argument(
+        '--keys', action='store_true',
+        help='send records with keys instead of None')
+    parser.add_argument(
+        '--batch-size', type=int, default=16384)
+    parser.add_argument(
+        '--linger-ms', type=int, default=5)
+    parser.add_argument(
+        '--partitions', type=int, default=8)
+    parser.add_argument(
+        '--topic', type=str, default='kafka-python-benchmark-test')
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Compare produce requests and throughput for keyless records with the
+random, sticky and adaptive modes of DefaultPartitioner.
+
+Records are produced to the in-process fake broker from test/fake_broker.py,
+so no Kafka cluster is needed; run from the repository root::
+
+    PYTHONPATH=. python benchmarks/producer_sticky_partitioner.py
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+
+from kafka import KafkaProducer
+from kafka.partitioner import DefaultPartitioner
+from kafka.protocol.produce import ProduceRequest
+from test.fake_broker import FakeKafkaBroker
+
+
+def run(args):
+    value = b'x' * args.record_size
+    modes = [('random', {}), ('sticky', {'sticky': True}),
+             ('adaptive', {'adaptive': True})]
+    for mode, kwargs in modes:
+        broker = FakeKafkaBroker(num_partitions=args.partitions).open()
+        try:
+            producer = KafkaProducer(
+                bootstrap_servers=broker.bootstrap_server(),
+                partitioner=DefaultPartitioner(**kwargs),
+                compression_type=args.compression_type,
+                batch_size=args.batch_size, linger_ms=args.linger_ms)
+            producer.send(args.topic, b'warmup').get()
+            requests = broker.request_counts[ProduceRequest[0].API_KEY]
+
+            start = time.time()
+            for _ in range(args.num_records):
+                producer.send(args.topic, value)
+            producer.flush()
+            elapsed = time.time() - start
+            producer.close()
+
+            requests = broker.request_counts[ProduceRequest[0].API_KEY] - requests
+            batches = sum(len(broker.partition_log(args.topic, p)._batches)
+                          for p in range(args.partitions)) - 1
+            print('{0}: {1:.0f} records/sec, {2} produce requests,'
+                  ' {3} batches ({4:.1f} records/batch)'.format(
+                      mode, args.num_records / elapsed, requests, batches,
+                      args.num_records / float(batches)))
+        finally:
+            broker.close()
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark DefaultPartitioner sticky modes.')
+    parser.add_argument(
+        '--num-records', type=int, default=100000)
+    parser.add_argument(
+        '--record-size', type=int, default=100)
+    parser.add_argument(
+        '--batch-size', type=int, default=16384)
+    parser.add_argument(
+        '--linger-ms', type=int, default=5)
+    parser.add_argument(
+        '--compression-type', type=str, default=None)
+    parser.add_argument(
+        '--partitions', type=int, default=64)
+    parser.add_argument(
+        '--topic', type=str, default='kafka-python-benchmark-test')
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
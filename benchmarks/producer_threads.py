@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Measure KafkaProducer.send() throughput with many application threads
+producing to a hot topic.
+
+Records are produced to the in-process fake broker from test/fake_broker.py,
+so no Kafka cluster is needed; run from the repository root::
+
+    PYTHONPATH=. python benchmarks/producer_threads.py
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import threading
+import time
+
+from kafka import KafkaProducer
+from test.fake_broker import FakeKafkaBroker
+
+
+def run(args):
+    broker = FakeKafkaBroker(num_partitions=args.partitions).open()
+    try:
+        for num_threads in args.threads:
+            producer = KafkaProducer(
+                bootstrap_servers=broker.bootstrap_server(),
+                batch_size=args.batch_size, linger_ms=args.linger_ms,
+                record_futures=False, buffer_memory=256 * 1024 * 1024)
+            producer.send(args.topic, b'warmup')
+            producer.flush()
+            value = b'x' * args.record_size
+            per_thread = args.num_records // num_threads
+
+            def produce(offset):
+                for i in range(per_thread):
+                    producer.send(args.topic, value,
+                                  partition=(offset + i) % args.partitions)
+
+            threads = [threading.Thread(target=produce, args=(i,))
+                       for i in range(num_threads)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            producer.flush()
+            elapsed = time.time() - start
+            producer.close()
+            print('{0} threads: {1:.0f} records/sec'.format(
+                num_threads, per_thread * num_threads / elapsed))
+    finally:
+        broker.close()
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark KafkaProducer.send() from many threads.')
+    parser.add_argument(
+        '--threads', type=int, nargs='+', default=[1, 4, 32])
+    parser.add_argument(
+        '--num-records', type=int, default=100000)
+    parser.add_argument(
+        '--record-size', type=int, default=100)
+    parser.add_argument(
+        '--batch-size', type=int, default=16384)
+    parser.add_argument(
+        '--linger-ms', type=int, default=5)
+    parser.add_argument(
+        '--partitions', type=int, default=4)
+    parser.add_argument(
+        '--topic', type=str, default='kafka-python-benchmark-test')
+    return parser
+
+
+if __name__ == '__main__':
+    run(get_args_parser().parse_args())
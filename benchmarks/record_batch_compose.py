@@ -45,7 +45,7 @@ def finalize(results):
     print(hash_val, file=open(os.devnull, "w"))
 
 
-def func(loops, magic):
+def func(loops, magic, compression_type=0):
     # Jit can optimize out the whole function if the result is the same each
     # time, so we need some randomized input data )
     precomputed_samples = prepare()
@@ -55,7 +55,8 @@ def func(loops, magic):
     t0 = perf.perf_counter()
     for _ in range(loops):
         batch = MemoryRecordsBuilder(
-            magic, batch_size=DEFAULT_BATCH_SIZE, compression_type=0)
+            magic, batch_size=DEFAULT_BATCH_SIZE,
+            compression_type=compression_type)
         for _ in range(MESSAGES_PER_BATCH):
             key, value, timestamp = next(precomputed_samples)
             size = batch.append(
@@ -75,3 +76,7 @@ runner = perf.Runner()
 runner.bench_time_func('batch_append_v0', func, 0)
 runner.bench_time_func('batch_append_v1', func, 1)
 runner.bench_time_func('batch_append_v2', func, 2)
+for name, compression_type in [('gzip', 1), ('snappy', 2), ('lz4', 3),
+                               ('zstd', 4)]:
+    runner.bench_time_func(
+        'batch_append_v2_' + name, func, 2, compression_type)
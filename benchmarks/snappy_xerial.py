@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+import hashlib
+import os
+import random
+
+import perf
+
+from kafka import codec
+
+
+PAYLOAD_SIZES = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+
+
+def prepare(size):
+    # Record batches compress somewhat, so mix random and repeated data
+    words = [os.urandom(random.randint(4, 12)) for _ in range(256)]
+    payload = bytearray()
+    while len(payload) < size:
+        payload += random.choice(words)
+    return bytes(payload[:size])
+
+
+def finalize(results):
+    # Just some strange code to make sure PyPy does execute the main code
+    # properly, without optimizing it away
+    hash_val = hashlib.md5()
+    for buf in results:
+        hash_val.update(buf)
+    print(hash_val, file=open(os.devnull, "w"))
+
+
+def func(loops, size, decode, buffer_api):
+    payload = prepare(size)
+    if decode:
+        payload = codec.snappy_encode(payload)
+    op = codec.snappy_decode_buffer if decode else codec.snappy_encode
+    results = []
+
+    # Compare with the block by block fallback used without cramjam
+    cramjam_snappy = codec.cramjam_snappy
+    if not buffer_api:
+        codec.cramjam_snappy = None
+    try:
+        t0 = perf.perf_counter()
+        for _ in range(loops):
+            results.append(op(payload))
+        res = perf.perf_counter() - t0
+    finally:
+        codec.cramjam_snappy = cramjam_snappy
+
+    finalize(results)
+
+    return res
+
+
+runner = perf.Runner()
+for size in PAYLOAD_SIZES:
+    for decode in (False, True):
+        for buffer_api in (True, False):
+            if buffer_api and codec.cramjam_snappy is None:
+                continue
+            runner.bench_time_func(
+                'snappy_xerial_{0}_{1}kb{2}'.format(
+                    'decode' if decode else 'encode', size // 1024,
+                    '' if buffer_api else '_fallback'),
+                func, size, decode, buffer_api)
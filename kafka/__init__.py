@@ -20,7 +20,7 @@ logging.getLogger(__name__).addHandler(NullHandler())
 
 from kafka.consumer import KafkaConsumer
 from kafka.consumer.subscription_state import ConsumerRebalanceListener
-from kafka.producer import KafkaProducer
+from kafka.producer import KafkaProducer, KafkaProducerPool
 from kafka.conn import BrokerConnection
 from kafka.protocol import (
     create_message, create_gzip_message, create_snappy_message)
@@ -46,8 +46,8 @@ class KafkaClient(SimpleClient):
 
 
 __all__ = [
-    'KafkaConsumer', 'KafkaProducer', 'KafkaClient', 'BrokerConnection',
-    'SimpleClient', 'SimpleProducer', 'KeyedProducer',
+    'KafkaConsumer', 'KafkaProducer', 'KafkaProducerPool', 'KafkaClient',
+    'BrokerConnection', 'SimpleClient', 'SimpleProducer', 'KeyedProducer',
     'RoundRobinPartitioner', 'HashedPartitioner',
     'create_message', 'create_gzip_message', 'create_snappy_message',
     'SimpleConsumer', 'MultiProcessConsumer',
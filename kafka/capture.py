@@ -0,0 +1,378 @@
+"""Wire-traffic capture and replay.
+
+A :class:`WireCapture` passed to a client as ``wire_capture`` records every
+request frame a BrokerConnection sends together with the matching response
+frame and the send / receive timestamps. A :class:`WireReplay` passed as
+``transport`` replaces the broker sockets with in-process socket pairs that
+answer each request with the recorded response, either with the recorded
+latency or as fast as possible. No network access or broker is needed to
+replay, which makes it possible to profile client-side processing (Fetcher,
+ConsumerCoordinator, ...) against real production traffic.
+
+Replay matches requests to recorded responses by node id, api key and api
+version, preferring the oldest recorded request with identical content and
+falling back to recorded order. Correlation ids are rewritten to match the
+replaying client. Metadata, ApiVersions and FindCoordinator requests may be
+answered from any node's recording. Replay requires security_protocol
+PLAINTEXT; SASL and SSL handshakes are not captured.
+"""
+from __future__ import absolute_import
+
+import collections
+import heapq
+import logging
+import socket
+import struct
+import threading
+import time
+
+from kafka.protocol.struct import Struct
+from kafka.protocol.types import Bytes, Int16, Int64, Schema, String
+from kafka.transport import Transport
+from kafka.vendor import six
+# Although this looks unused, it actually monkey-patches socket.socketpair()
+# and should be left in as long as we're using socket.socketpair() in this file
+from kafka.vendor import socketpair
+
+log = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b'KPWC\x00\x01'
+
+
+class CapturedExchange(Struct):
+    """A request frame and its response frame, as seen on the wire.
+
+    Frames include the 4-byte size prefix. response is None for requests
+    that do not expect a response (i.e. produce with acks=0).
+    """
+    SCHEMA = Schema(
+        ('node_id', String('utf-8')),
+        ('api_key', Int16),
+        ('api_version', Int16),
+        ('sent_us', Int64),
+        ('received_us', Int64),
+        ('request', Bytes),
+        ('response', Bytes)
+    )
+
+
+def _split_frames(buf):
+    """Remove and return all complete size-prefixed frames from buf."""
+    frames = []
+    while len(buf) >= 4:
+        size, = struct.unpack_from('>i', buf)
+        if len(buf) < 4 + size:
+            break
+        frames.append(bytes(buf[:4 + size]))
+        del buf[:4 + size]
+    return frames
+
+
+def _request_header(frame):
+    """Return (api_key, api_version, correlation_id) of a request frame."""
+    return struct.unpack_from('>hhi', frame, 4)
+
+
+def read_capture(filename):
+    """Yield the CapturedExchange records stored in a capture file."""
+    with open(filename, 'rb') as f:
+        magic = f.read(len(CAPTURE_MAGIC))
+        if magic != CAPTURE_MAGIC:
+            raise ValueError('%s is not a kafka-python wire capture' % filename)
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            size, = struct.unpack('>i', header)
+            data = f.read(size)
+            if len(data) < size:
+                log.warning('Truncated exchange at end of %s', filename)
+                break
+            yield CapturedExchange.decode(data)
+
+
+class WireCapture(object):
+    """Record request / response frames of one or more connections to a file.
+
+    The same instance may be shared by all connections of a client; it is
+    thread-safe.
+
+    Arguments:
+        filename (str): file to write. Existing content is replaced.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'wb')
+        self._file.write(CAPTURE_MAGIC)
+        self._lock = threading.Lock()
+        self._buffers = collections.defaultdict(bytearray)
+        self._in_flight = {}  # (node_id, correlation_id) -> (frame, sent_at)
+
+    def record_sent(self, node_id, data, sent_at, expect_response=True):
+        """Record request bytes written to a connection."""
+        node_id = str(node_id)
+        with self._lock:
+            for frame in _split_frames(bytearray(data)):
+                if not expect_response:
+                    self._write(node_id, frame, sent_at, None, sent_at)
+                    continue
+                correlation_id = _request_header(frame)[2]
+                self._in_flight[(node_id, correlation_id)] = (frame, sent_at)
+
+    def record_received(self, node_id, data, received_at):
+        """Record bytes read from a connection; they may be partial frames."""
+        node_id = str(node_id)
+        with self._lock:
+            buf = self._buffers[node_id]
+            buf.extend(data)
+            for frame in _split_frames(buf):
+                correlation_id, = struct.unpack_from('>i', frame, 4)
+                request = self._in_flight.pop((node_id, correlation_id), None)
+                if request is None:
+                    log.warning('No captured request for node %s response %d',
+                                node_id, correlation_id)
+                    continue
+                self._write(node_id, request[0], request[1], frame, received_at)
+
+    def reset(self, node_id):
+        """Drop partial state for a connection that was closed."""
+        node_id = str(node_id)
+        with self._lock:
+            self._buffers.pop(node_id, None)
+            for key in [key for key in self._in_flight if key[0] == node_id]:
+                del self._in_flight[key]
+
+    def _write(self, node_id, request, sent_at, response, received_at):
+        if self._file is None:
+            return
+        api_key, api_version, _ = _request_header(request)
+        exchange = CapturedExchange(
+            node_id, api_key, api_version,
+            int(sent_at * 1000000), int(received_at * 1000000),
+            request, response)
+        data = exchange.encode()
+        self._file.write(struct.pack('>i', len(data)) + data)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _ExchangeQueue(object):
+    """Recorded exchanges of one (node_id, api_key, api_version).
+
+    Exchanges are indexed by request content, and a cursor tracks the oldest
+    exchange not yet replayed, so pop() does not scan the recording.
+    """
+    def __init__(self):
+        self._exchanges = []
+        self._replayed = []
+        self._by_request = collections.defaultdict(collections.deque)
+        self._cursor = 0
+        self.remaining = 0
+
+    @staticmethod
+    def _content(request):
+        # Skip size, api key, api version and correlation id
+        return request[12:]
+
+    def append(self, exchange):
+        self._by_request[self._content(exchange.request)].append(
+            len(self._exchanges))
+        self._exchanges.append(exchange)
+        self._replayed.append(False)
+        self.remaining += 1
+
+    def pop(self, request):
+        """Return the oldest exchange with request's content, else the
+        oldest exchange, or None if all were replayed."""
+        if not self.remaining:
+            return None
+        content = self._content(request)
+        matches = self._by_request.get(content)
+        while matches and self._replayed[matches[0]]:
+            matches.popleft()
+        if matches:
+            i = matches.popleft()
+        else:
+            while self._replayed[self._cursor]:
+                self._cursor += 1
+            i = self._cursor
+        if matches is not None and not matches:
+            del self._by_request[content]
+        self._replayed[i] = True
+        self.remaining -= 1
+        exchange, self._exchanges[i] = self._exchanges[i], None
+        return exchange
+
+
+class WireReplay(Transport):
+    """Transport serving recorded responses to a client instead of brokers.
+
+    Arguments:
+        capture (str or iterable of CapturedExchange): capture filename, or
+            exchanges as returned by :func:`read_capture`.
+        speed (float, optional): replay recorded request latencies divided
+            by this factor (1.0 is recorded speed, 2.0 twice as fast). If
+            None, responses are delivered as fast as possible. Default: None
+    """
+    # Responses to these apis do not depend on which broker answered
+    NODE_AGNOSTIC_APIS = (3, 10, 18)  # Metadata, FindCoordinator, ApiVersions
+
+    def __init__(self, capture, speed=None):
+        if isinstance(capture, six.string_types):
+            capture = read_capture(capture)
+        self.speed = speed
+        self._queues = {}
+        # (api_key, api_version) -> queues of all nodes
+        self._api_queues = collections.defaultdict(list)
+        for exchange in capture:
+            if exchange.response is None:
+                continue
+            key = (exchange.node_id, exchange.api_key, exchange.api_version)
+            if key not in self._queues:
+                self._queues[key] = _ExchangeQueue()
+                self._api_queues[key[1:]].append(self._queues[key])
+            self._queues[key].append(exchange)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._deliveries = []
+        self._sequence = 0
+        self._thread = None
+        self._closed = False
+
+    def addresses(self, host, port, afi):
+        # Recorded hosts may not resolve (or exist) where we replay
+        return [(afi, (host, port))]
+
+    def socket(self, afi, sockaddr, node_id):
+        """Return a socket-like object serving node_id's recorded traffic."""
+        return ReplaySocket(self, str(node_id))
+
+    def configure(self, sock, socket_options):
+        pass
+
+    def connect(self, sock, sockaddr):
+        return 0
+
+    def remaining(self):
+        """Return the number of recorded responses not yet replayed."""
+        with self._lock:
+            return sum(queue.remaining for queue in self._queues.values())
+
+    def exhausted(self):
+        return self.remaining() == 0
+
+    def _next_exchange(self, node_id, api_key, api_version, request):
+        with self._lock:
+            queue = self._queues.get((node_id, api_key, api_version))
+            agnostic = api_key in self.NODE_AGNOSTIC_APIS
+            if (queue is None or not queue.remaining) and agnostic:
+                for queue in self._api_queues.get((api_key, api_version), ()):
+                    if queue.remaining:
+                        break
+            if queue is None:
+                return None
+            return queue.pop(request)
+
+    def _latency(self, exchange):
+        if not self.speed:
+            return 0
+        return max(exchange.received_us - exchange.sent_us, 0) / 1000000.0 / self.speed
+
+    def _deliver(self, peer, data, deliver_at):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='kafka-wire-replay')
+                self._thread.daemon = True
+                self._thread.start()
+            self._sequence += 1
+            heapq.heappush(self._deliveries, (deliver_at, self._sequence, peer, data))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._deliveries:
+                        wait = self._deliveries[0][0] - time.time()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                _, _, peer, data = heapq.heappop(self._deliveries)
+            try:
+                peer.sendall(data)
+            except socket.error:
+                pass  # client closed the connection
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._deliveries = []
+            self._cond.notify()
+
+
+class ReplaySocket(object):
+    """Socket stand-in used by BrokerConnection when replaying a capture.
+
+    Reads come from one end of a local socket pair, so the object can be
+    registered with selectors like a real socket. Request bytes written by
+    the client are answered by writing the recorded response to the other
+    end.
+    """
+    def __init__(self, replay, node_id):
+        self._replay = replay
+        self.node_id = node_id
+        self._sock, self._peer = socket.socketpair()
+        self._requests = bytearray()
+        self._last_deliver_at = 0
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv(self, nbytes):
+        return self._sock.recv(nbytes)
+
+    def recv_into(self, buf):
+        return self._sock.recv_into(buf)
+
+    def send(self, data):
+        self._requests.extend(data)
+        for frame in _split_frames(self._requests):
+            api_key, api_version, correlation_id = _request_header(frame)
+            exchange = self._replay._next_exchange(
+                self.node_id, api_key, api_version, frame)
+            if exchange is None:
+                log.debug('Replay has no recorded response for node %s'
+                          ' api %d v%d', self.node_id, api_key, api_version)
+                continue
+            response = bytearray(exchange.response)
+            struct.pack_into('>i', response, 4, correlation_id)
+            # Keep responses in request order on this connection
+            deliver_at = max(time.time() + self._replay._latency(exchange),
+                             self._last_deliver_at)
+            self._last_deliver_at = deliver_at
+            self._replay._deliver(self._peer, bytes(response), deliver_at)
+        return len(data)
+
+    def close(self):
+        self._sock.close()
+        self._peer.close()
@@ -3,6 +3,7 @@ from __future__ import absolute_import, division
 import collections
 import copy
 import functools
+import heapq
 import logging
 import random
 import threading
@@ -145,6 +146,13 @@ class KafkaClient(object):
             Default: None
         sasl_kerberos_service_name (str): Service name to include in GSSAPI
             sasl mechanism handshake. Default: 'kafka'
+        wire_capture (kafka.capture.WireCapture): Record raw request and
+            response frames of every broker connection, with timings, for
+            later replay. Default: None
+        transport (kafka.transport.Transport): How to reach brokers:
+            TcpTransport, UnixSocketTransport (e.g. to go through a local
+            proxy), InMemoryTransport, or kafka.capture.WireReplay to answer
+            requests from a recorded capture. Default: None (TcpTransport)
     """
 
     DEFAULT_CONFIG = {
@@ -179,6 +187,8 @@ class KafkaClient(object):
         'sasl_plain_username': None,
         'sasl_plain_password': None,
         'sasl_kerberos_service_name': 'kafka',
+        'wire_capture': None,
+        'transport': None,
     }
 
     def __init__(self, **configs):
@@ -188,6 +198,8 @@ class KafkaClient(object):
                 self.config[key] = configs[key]
 
         self.cluster = ClusterMetadata(**self.config)
+        self._node_loads = NodeLoadIndex()
+        self.cluster.add_listener(WeakMethod(self._update_node_loads))
         self._topics = set()  # empty set will fetch all topic metadata
         self._metadata_refresh_in_progress = False
         self._selector = self.config['selector']()
@@ -335,6 +347,8 @@ class KafkaClient(object):
                     log.warning("Node %s connection failed -- refreshing metadata", node_id)
                     self.cluster.request_update()
 
+            self._update_node_load(node_id)
+
     def _maybe_connect(self, node_id):
         """Idempotent non-blocking connection attempt to the given node id."""
         with self._lock:
@@ -459,6 +473,23 @@ class KafkaClient(object):
                 return 0
             return self._conns[node_id].connection_delay()
 
+    def throttle_delay(self, node_id):
+        """
+        Return the number of milliseconds to wait before sending data
+        (produce / fetch) requests to a node that reported a quota throttle
+        time in a recent response, or 0 if the node is not throttled.
+
+        Arguments:
+            node_id (int): The id of the node to check
+
+        Returns:
+            int: The number of milliseconds to wait.
+        """
+        with self._lock:
+            if node_id not in self._conns:
+                return 0
+            return self._conns[node_id].throttle_delay()
+
     def is_ready(self, node_id, metadata_priority=True):
         """Check whether a node is ready to send more requests.
 
@@ -509,7 +540,9 @@ class KafkaClient(object):
             if not self._maybe_connect(node_id):
                 return Future().failure(Errors.NodeNotReadyError(node_id))
 
-            return self._conns[node_id].send(request)
+            future = self._conns[node_id].send(request)
+            self._update_node_load(node_id)
+            return future
 
     def poll(self, timeout_ms=None, future=None):
         """Try to read and write to sockets.
@@ -521,7 +554,8 @@ class KafkaClient(object):
             timeout_ms (int, optional): maximum amount of time to wait (in ms)
                 for at least one response. Must be non-negative. The actual
                 timeout will be the minimum of timeout, request timeout and
-                metadata timeout. Default: request_timeout_ms
+                metadata timeout, and the end of any quota throttle time.
+                Default: request_timeout_ms
             future (Future, optional): if provided, blocks until future.is_done
 
         Returns:
@@ -551,10 +585,12 @@ class KafkaClient(object):
                     timeout = 0
                 else:
                     idle_connection_timeout_ms = self._idle_expiry_manager.next_check_ms()
+                    throttle_timeout_ms = self._throttle_timeout_ms()
                     timeout = min(
                         timeout_ms,
                         metadata_timeout_ms,
                         idle_connection_timeout_ms,
+                        throttle_timeout_ms,
                         self.config['request_timeout_ms'])
                     timeout = max(0, timeout / 1000)  # avoid negative timeouts
 
@@ -571,6 +607,15 @@ class KafkaClient(object):
 
         return responses
 
+    def _throttle_timeout_ms(self):
+        """Return milliseconds until the next throttled node accepts data."""
+        timeout = float('inf')
+        for conn in six.itervalues(self._conns):
+            delay = conn.throttle_delay()
+            if 0 < delay < timeout:
+                timeout = delay
+        return timeout
+
     def _poll(self, timeout):
         """Returns list of (response, future) tuples"""
         processed = set()
@@ -612,6 +657,7 @@ class KafkaClient(object):
 
             self._idle_expiry_manager.update(conn.node_id)
             self._pending_completion.extend(conn.recv())
+            self._update_node_load(conn.node_id)
 
         # Check for additional pending SSL bytes
         if self.config['security_protocol'] in ('SSL', 'SASL_SSL'):
@@ -619,6 +665,7 @@ class KafkaClient(object):
             for conn in self._conns.values():
                 if conn not in processed and conn.connected() and conn._sock.pending():
                     self._pending_completion.extend(conn.recv())
+                    self._update_node_load(conn.node_id)
 
         for conn in six.itervalues(self._conns):
             if conn.requests_timed_out():
@@ -665,6 +712,32 @@ class KafkaClient(object):
             responses.append(response)
         return responses
 
+    def _update_node_load(self, node_id):
+        """Re-index a broker after its connection state or in-flight count
+        may have changed. Return True if its position in the index changed."""
+        if node_id not in self._node_loads:
+            return False
+        conn = self._conns.get(node_id)
+        if conn is None:
+            return self._node_loads.update(node_id, False, 0)
+        blacked_out_until = 0
+        if conn.blacked_out():
+            blacked_out_until = time.time() + conn.connection_delay() / 1000.0
+        return self._node_loads.update(node_id, conn.connected(),
+                                       len(conn.in_flight_requests),
+                                       blacked_out_until)
+
+    def _update_node_loads(self, cluster):
+        """Metadata listener: track the current set of brokers."""
+        with self._lock:
+            brokers = set([broker.nodeId for broker in cluster.brokers()])
+            for node_id in self._node_loads.nodes() - brokers:
+                self._node_loads.remove(node_id)
+            for node_id in brokers:
+                if node_id not in self._node_loads:
+                    self._node_loads.update(node_id, False, 0)
+                    self._update_node_load(node_id)
+
     def least_loaded_node(self):
         """Choose the node with fewest outstanding requests, with fallbacks.
 
@@ -677,24 +750,12 @@ class KafkaClient(object):
             node_id or None if no suitable node was found
         """
         with self._lock:
-            nodes = [broker.nodeId for broker in self.cluster.brokers()]
-            random.shuffle(nodes)
-
-            inflight = float('inf')
-            found = None
-            for node_id in nodes:
-                conn = self._conns.get(node_id)
-                connected = conn is not None and conn.connected()
-                blacked_out = conn is not None and conn.blacked_out()
-                curr_inflight = len(conn.in_flight_requests) if conn is not None else 0
-                if connected and curr_inflight == 0:
-                    # if we find an established connection
-                    # with no in-flight requests, we can stop right away
-                    return node_id
-                elif not blacked_out and curr_inflight < inflight:
-                    # otherwise if this is the best we have found so far, record that
-                    inflight = curr_inflight
-                    found = node_id
+            while True:
+                found = self._node_loads.least_loaded(time.time())
+                # The index is updated on send, receive and state changes;
+                # re-check the pick in case a connection was used directly
+                if found is None or not self._update_node_load(found):
+                    break
 
             if found is not None:
                 return found
@@ -875,6 +936,79 @@ except ImportError:
     OrderedDict = dict
 
 
+class NodeLoadIndex(object):
+    """Brokers grouped by load, so the least loaded one is found without
+    scanning every broker.
+
+    Connected nodes without in-flight requests come first, then nodes by
+    in-flight request count (nodes that are not connected count as 0).
+    Nodes in reconnect backoff are left out until the backoff expires. Ties
+    are broken uniformly at random.
+    """
+    IDLE = -1
+
+    def __init__(self):
+        self._buckets = {}  # load -> list of node_ids
+        self._positions = {}  # node_id -> (load, index in bucket)
+        self._blacked_out = {}  # node_id -> (until, load)
+        self._expiry = []  # heap of (until, node_id)
+
+    def __contains__(self, node_id):
+        return node_id in self._positions or node_id in self._blacked_out
+
+    def nodes(self):
+        return set(self._positions) | set(self._blacked_out)
+
+    def update(self, node_id, connected, in_flight, blacked_out_until=0):
+        """Place node_id according to its load, return True if it moved."""
+        load = self.IDLE if connected and not in_flight else in_flight
+        if blacked_out_until:
+            entry = self._blacked_out.get(node_id)
+            if entry is not None and entry[1] == load:
+                return False
+            self.remove(node_id)
+            self._blacked_out[node_id] = (blacked_out_until, load)
+            heapq.heappush(self._expiry, (blacked_out_until, node_id))
+            return True
+        position = self._positions.get(node_id)
+        if position is not None and position[0] == load:
+            return False
+        self.remove(node_id)
+        self._insert(node_id, load)
+        return True
+
+    def remove(self, node_id):
+        self._blacked_out.pop(node_id, None)
+        if node_id not in self._positions:
+            return
+        load, i = self._positions.pop(node_id)
+        bucket = self._buckets[load]
+        last = bucket.pop()
+        if i < len(bucket):
+            bucket[i] = last
+            self._positions[last] = (load, i)
+        elif not bucket:
+            del self._buckets[load]
+
+    def _insert(self, node_id, load):
+        bucket = self._buckets.setdefault(load, [])
+        self._positions[node_id] = (load, len(bucket))
+        bucket.append(node_id)
+
+    def least_loaded(self, now):
+        """Return a random node among the least loaded, or None."""
+        while self._expiry and self._expiry[0][0] <= now:
+            until, node_id = heapq.heappop(self._expiry)
+            entry = self._blacked_out.get(node_id)
+            if entry is not None and entry[0] == until:
+                del self._blacked_out[node_id]
+                self._insert(node_id, entry[1])
+        if not self._buckets:
+            return None
+        # there are at most max_in_flight_requests_per_connection + 2 loads
+        return random.choice(self._buckets[min(self._buckets)])
+
+
 class IdleConnectionManager(object):
     def __init__(self, connections_max_idle_ms):
         if connections_max_idle_ms > 0:
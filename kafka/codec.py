@@ -4,6 +4,7 @@ import gzip
 import io
 import platform
 import struct
+import zlib
 
 from kafka.vendor import six
 from kafka.vendor.six.moves import xrange # pylint: disable=import-error
@@ -16,6 +17,14 @@ try:
 except ImportError:
     snappy = None
 
+try:
+    # python-snappy>=0.7 is built on cramjam, which can compress from and
+    # decompress into buffer slices without intermediate copies
+    from cramjam import snappy as cramjam_snappy
+    cramjam_snappy.compress_raw_into
+except (ImportError, AttributeError):
+    cramjam_snappy = None
+
 try:
     import lz4.frame as lz4
 
@@ -48,6 +57,11 @@ try:
 except ImportError:
     xxhash = None
 
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
 PYPY = bool(platform.python_implementation() == 'PyPy')
 
 def has_gzip():
@@ -58,6 +72,33 @@ def has_snappy():
     return snappy is not None
 
 
+def _xerial_header():
+    return b''.join(struct.pack('!' + fmt, dat)
+                    for fmt, dat in zip(_XERIAL_V1_FORMAT, _XERIAL_V1_HEADER))
+
+
+def _snappy_xerial_encode_into(data, blocksize, header=b''):
+    """Return header followed by the xerial blocks (length prefixed snappy
+    blocks) of data, compressed from data slices into one preallocated
+    bytearray."""
+    data = memoryview(data)
+    blocks = (len(data) + blocksize - 1) // blocksize
+    # Allocate for the worst case, see snappy::MaxCompressedLength. Pages
+    # that are not written to are never touched.
+    out = bytearray(len(header) +
+                    blocks * (4 + 32 + blocksize + blocksize // 6))
+    out[:len(header)] = header
+    pos = len(header)
+    with memoryview(out) as view:
+        for i in xrange(0, len(data), blocksize):
+            block_size = cramjam_snappy.compress_raw_into(
+                data[i:i + blocksize], view[pos + 4:])
+            struct.pack_into('!i', out, pos, block_size)
+            pos += 4 + block_size
+    del out[pos:]
+    return out
+
+
 def has_lz4():
     if lz4 is not None:
         return True
@@ -68,8 +109,12 @@ def has_lz4():
     return False
 
 
+def has_zstd():
+    return zstd is not None
+
+
 def gzip_encode(payload, compresslevel=None):
-    if not compresslevel:
+    if compresslevel is None:
         compresslevel = 9
 
     buf = io.BytesIO()
@@ -85,6 +130,30 @@ def gzip_encode(payload, compresslevel=None):
     return buf.getvalue()
 
 
+class GzipStreamCompressor(object):
+    """Incrementally gzip data, as gzip_encode would in one call.
+
+    Streaming compressors take data through compress() and return whatever
+    compressed output is ready. sync() flushes pending output at a block
+    boundary, without ending the stream; flush() ends the stream.
+    """
+    def __init__(self, compresslevel=None):
+        if compresslevel is None:
+            compresslevel = 9
+        # wbits > 16 writes a gzip header and trailer
+        self._compressor = zlib.compressobj(
+            compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def sync(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
 def gzip_decode(payload):
     buf = io.BytesIO(payload)
 
@@ -129,6 +198,10 @@ def snappy_encode(payload, xerial_compatible=True, xerial_blocksize=32*1024):
     if not xerial_compatible:
         return snappy.compress(payload)
 
+    if cramjam_snappy is not None:
+        return bytes(_snappy_xerial_encode_into(
+            payload, xerial_blocksize, _xerial_header()))
+
     out = io.BytesIO()
     for fmt, dat in zip(_XERIAL_V1_FORMAT, _XERIAL_V1_HEADER):
         out.write(struct.pack('!' + fmt, dat))
@@ -160,6 +233,53 @@ def snappy_encode(payload, xerial_compatible=True, xerial_blocksize=32*1024):
     return out.getvalue()
 
 
+class SnappyStreamCompressor(object):
+    """Incrementally snappy-compress data in xerial blocks, as snappy_encode
+    would in one call. See GzipStreamCompressor for the interface."""
+    def __init__(self, xerial_blocksize=32*1024):
+        if not has_snappy():
+            raise NotImplementedError("Snappy codec is not available")
+        self._blocksize = xerial_blocksize
+        self._pending = bytearray()
+        self._header = _xerial_header()
+
+    def _blocks(self, end):
+        pending = self._pending
+        if cramjam_snappy is not None:
+            size = len(pending)
+            if not end:
+                size -= size % self._blocksize
+            with memoryview(pending) as view:
+                out = _snappy_xerial_encode_into(
+                    view[:size], self._blocksize, self._header)
+            self._header = b''
+            del pending[:size]
+            return bytes(out)
+
+        out = [self._header]
+        self._header = b''
+        start = 0
+        while len(pending) - start >= self._blocksize or (end and start < len(pending)):
+            block = snappy.compress(bytes(pending[start:start + self._blocksize]))
+            out.append(struct.pack('!i', len(block)))
+            out.append(block)
+            start += self._blocksize
+        del pending[:start]
+        return b''.join(out)
+
+    def compress(self, data):
+        self._pending.extend(data)
+        if len(self._pending) < self._blocksize:
+            return b''
+        return self._blocks(False)
+
+    def sync(self):
+        return self._blocks(True)
+
+    def flush(self):
+        return self._blocks(True)
+
+
 def _detect_xerial_stream(payload):
     """Detects if the data given might have been encoded with the blocking mode
         of the xerial snappy library.
@@ -183,15 +303,52 @@ def _detect_xerial_stream(payload):
     """
 
     if len(payload) > 16:
-        header = struct.unpack('!' + _XERIAL_V1_FORMAT, bytes(payload)[:16])
+        header = struct.unpack('!' + _XERIAL_V1_FORMAT, bytes(payload[:16]))
         return header == _XERIAL_V1_HEADER
     return False
 
 
+def _snappy_decode_xerial_into(payload):
+    """Decode xerial blocks into a single preallocated bytearray."""
+    payload = memoryview(payload)
+    length = len(payload)
+    blocks = []
+    size = 0
+    cursor = 16
+    while cursor < length:
+        block_size, = struct.unpack_from('!i', payload, cursor)
+        block = payload[cursor + 4:cursor + 4 + block_size]
+        blocks.append(block)
+        size += cramjam_snappy.decompress_raw_len(block)
+        cursor += 4 + block_size
+
+    out = bytearray(size)
+    pos = 0
+    with memoryview(out) as view:
+        for block in blocks:
+            pos += cramjam_snappy.decompress_raw_into(block, view[pos:])
+    return out
+
+
 def snappy_decode(payload):
     if not has_snappy():
         raise NotImplementedError("Snappy codec is not available")
+    return bytes(snappy_decode_buffer(payload))
 
+
+def snappy_decode_buffer(payload):
+    """Like snappy_decode, but may return a bytearray to save a copy.
+
+    Meant for record batches, which read the result through a memoryview.
+    """
+    if not has_snappy():
+        raise NotImplementedError("Snappy codec is not available")
+
+    if cramjam_snappy is not None and _detect_xerial_stream(payload):
+        return _snappy_decode_xerial_into(payload)
+
+    if isinstance(payload, memoryview):
+        payload = payload.tobytes()
     if _detect_xerial_stream(payload):
         # TODO ? Should become a fileobj ?
         out = io.BytesIO()
@@ -214,15 +371,56 @@ def snappy_decode(payload):
 
 
 if lz4:
-    lz4_encode = _lz4_compress # pylint: disable-msg=no-member
+    def lz4_encode(payload, compresslevel=None):
+        if compresslevel is None:
+            return _lz4_compress(payload)
+        return _lz4_compress(payload, compression_level=compresslevel)
 elif lz4f:
-    lz4_encode = lz4f.compressFrame # pylint: disable-msg=no-member
+    def lz4_encode(payload, compresslevel=None):
+        # lz4f does not support compression levels
+        return lz4f.compressFrame(payload) # pylint: disable-msg=no-member
 elif lz4framed:
-    lz4_encode = lz4framed.compress # pylint: disable-msg=no-member
+    def lz4_encode(payload, compresslevel=None):
+        if compresslevel is None:
+            return lz4framed.compress(payload) # pylint: disable-msg=no-member
+        return lz4framed.compress(payload, level=compresslevel) # pylint: disable-msg=no-member
 else:
     lz4_encode = None
 
 
+def has_lz4_stream():
+    """lz4 frame streaming requires python-lz4 >= 1.0"""
+    return lz4 is not None and hasattr(lz4, 'compress_flush')
+
+
+class Lz4StreamCompressor(object):
+    """Incrementally lz4-compress data into one frame of independent blocks,
+    as lz4_encode would in one call. See GzipStreamCompressor for the
+    interface."""
+    def __init__(self, compresslevel=None):
+        if not has_lz4_stream():
+            raise NotImplementedError("Lz4 streaming is not available")
+        self._context = lz4.create_compression_context()
+        # Kafka does not support LZ4 dependent blocks
+        self._header = lz4.compress_begin(
+            self._context, block_linked=False, auto_flush=False,
+            compression_level=compresslevel or 0)
+
+    def _with_header(self, data):
+        if self._header:
+            data, self._header = self._header + data, b''
+        return data
+
+    def compress(self, data):
+        return self._with_header(lz4.compress_chunk(self._context, data))
+
+    def sync(self):
+        return self._with_header(lz4.compress_flush(self._context, end_frame=False))
+
+    def flush(self):
+        return self._with_header(lz4.compress_flush(self._context, end_frame=True))
+
+
 def lz4f_decode(payload):
     """Decode payload using interoperable LZ4 framing. Requires Kafka >= 0.10"""
     # pylint: disable-msg=no-member
@@ -247,10 +445,10 @@ else:
     lz4_decode = None
 
 
-def lz4_encode_old_kafka(payload):
+def lz4_encode_old_kafka(payload, compresslevel=None):
     """Encode payload for 0.8/0.9 brokers -- requires an incorrect header checksum."""
     assert xxhash is not None
-    data = lz4_encode(payload)
+    data = lz4_encode(payload, compresslevel=compresslevel)
     header_size = 7
     flg = data[4]
     if not isinstance(flg, int):
@@ -299,3 +497,43 @@ def lz4_decode_old_kafka(payload):
         payload[header_size:]
     ])
     return lz4_decode(munged_payload)
+
+
+def zstd_encode(payload, compresslevel=None):
+    if not zstd:
+        raise NotImplementedError("Zstd codec is not available")
+    if compresslevel is None:
+        compresslevel = 3
+    return zstd.ZstdCompressor(level=compresslevel).compress(payload)
+
+
+class ZstdStreamCompressor(object):
+    """Incrementally zstd-compress data into one frame, as zstd_encode would
+    in one call (but without the content size in the frame header). See
+    GzipStreamCompressor for the interface."""
+    def __init__(self, compresslevel=None):
+        if not zstd:
+            raise NotImplementedError("Zstd codec is not available")
+        if compresslevel is None:
+            compresslevel = 3
+        self._compressor = zstd.ZstdCompressor(level=compresslevel).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def sync(self):
+        return self._compressor.flush(zstd.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+def zstd_decode(payload):
+    if not zstd:
+        raise NotImplementedError("Zstd codec is not available")
+    try:
+        return zstd.ZstdDecompressor().decompress(payload)
+    except zstd.ZstdError:
+        # Frames written in streaming mode (i.e. by the java client) do not
+        # record the decompressed size, which decompress() requires
+        return zstd.ZstdDecompressor().decompressobj().decompress(payload)
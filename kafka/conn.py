@@ -26,9 +26,11 @@ from kafka.future import Future
 from kafka.metrics.stats import Avg, Count, Max, Rate
 from kafka.protocol.admin import SaslHandShakeRequest
 from kafka.protocol.commit import OffsetFetchRequest
+from kafka.protocol.fetch import FetchRequest
 from kafka.protocol.metadata import MetadataRequest
 from kafka.protocol.parser import KafkaProtocol
 from kafka.protocol.types import Int32, Int8
+from kafka.transport import AF_UNIX, TcpTransport
 from kafka.version import __version__
 
 
@@ -84,6 +86,8 @@ AFI_NAMES = {
     socket.AF_INET: "IPv4",
     socket.AF_INET6: "IPv6",
 }
+if AF_UNIX is not None:
+    AFI_NAMES[AF_UNIX] = "unix"
 
 
 class ConnectionStates(object):
@@ -176,6 +180,12 @@ class BrokerConnection(object):
             Default: None
         sasl_kerberos_service_name (str): Service name to include in GSSAPI
             sasl mechanism handshake. Default: 'kafka'
+        wire_capture (kafka.capture.WireCapture): Record raw request and
+            response frames, with timings, for later replay. Default: None
+        transport (kafka.transport.Transport): How to reach brokers:
+            TcpTransport, UnixSocketTransport (e.g. to go through a local
+            proxy), InMemoryTransport, or kafka.capture.WireReplay to answer
+            requests from a recorded capture. Default: None (TcpTransport)
     """
 
     DEFAULT_CONFIG = {
@@ -206,7 +216,9 @@ class BrokerConnection(object):
         'sasl_mechanism': 'PLAIN',
         'sasl_plain_username': None,
         'sasl_plain_password': None,
-        'sasl_kerberos_service_name': 'kafka'
+        'sasl_kerberos_service_name': 'kafka',
+        'wire_capture': None,
+        'transport': None,
     }
     SECURITY_PROTOCOLS = ('PLAINTEXT', 'SSL', 'SASL_PLAINTEXT', 'SASL_SSL')
     SASL_MECHANISMS = ('PLAIN', 'GSSAPI')
@@ -257,12 +269,15 @@ class BrokerConnection(object):
             api_version=self.config['api_version'])
         self.state = ConnectionStates.DISCONNECTED
         self._reset_reconnect_backoff()
+        self._transport = self.config['transport'] or TcpTransport()
         self._sock = None
+        self._recv_buffer = None
         self._ssl_context = None
         if self.config['ssl_context'] is not None:
             self._ssl_context = self.config['ssl_context']
         self._sasl_auth_future = None
         self.last_attempt = 0
+        self._throttle_until = 0
         self._gai = []
         self._sensors = None
         if self.config['metrics']:
@@ -271,7 +286,7 @@ class BrokerConnection(object):
                                                     self.node_id)
 
     def _dns_lookup(self):
-        self._gai = dns_lookup(self.host, self.port, self.afi)
+        self._gai = self._transport.addresses(self.host, self.port, self.afi)
         if not self._gai:
             log.error('DNS lookup failed for %s:%i (%s)',
                       self.host, self.port, self.afi)
@@ -282,8 +297,7 @@ class BrokerConnection(object):
         if not self._gai:
             if not self._dns_lookup():
                 return
-        afi, _, __, ___, sockaddr = self._gai.pop(0)
-        return (afi, sockaddr)
+        return self._gai.pop(0)
 
     def connect_blocking(self, timeout=float('inf')):
         if self.connected():
@@ -328,12 +342,10 @@ class BrokerConnection(object):
             else:
                 log.debug('%s: creating new socket', self)
                 self._sock_afi, self._sock_addr = next_lookup
-                self._sock = socket.socket(self._sock_afi, socket.SOCK_STREAM)
-
-            for option in self.config['socket_options']:
-                log.debug('%s: setting socket option %s', self, option)
-                self._sock.setsockopt(*option)
+                self._sock = self._transport.socket(
+                    self._sock_afi, self._sock_addr, self.node_id)
 
+            self._transport.configure(self._sock, self.config['socket_options'])
             self._sock.setblocking(False)
             self.state = ConnectionStates.CONNECTING
             if self.config['security_protocol'] in ('SSL', 'SASL_SSL'):
@@ -343,7 +355,8 @@ class BrokerConnection(object):
             if self.connecting():
                 self.config['state_change_callback'](self)
                 log.info('%s: connecting to %s:%d [%s %s]', self, self.host,
-                         self.port, self._sock_addr, AFI_NAMES[self._sock_afi])
+                         self.port, self._sock_addr,
+                         AFI_NAMES.get(self._sock_afi, self._sock_afi))
 
         if self.state is ConnectionStates.CONNECTING:
             # in non-blocking mode, use repeated calls to socket.connect_ex
@@ -351,7 +364,7 @@ class BrokerConnection(object):
             request_timeout = self.config['request_timeout_ms'] / 1000.0
             ret = None
             try:
-                ret = self._sock.connect_ex(self._sock_addr)
+                ret = self._transport.connect(self._sock, self._sock_addr)
             except socket.error as err:
                 ret = err.errno
 
@@ -513,9 +526,10 @@ class BrokerConnection(object):
     def _send_bytes_blocking(self, data):
         self._sock.settimeout(self.config['request_timeout_ms'] / 1000)
         total_sent = 0
+        view = memoryview(data)
         try:
             while total_sent < len(data):
-                sent_bytes = self._sock.send(data[total_sent:])
+                sent_bytes = self._transport.send(self._sock, view[total_sent:])
                 total_sent += sent_bytes
             if total_sent != len(data):
                 raise ConnectionError('Buffer overrun during socket send')
@@ -526,13 +540,15 @@ class BrokerConnection(object):
     def _recv_bytes_blocking(self, n):
         self._sock.settimeout(self.config['request_timeout_ms'] / 1000)
         try:
-            data = b''
-            while len(data) < n:
-                fragment = self._sock.recv(n - len(data))
+            data = bytearray(n)
+            view = memoryview(data)
+            received = 0
+            while received < n:
+                fragment = self._transport.recv_into(self._sock, view[received:])
                 if not fragment:
                     raise ConnectionError('Connection reset during recv')
-                data += fragment
-            return data
+                received += fragment
+            return bytes(data)
         finally:
             self._sock.settimeout(0.0)
 
@@ -652,6 +668,23 @@ class BrokerConnection(object):
         else:
             return float('inf')
 
+    def throttle_delay(self):
+        """
+        Return the number of milliseconds until the quota throttle time the
+        broker last reported has passed, or 0 if not throttled.
+        """
+        return max(self._throttle_until - time.time(), 0) * 1000
+
+    def _maybe_throttle(self, response, sent_time):
+        throttle_time_ms = getattr(response, 'throttle_time_ms', 0)
+        if throttle_time_ms > 0:
+            # Brokers before KIP-219 hold back the response for the throttle
+            # time, newer brokers mute the connection after responding.
+            # Counting from when the request was sent honors both without
+            # throttling twice.
+            self._throttle_until = max(self._throttle_until,
+                                       sent_time + throttle_time_ms / 1000.0)
+
     def connected(self):
         """Return True iff socket is connected."""
         return self.state is ConnectionStates.CONNECTED
@@ -708,6 +741,8 @@ class BrokerConnection(object):
         self.config['state_change_callback'](self)
         self._update_reconnect_backoff()
         self._close_socket()
+        if self.config['wire_capture'] is not None:
+            self.config['wire_capture'].reset(self.node_id)
         self.state = ConnectionStates.DISCONNECTED
         self._sasl_auth_future = None
         self._protocol = KafkaProtocol(
@@ -747,6 +782,9 @@ class BrokerConnection(object):
             total_bytes = self._send_bytes_blocking(data)
             if self._sensors:
                 self._sensors.bytes_sent.record(total_bytes)
+            if self.config['wire_capture'] is not None:
+                self.config['wire_capture'].record_sent(
+                    self.node_id, data, sent_time, request.expect_response())
         except ConnectionError as e:
             log.exception("Error sending %s to %s", request, self)
             error = Errors.KafkaConnectionError("%s: %s" % (self, e))
@@ -801,26 +839,31 @@ class BrokerConnection(object):
                 self._sensors.request_time.record(latency_ms)
 
             log.debug('%s Response %d (%s ms): %s', self, correlation_id, latency_ms, response)
+            self._maybe_throttle(response, timestamp)
             responses[i] = (response, future)
 
         return responses
 
     def _recv(self):
         """Take all available bytes from socket, return list of any responses from parser"""
-        recvd = []
-        while len(recvd) < self.config['sock_chunk_buffer_count']:
+        # Chunks are read into one reusable buffer and handed to the parser
+        # as memoryview slices, which copies them straight into the response
+        # buffers without intermediate bytes objects
+        if self._recv_buffer is None:
+            self._recv_buffer = memoryview(bytearray(self.config['sock_chunk_bytes']))
+        responses = []
+        total_bytes = 0
+        for _ in range(self.config['sock_chunk_buffer_count']):
             try:
-                data = self._sock.recv(self.config['sock_chunk_bytes'])
-                # We expect socket.recv to raise an exception if there are no
-                # bytes available to read from the socket in non-blocking mode.
-                # but if the socket is disconnected, we will get empty data
+                nbytes = self._transport.recv_into(self._sock, self._recv_buffer)
+                # We expect socket.recv_into to raise an exception if there are
+                # no bytes available to read from the socket in non-blocking
+                # mode. but if the socket is disconnected, we will get 0 bytes
                 # without an exception raised
-                if not data:
+                if not nbytes:
                     log.error('%s: socket disconnected', self)
                     self.close(error=Errors.KafkaConnectionError('socket disconnected'))
                     return []
-                else:
-                    recvd.append(data)
 
             except SSLWantReadError:
                 break
@@ -836,17 +879,20 @@ class BrokerConnection(object):
                     break
                 raise
 
-        recvd_data = b''.join(recvd)
-        if self._sensors:
-            self._sensors.bytes_received.record(len(recvd_data))
+            data = self._recv_buffer[:nbytes]
+            total_bytes += nbytes
+            if self.config['wire_capture'] is not None:
+                self.config['wire_capture'].record_received(
+                    self.node_id, data, time.time())
+            try:
+                responses.extend(self._protocol.receive_bytes(data))
+            except Errors.KafkaProtocolError as e:
+                self.close(e)
+                return []
 
-        try:
-            responses = self._protocol.receive_bytes(recvd_data)
-        except Errors.KafkaProtocolError as e:
-            self.close(e)
-            return []
-        else:
-            return [resp for (_, resp) in responses]  # drop correlation id
+        if self._sensors:
+            self._sensors.bytes_received.record(total_bytes)
+        return [resp for (_, resp) in responses]  # drop correlation id
 
     def requests_timed_out(self):
         if self.in_flight_requests:
@@ -874,6 +920,7 @@ class BrokerConnection(object):
         # in reverse order. As soon as we find one that works, return it
         test_cases = [
             # format (<broker version>, <needed struct>)
+            ((2, 1, 0), FetchRequest[10]),
             ((1, 0, 0), MetadataRequest[5]),
             ((0, 11, 0), MetadataRequest[4]),
             ((0, 10, 2), OffsetFetchRequest[2]),
@@ -34,7 +34,9 @@ ConsumerRecord = collections.namedtuple("ConsumerRecord",
 
 CompletedFetch = collections.namedtuple("CompletedFetch",
     ["topic_partition", "fetched_offset", "response_version",
-     "partition_data", "metric_aggregator"])
+     "partition_data", "metric_aggregator", "decoded"])
+# decoded: WorkerFuture of (records, valid_bytes) when decoded in background
+CompletedFetch.__new__.__defaults__ = (None,)
 
 
 class NoOffsetForPartitionError(Errors.KafkaError):
@@ -59,7 +61,8 @@ class Fetcher(six.Iterator):
         'iterator_refetch_records': 1,  # undocumented -- interface may change
         'metric_group_prefix': 'consumer',
         'api_version': (0, 8, 0),
-        'retry_backoff_ms': 100
+        'retry_backoff_ms': 100,
+        'decompression_pool': None
     }
 
     def __init__(self, client, subscriptions, metrics, **configs):
@@ -105,6 +108,10 @@ class Fetcher(six.Iterator):
                 actually published to the cluster. If you prefer to have the
                 fetcher automatically detect corrupt messages and skip them,
                 set this option to True. Default: False.
+            decompression_pool (WorkerPool): If set, completed fetches are
+                decompressed and decoded on these threads as soon as they
+                are received, instead of when they are returned by
+                fetched_records(). Default: None
         """
         self.config = copy.copy(self.DEFAULT_CONFIG)
         for key in self.config:
@@ -300,12 +307,16 @@ class Fetcher(six.Iterator):
         raise Errors.KafkaTimeoutError(
             "Failed to get offsets by timestamps in %s ms" % timeout_ms)
 
-    def fetched_records(self, max_records=None):
+    def fetched_records(self, max_records=None, timeout_ms=None):
         """Returns previously fetched records and updates consumed offsets.
 
         Arguments:
             max_records (int): Maximum number of records returned. Defaults
                 to max_poll_records configuration.
+            timeout_ms (int, optional): Maximum milliseconds to wait for
+                fetches still being decoded by decompression_pool. They and
+                the fetches after them are left for the next call.
+                Default: None (wait until decoded)
 
         Raises:
             OffsetOutOfRangeError: if no subscription offset_reset_strategy
@@ -328,12 +339,15 @@ class Fetcher(six.Iterator):
 
         drained = collections.defaultdict(list)
         records_remaining = max_records
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.time() + timeout_ms / 1000.0
 
         while records_remaining > 0:
             if not self._next_partition_records:
-                if not self._completed_fetches:
+                completion = self._next_completed_fetch(deadline)
+                if completion is None:
                     break
-                completion = self._completed_fetches.popleft()
                 self._next_partition_records = self._parse_fetched_data(completion)
             else:
                 records_remaining -= self._append(drained,
@@ -341,6 +355,20 @@ class Fetcher(six.Iterator):
                                                   records_remaining)
         return dict(drained), bool(self._completed_fetches)
 
+    def _next_completed_fetch(self, deadline=None):
+        """Pop the oldest completed fetch, or return None if there is none
+        or it is still being decoded at deadline (None waits for it)."""
+        if not self._completed_fetches:
+            return None
+        decoded = self._completed_fetches[0].decoded
+        if decoded is not None and not decoded.is_done:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+            if not decoded.wait(timeout):
+                return None
+        return self._completed_fetches.popleft()
+
     def _append(self, drained, part, max_records):
         if not part:
             return 0
@@ -392,7 +420,10 @@ class Fetcher(six.Iterator):
         while self._next_partition_records or self._completed_fetches:
 
             if not self._next_partition_records:
-                completion = self._completed_fetches.popleft()
+                # Do not block the iterator on a fetch still being decoded
+                completion = self._next_completed_fetch(time.time())
+                if completion is None:
+                    return
                 self._next_partition_records = self._parse_fetched_data(completion)
                 continue
 
@@ -443,11 +474,26 @@ class Fetcher(six.Iterator):
 
             self._next_partition_records = None
 
-    def _unpack_message_set(self, tp, records):
+    def _unpack_message_set(self, tp, records, position=None):
+        """Deserialize the records of a fetched message set.
+
+        If position is given, batches that end before it are skipped without
+        being decompressed or parsed, as are the records before it in the
+        batch that contains it.
+        """
         try:
+            if position is not None:
+                offsets = records.next_batch_offsets()
+                while offsets is not None and offsets[1] < position:
+                    log.debug("Skipping batch with offsets %s-%s (expecting"
+                              " %s)", offsets[0], offsets[1], position)
+                    records.skip_batch()
+                    offsets = records.next_batch_offsets()
             batch = records.next_batch()
             while batch is not None:
                 for record in batch:
+                    if position is not None and record.offset < position:
+                        continue
                     key_size = len(record.key) if record.key is not None else -1
                     value_size = len(record.value) if record.value is not None else -1
                     key = self._deserialize(
@@ -638,7 +684,8 @@ class Fetcher(six.Iterator):
     def _create_fetch_requests(self):
         """Create fetch requests for all assigned partitions, grouped by node.
 
-        FetchRequests skipped if no leader, or node has requests in flight
+        FetchRequests skipped if no leader, node has requests in flight, or
+        node is throttled by a quota
 
         Returns:
             dict: {node_id: FetchRequest, ...} (version depends on api_version)
@@ -657,6 +704,10 @@ class Fetcher(six.Iterator):
                           " Requesting metadata update", partition)
                 self._client.cluster.request_update()
 
+            elif self._client.throttle_delay(node_id) > 0:
+                log.log(0, "Skipping fetch for partition %s because node %s is throttled",
+                        partition, node_id)
+
             elif self._client.in_flight_request_count(node_id) == 0:
                 partition_info = (
                     partition.partition,
@@ -670,7 +721,9 @@ class Fetcher(six.Iterator):
                 log.log(0, "Skipping fetch for partition %s because there is an inflight request to node %s",
                         partition, node_id)
 
-        if self.config['api_version'] >= (0, 11, 0):
+        if self.config['api_version'] >= (2, 1, 0):
+            version = 10
+        elif self.config['api_version'] >= (0, 11, 0):
             version = 4
         elif self.config['api_version'] >= (0, 10, 1):
             version = 3
@@ -705,7 +758,7 @@ class Fetcher(six.Iterator):
                         self.config['fetch_min_bytes'],
                         self.config['fetch_max_bytes'],
                         partition_data)
-                else:
+                elif version == 4:
                     requests[node_id] = FetchRequest[version](
                         -1,  # replica_id
                         self.config['fetch_max_wait_ms'],
@@ -713,6 +766,24 @@ class Fetcher(six.Iterator):
                         self.config['fetch_max_bytes'],
                         self._isolation_level,
                         partition_data)
+                else:
+                    # Version 10 is needed to receive zstd compressed batches.
+                    # Incremental fetch sessions are not used: session_id 0
+                    # and epoch -1 request a full fetch every time
+                    partition_data = [
+                        (topic, [(partition, -1, offset, -1, max_bytes)
+                                 for partition, offset, max_bytes in partitions])
+                        for topic, partitions in partition_data]
+                    requests[node_id] = FetchRequest[version](
+                        -1,  # replica_id
+                        self.config['fetch_max_wait_ms'],
+                        self.config['fetch_min_bytes'],
+                        self.config['fetch_max_bytes'],
+                        self._isolation_level,
+                        0,  # session_id
+                        -1,  # session_epoch
+                        partition_data,
+                        [])  # forgotten_topics_data
         return requests
 
     def _handle_fetch_response(self, request, send_time, response):
@@ -720,7 +791,10 @@ class Fetcher(six.Iterator):
         fetch_offsets = {}
         for topic, partitions in request.topics:
             for partition_data in partitions:
-                partition, offset = partition_data[:2]
+                if request.API_VERSION >= 9:
+                    partition, _, offset = partition_data[:3]
+                else:
+                    partition, offset = partition_data[:2]
                 fetch_offsets[TopicPartition(topic, partition)] = offset
 
         partitions = set([TopicPartition(topic, partition_data[0])
@@ -738,7 +812,9 @@ class Fetcher(six.Iterator):
                     tp, fetch_offsets[tp],
                     response.API_VERSION,
                     partition_data[1:],
-                    metric_aggregator
+                    metric_aggregator,
+                    self._maybe_decode_async(
+                        tp, fetch_offsets[tp], partition_data)
                 )
                 self._completed_fetches.append(completed_fetch)
 
@@ -746,6 +822,24 @@ class Fetcher(six.Iterator):
             self._sensors.fetch_throttle_time_sensor.record(response.throttle_time_ms)
         self._sensors.fetch_latency.record((time.time() - send_time) * 1000)
 
+    def _maybe_decode_async(self, tp, fetch_offset, partition_data):
+        pool = self.config['decompression_pool']
+        if pool is None or partition_data[1] != Errors.NoError.errno:
+            return None
+        records = MemoryRecords(partition_data[-1])
+        if not records.has_next():
+            return None
+        # Records are decoded even if the fetch is discarded later on, i.e.
+        # after a seek. Per-partition order is kept by _completed_fetches.
+        # Let a consumer blocked in poll() return the decoded records. The
+        # callback is added before decoding starts so it cannot be missed.
+        return pool.submit(self._decode_records, tp, records, fetch_offset,
+                           callback=lambda _: self._client.wakeup())
+
+    def _decode_records(self, tp, records, fetch_offset):
+        unpacked = list(self._unpack_message_set(tp, records, fetch_offset))
+        return unpacked, records.valid_bytes()
+
     def _parse_fetched_data(self, completed_fetch):
         tp = completed_fetch.topic_partition
         fetch_offset = completed_fetch.fetched_offset
@@ -779,15 +873,23 @@ class Fetcher(six.Iterator):
                     return None
 
                 records = MemoryRecords(completed_fetch.partition_data[-1])
-                if records.has_next():
+                if completed_fetch.decoded is not None or records.has_next():
                     log.debug("Adding fetched record for partition %s with"
                               " offset %d to buffered record list", tp,
                               position)
-                    unpacked = list(self._unpack_message_set(tp, records))
+                    if completed_fetch.decoded is not None:
+                        # Done, see _next_completed_fetch()
+                        if completed_fetch.decoded.failed():
+                            raise completed_fetch.decoded.exception
+                        unpacked, num_bytes = completed_fetch.decoded.value
+                    else:
+                        unpacked = list(self._unpack_message_set(
+                            tp, records, fetch_offset))
+                        num_bytes = records.valid_bytes()
                     parsed_records = self.PartitionRecords(fetch_offset, tp, unpacked)
-                    last_offset = unpacked[-1].offset
-                    self._sensors.records_fetch_lag.record(highwater - last_offset)
-                    num_bytes = records.valid_bytes()
+                    if unpacked:
+                        last_offset = unpacked[-1].offset
+                        self._sensors.records_fetch_lag.record(highwater - last_offset)
                     records_count = len(unpacked)
                 elif records.size_in_bytes() > 0:
                     # we did not read a single message from a non-empty
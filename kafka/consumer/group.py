@@ -18,6 +18,7 @@ from kafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
 from kafka.metrics import MetricConfig, Metrics
 from kafka.protocol.offset import OffsetResetStrategy
 from kafka.structs import TopicPartition
+from kafka.util import WorkerPool
 from kafka.version import __version__
 
 log = logging.getLogger(__name__)
@@ -117,6 +118,14 @@ class KafkaConsumer(six.Iterator):
             consumed. This ensures no on-the-wire or on-disk corruption to
             the messages occurred. This check adds some overhead, so it may
             be disabled in cases seeking extreme performance. Default: True
+        decompression_workers (int): Number of background threads that
+            decompress and decode fetched records as soon as fetch responses
+            arrive, so that poll() mostly hands out records that are already
+            decoded. gzip, lz4 and zstd release the GIL while decompressing,
+            so partitions are decompressed in parallel. Records are still
+            returned in order within each partition. Note that
+            key_deserializer and value_deserializer are then called from the
+            worker threads. If 0, records are decoded by poll(). Default: 0
         metadata_max_age_ms (int): The period of time in milliseconds after
             which we force a refresh of metadata, even if we haven't seen any
             partition leadership changes to proactively discover any new
@@ -240,6 +249,13 @@ class KafkaConsumer(six.Iterator):
             Default: None
         sasl_kerberos_service_name (str): Service name to include in GSSAPI
             sasl mechanism handshake. Default: 'kafka'
+        wire_capture (kafka.capture.WireCapture): Record raw request and
+            response frames of every broker connection, with timings, for
+            later replay. Default: None
+        transport (kafka.transport.Transport): How to reach brokers:
+            TcpTransport, UnixSocketTransport (e.g. to go through a local
+            proxy), InMemoryTransport, or kafka.capture.WireReplay to answer
+            requests from a recorded capture. Default: None (TcpTransport)
 
     Note:
         Configuration parameters are described in more detail at
@@ -265,6 +281,7 @@ class KafkaConsumer(six.Iterator):
         'auto_commit_interval_ms': 5000,
         'default_offset_commit_callback': lambda offsets, response: True,
         'check_crcs': True,
+        'decompression_workers': 0,
         'metadata_max_age_ms': 5 * 60 * 1000,
         'partition_assignment_strategy': (RangePartitionAssignor, RoundRobinPartitionAssignor),
         'max_poll_records': 500,
@@ -298,7 +315,9 @@ class KafkaConsumer(six.Iterator):
         'sasl_mechanism': None,
         'sasl_plain_username': None,
         'sasl_plain_password': None,
-        'sasl_kerberos_service_name': 'kafka'
+        'sasl_kerberos_service_name': 'kafka',
+        'wire_capture': None,
+        'transport': None,
     }
     DEFAULT_SESSION_TIMEOUT_MS_0_9 = 30000
 
@@ -368,8 +387,14 @@ class KafkaConsumer(six.Iterator):
                     (self.config['request_timeout_ms'], self.config['session_timeout_ms']))
 
         self._subscription = SubscriptionState(self.config['auto_offset_reset'])
+        self._decompression_pool = None
+        if self.config['decompression_workers']:
+            self._decompression_pool = WorkerPool(
+                self.config['decompression_workers'],
+                name=self.config['client_id'] + '-decompression')
         self._fetcher = Fetcher(
-            self._client, self._subscription, self._metrics, **self.config)
+            self._client, self._subscription, self._metrics,
+            decompression_pool=self._decompression_pool, **self.config)
         self._coordinator = ConsumerCoordinator(
             self._client, self._subscription, self._metrics,
             assignors=self.config['partition_assignment_strategy'],
@@ -441,6 +466,8 @@ class KafkaConsumer(six.Iterator):
         self._coordinator.close(autocommit=autocommit)
         self._metrics.close()
         self._client.close()
+        if self._decompression_pool is not None:
+            self._decompression_pool.close()
         try:
             self.config['key_deserializer'].close()
         except AttributeError:
@@ -635,7 +662,8 @@ class KafkaConsumer(six.Iterator):
 
         # If data is available already, e.g. from a previous network client
         # poll() call to commit, then just return it immediately
-        records, partial = self._fetcher.fetched_records(max_records)
+        records, partial = self._fetcher.fetched_records(max_records,
+                                                         timeout_ms=0)
         if records:
             # Before returning the fetched records, we can send off the
             # next round of fetches and avoid block waiting for their
@@ -649,13 +677,17 @@ class KafkaConsumer(six.Iterator):
         self._fetcher.send_fetches()
 
         timeout_ms = min(timeout_ms, self._coordinator.time_to_next_poll() * 1000)
+        start = time.time()
         self._client.poll(timeout_ms=timeout_ms)
         # after the long poll, we should check whether the group needs to rebalance
         # prior to returning data so that the group can stabilize faster
         if self._coordinator.need_rejoin():
             return {}
 
-        records, _ = self._fetcher.fetched_records(max_records)
+        # Wait for records still being decoded up to the poll timeout
+        remaining_ms = max(timeout_ms - (time.time() - start) * 1000, 0)
+        records, _ = self._fetcher.fetched_records(max_records,
+                                                   timeout_ms=remaining_ms)
         return records
 
     def position(self, partition):
@@ -437,6 +437,13 @@ class PolicyViolationError(BrokerResponseError):
     description = 'Request parameters do not satisfy the configured policy.'
 
 
+class UnsupportedCompressionTypeError(BrokerResponseError):
+    errno = 76
+    message = 'UNSUPPORTED_COMPRESSION_TYPE'
+    description = ('The requesting client does not support the compression'
+                   ' type of given partition.')
+
+
 class KafkaUnavailableError(KafkaError):
     pass
 
@@ -445,6 +452,11 @@ class KafkaTimeoutError(KafkaError):
     pass
 
 
+class BufferExhaustedError(KafkaTimeoutError):
+    """The producer ran out of buffer memory for records."""
+    pass
+
+
 class FailedPayloadsError(KafkaError):
     def __init__(self, payload, *args):
         super(FailedPayloadsError, self).__init__(*args)
@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 
+import bisect
 import random
+import threading
 
 from kafka.partitioner.hashed import murmur2
 
@@ -11,17 +13,46 @@ class DefaultPartitioner(object):
     Hashes key to partition using murmur2 hashing (from java client)
     If key is None, selects partition randomly from available,
     or from all partitions if none are currently available
+
+    In sticky mode (KIP-480), records with a None key of the same topic
+    stick to one randomly chosen partition until KafkaProducer calls
+    on_new_batch() because the current batch of that partition is full or
+    already sent. This produces fewer, larger batches than choosing a
+    partition for every record.
+
+    In adaptive mode (KIP-794), the next sticky partition is chosen with a
+    probability that decreases with the bytes already queued for it in the
+    producer, and partitions whose leader is not ready are skipped, so
+    less data goes to partitions on slow or overloaded brokers.
+
+    Keyword Arguments:
+        sticky (bool): stick to one partition per topic for records with a
+            None key. Default: False.
+        adaptive (bool): choose the next sticky partition by the partition
+            load passed to on_new_batch(). Implies sticky. Default: False.
     """
-    @classmethod
-    def __call__(cls, key, all_partitions, available):
+    def __init__(self, sticky=False, adaptive=False):
+        self.sticky = sticky or adaptive
+        self.adaptive = adaptive
+        self._sticky_partitions = {}  # topic -> partition
+        self._lock = threading.Lock()
+
+    def __call__(self, key, all_partitions, available, topic=None):
         """
         Get the partition corresponding to key
         :param key: partitioning key
         :param all_partitions: list of all partitions sorted by partition ID
         :param available: list of available partitions in no particular order
+        :param topic: topic of the record, used to choose sticky partitions
         :return: one of the values from all_partitions or available
         """
         if key is None:
+            if self.sticky and topic is not None:
+                partition = self._sticky_partitions.get(topic)
+                if partition is None:
+                    partition = self._next_partition(
+                        topic, all_partitions, available, None)
+                return partition
             if available:
                 return random.choice(available)
             return random.choice(all_partitions)
@@ -30,3 +61,50 @@ class DefaultPartitioner(object):
         idx &= 0x7fffffff
         idx %= len(all_partitions)
         return all_partitions[idx]
+
+    def on_new_batch(self, topic, all_partitions, available, prev_partition,
+                     partition_load=None):
+        """Switch the sticky partition of topic away from prev_partition.
+
+        Called by KafkaProducer when a record with a None key would start a
+        new batch on prev_partition, before partitioning it again.
+
+        :param partition_load: {partition: queued bytes} for partitions
+            whose leader is ready, passed by KafkaProducer in adaptive mode
+        """
+        if self.sticky:
+            self._next_partition(topic, all_partitions, available,
+                                 prev_partition, partition_load)
+
+    def _next_partition(self, topic, all_partitions, available, prev_partition,
+                        partition_load=None):
+        with self._lock:
+            old_partition = self._sticky_partitions.get(topic)
+            # Another thread may have switched already
+            if old_partition is not None and old_partition != prev_partition:
+                return old_partition
+            if self.adaptive and partition_load:
+                partition = self._weighted_choice(partition_load)
+            elif not available:
+                partition = random.choice(all_partitions)
+            elif len(available) == 1:
+                partition = available[0]
+            else:
+                partition = old_partition
+                while partition == old_partition:
+                    partition = random.choice(available)
+            self._sticky_partitions[topic] = partition
+            return partition
+
+    @staticmethod
+    def _weighted_choice(partition_load):
+        # Weigh partitions by how much less they have queued than the
+        # most loaded one, which still has a small chance of being chosen
+        max_load = max(partition_load.values())
+        partitions = sorted(partition_load)
+        cumulative = []
+        total = 0
+        for partition in partitions:
+            total += max_load + 1 - partition_load[partition]
+            cumulative.append(total)
+        return partitions[bisect.bisect_right(cumulative, random.randrange(total))]
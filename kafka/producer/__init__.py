@@ -1,10 +1,11 @@
 from __future__ import absolute_import
 
 from kafka.producer.kafka import KafkaProducer
+from kafka.producer.pool import KafkaProducerPool
 from kafka.producer.simple import SimpleProducer
 from kafka.producer.keyed import KeyedProducer
 
 __all__ = [
-    'KafkaProducer',
+    'KafkaProducer', 'KafkaProducerPool',
     'SimpleProducer', 'KeyedProducer' # deprecated
 ]
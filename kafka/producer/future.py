@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import collections
 import threading
+import time
 
 from kafka import errors as Errors
 from kafka.future import Future
@@ -27,6 +28,11 @@ class FutureProduceResult(Future):
         # wait() on python2.6 returns None instead of the flag value
         return self._latch.wait(timeout) or self._latch.is_set()
 
+    def release(self):
+        """Wake up waiters without completing the result, after the records
+        of the batch moved to other batches."""
+        self._latch.set()
+
 
 class FutureRecordMetadata(Future):
     def __init__(self, produce_future, relative_offset, timestamp_ms, checksum, serialized_key_size, serialized_value_size):
@@ -37,6 +43,14 @@ class FutureRecordMetadata(Future):
         produce_future.add_callback(self._produce_success)
         produce_future.add_errback(self.failure)
 
+    def rebind(self, produce_future, relative_offset):
+        """Complete with produce_future instead, i.e. when the record was
+        moved to another batch because its batch was split."""
+        self.args = (relative_offset,) + self.args[1:]
+        self._produce_future = produce_future
+        produce_future.add_callback(self._produce_success)
+        produce_future.add_errback(self.failure)
+
     def _produce_success(self, offset_and_timestamp):
         offset, produce_timestamp_ms = offset_and_timestamp
 
@@ -57,10 +71,103 @@ class FutureRecordMetadata(Future):
         self.success(metadata)
 
     def get(self, timeout=None):
-        if not self.is_done and not self._produce_future.wait(timeout):
+        if timeout is not None:
+            deadline = time.time() + timeout
+        # The produce future changes if the record moves to another batch
+        while not self.is_done:
+            remaining = None
+            if timeout is not None:
+                remaining = max(deadline - time.time(), 0)
+            if not self._produce_future.wait(remaining):
+                raise Errors.KafkaTimeoutError(
+                    "Timeout after waiting for %s secs." % timeout)
+        assert self.is_done
+        if self.failed():
+            raise self.exception # pylint: disable-msg=raising-bad-type
+        return self.value
+
+
+class FutureRecordSet(Future):
+    """Aggregate result of the records sent by KafkaProducer.send_many().
+
+    Resolves to the number of records once all of them were acknowledged,
+    or fails with the first error of any of their batches.
+    """
+    def __init__(self):
+        super(FutureRecordSet, self).__init__()
+        self._lock = threading.Lock()
+        self._latch = threading.Event()
+        # Held until seal(), so batches completing while records are still
+        # being appended do not resolve the set early
+        self._pending = 1
+        self._count = 0
+        self._completed = False
+
+    def add_batch(self, produce_future, count):
+        """Track count records appended to the batch of produce_future."""
+        with self._lock:
+            self._pending += count
+            self._count += count
+        self._bind(produce_future, count)
+
+    def add_record(self, future):
+        """Track a record with its own FutureRecordMetadata."""
+        with self._lock:
+            self._pending += 1
+            self._count += 1
+        future.add_callback(lambda _: self._acknowledge(1))
+        future.add_errback(self._fail)
+
+    def rebind(self, produce_future, relative_offset):
+        """Track one record that moved to the batch of produce_future
+        because its batch was split; it stays pending."""
+        self._bind(produce_future, 1)
+
+    def seal(self):
+        """Resolve once the records added so far are acknowledged."""
+        self._acknowledge(1)
+        return self
+
+    def fail(self, error):
+        """Fail with error unless already completed, e.g. when not all
+        records could be appended."""
+        self._fail(error)
+
+    def _bind(self, produce_future, count):
+        produce_future.add_callback(lambda _: self._acknowledge(count))
+        produce_future.add_errback(self._fail)
+
+    def _acknowledge(self, count):
+        with self._lock:
+            self._pending -= count
+            if self._pending or self._completed:
+                return
+            self._completed = True
+        self.success(self._count)
+
+    def _fail(self, error):
+        with self._lock:
+            if self._completed:
+                return  # Only the first error is reported
+            self._completed = True
+        self.failure(error)
+
+    def success(self, value):
+        self._completed = True
+        ret = super(FutureRecordSet, self).success(value)
+        self._latch.set()
+        return ret
+
+    def failure(self, error):
+        self._completed = True
+        ret = super(FutureRecordSet, self).failure(error)
+        self._latch.set()
+        return ret
+
+    def get(self, timeout=None):
+        if not self._latch.wait(timeout) and not self._latch.is_set():
             raise Errors.KafkaTimeoutError(
                 "Timeout after waiting for %s secs." % timeout)
-        assert self.is_done
         if self.failed():
             raise self.exception # pylint: disable-msg=raising-bad-type
         return self.value
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import atexit
+import collections
 import copy
 import logging
 import socket
@@ -12,16 +13,19 @@ from kafka.vendor import six
 
 import kafka.errors as Errors
 from kafka.client_async import KafkaClient, selectors
-from kafka.codec import has_gzip, has_snappy, has_lz4
+from kafka.codec import has_gzip, has_snappy, has_lz4, has_zstd
 from kafka.metrics import MetricConfig, Metrics
 from kafka.partitioner.default import DefaultPartitioner
-from kafka.producer.future import FutureRecordMetadata, FutureProduceResult
+from kafka.producer.future import (
+    FutureRecordMetadata, FutureProduceResult, FutureRecordSet)
 from kafka.producer.record_accumulator import AtomicInteger, RecordAccumulator
 from kafka.producer.sender import Sender
+from kafka.producer.spill import BatchSpill
 from kafka.record.default_records import DefaultRecordBatchBuilder
 from kafka.record.legacy_records import LegacyRecordBatchBuilder
 from kafka.serializer import Serializer
 from kafka.structs import TopicPartition
+from kafka.util import WorkerPool
 
 
 log = logging.getLogger(__name__)
@@ -119,10 +123,38 @@ class KafkaProducer(object):
                 available guarantee.
             If unset, defaults to acks=1.
         compression_type (str): The compression type for all data generated by
-            the producer. Valid values are 'gzip', 'snappy', 'lz4', or None.
+            the producer. Valid values are 'gzip', 'snappy', 'lz4', 'zstd',
+            or None. 'zstd' requires Kafka >= 2.1.0 brokers.
             Compression is of full batches of data, so the efficacy of batching
             will also impact the compression ratio (more batching means better
             compression). Default: None.
+        compression_level (int): The compression level used by
+            compression_type. Valid ranges are 0-9 for gzip, 0-16 for lz4
+            and 1-22 for zstd; higher levels trade producer cpu for smaller
+            batches. snappy does not support levels. If None, the codec
+            default is used. Default: None.
+        topic_compression (dict): Per-topic overrides of compression_type
+            and compression_level, i.e. for topics whose traffic calls for
+            maximum compression or none at all. Maps topic names to a
+            compression_type, or to a (compression_type, compression_level)
+            tuple. Topics not listed use compression_type and
+            compression_level. Default: None.
+        streaming_compression (bool): Compress records as they are appended
+            to a batch, instead of compressing the whole batch when it is
+            sent. This avoids holding both the uncompressed and compressed
+            copy of a batch in memory, moves most of the compression work
+            to send(), and lets batch_size apply to the compressed size, so
+            batches of compressible data hold more records. Streamed batches
+            are always sent compressed, even if compression did not reduce
+            their size. Only applies to Kafka >= 0.11 message format.
+            Default: False.
+        compression_workers (int): Number of background threads that close
+            and compress batches, so that compressing a large batch does not
+            stall network I/O on the sender thread. gzip, lz4 and zstd
+            release the GIL while compressing, so batches of different
+            partitions compress in parallel. Full batches start compressing
+            as soon as they fill up. If 0, batches are compressed by the
+            sender thread when drained. Default: 0.
         retries (int): Setting a value greater than zero will cause the client
             to resend any record whose send fails with a potentially transient
             error. Note that this retry is no different than if the client
@@ -137,7 +169,9 @@ class KafkaProducer(object):
             batches, one for each partition with data available to be sent.
             A small batch size will make batching less common and may reduce
             throughput (a batch size of zero will disable batching entirely).
-            Default: 16384
+            With compression, batch size applies to the compressed size of
+            the batch, estimated from the compression ratio of previous
+            batches of the same topic. Default: 16384
         linger_ms (int): The producer groups together any records that arrive
             in between request transmissions into a single batched request.
             Normally this occurs only under load when records arrive faster
@@ -165,12 +199,46 @@ class KafkaProducer(object):
             messages with the same key are assigned to the same partition.
             When a key is None, the message is delivered to a random partition
             (filtered to partitions with available leaders only, if possible).
+            Use DefaultPartitioner(sticky=True) to send messages with a None
+            key to the same partition until its batch is full or sent,
+            which creates fewer, larger batches, or
+            DefaultPartitioner(adaptive=True) to also prefer partitions with
+            less data queued and ready leaders. Partitioners that define
+            on_new_batch(topic, all_partitions, available, prev_partition)
+            are called with an additional topic keyword argument. If they
+            also have a true sticky attribute, on_new_batch is called before
+            a message with a None key starts a new batch, after which the
+            message is partitioned again.
+            Partitioners with a true adaptive attribute get an additional
+            partition_load keyword argument: {partition: queued bytes} for
+            the partitions with ready leaders.
+        record_futures (bool): If False, send() returns None instead of a
+            FutureRecordMetadata, which saves creating and completing a
+            future for every record. Delivery can then be tracked with
+            delivery_callback, flush() or send_many(). Default: True.
+        delivery_callback (callable): Called, usually on the sender thread,
+            once for each batch when it is acknowledged or fails, with
+            (topic_partition, base_offset, record_count, error), where
+            error is None on success and base_offset is -1 on failure.
+            It must not block. Default: None.
         buffer_memory (int): The total bytes of memory the producer should use
-            to buffer records waiting to be sent to the server. If records are
-            sent faster than they can be delivered to the server the producer
-            will block up to max_block_ms, raising an exception on timeout.
-            In the current implementation, this setting is an approximation.
+            to buffer records waiting to be sent to the server, including
+            batches awaiting a response. If records are sent faster than they
+            can be delivered to the server, buffer_overflow_policy applies.
             Default: 33554432 (32MB)
+        buffer_overflow_policy (str): What :meth:`~kafka.KafkaProducer.send`
+            does when buffer_memory is exhausted: 'block' up to max_block_ms,
+            'fail' right away, 'drop_oldest' batches not sent yet, failing
+            their records with BufferExhaustedError, or 'spill' full batches
+            not sent yet to files in spill_dir, until the new record fits.
+            With 'spill', send() blocks once no batch is left to spill.
+            send() raises BufferExhaustedError, a KafkaTimeoutError, if
+            memory is still not available. Default: 'block'.
+        spill_dir (str): Directory for the 'spill' buffer_overflow_policy.
+            Spilled batches are written to memory-mapped files in a
+            directory created in spill_dir, read back in order when their
+            partition can be sent, and deleted once acknowledged. The
+            directory is removed when the producer is closed. Default: None.
         connections_max_idle_ms: Close idle connections after the number of
             milliseconds specified by this config. The broker closes idle
             connections after connections.max.idle.ms, so this avoids hitting
@@ -270,6 +338,13 @@ class KafkaProducer(object):
             Default: None
         sasl_kerberos_service_name (str): Service name to include in GSSAPI
             sasl mechanism handshake. Default: 'kafka'
+        wire_capture (kafka.capture.WireCapture): Record raw request and
+            response frames of every broker connection, with timings, for
+            later replay. Default: None
+        transport (kafka.transport.Transport): How to reach brokers:
+            TcpTransport, UnixSocketTransport (e.g. to go through a local
+            proxy), InMemoryTransport, or kafka.capture.WireReplay to answer
+            requests from a recorded capture. Default: None (TcpTransport)
 
     Note:
         Configuration parameters are described in more detail at
@@ -282,11 +357,19 @@ class KafkaProducer(object):
         'value_serializer': None,
         'acks': 1,
         'compression_type': None,
+        'compression_level': None,
+        'topic_compression': None,
+        'compression_workers': 0,
+        'streaming_compression': False,
         'retries': 0,
         'batch_size': 16384,
         'linger_ms': 0,
         'partitioner': DefaultPartitioner(),
+        'record_futures': True,
+        'delivery_callback': None,
         'buffer_memory': 33554432,
+        'buffer_overflow_policy': 'block',
+        'spill_dir': None,
         'connections_max_idle_ms': 9 * 60 * 1000,
         'max_block_ms': 60000,
         'max_request_size': 1048576,
@@ -318,16 +401,25 @@ class KafkaProducer(object):
         'sasl_mechanism': None,
         'sasl_plain_username': None,
         'sasl_plain_password': None,
-        'sasl_kerberos_service_name': 'kafka'
+        'sasl_kerberos_service_name': 'kafka',
+        'wire_capture': None,
+        'transport': None,
     }
 
     _COMPRESSORS = {
         'gzip': (has_gzip, LegacyRecordBatchBuilder.CODEC_GZIP),
         'snappy': (has_snappy, LegacyRecordBatchBuilder.CODEC_SNAPPY),
         'lz4': (has_lz4, LegacyRecordBatchBuilder.CODEC_LZ4),
+        'zstd': (has_zstd, DefaultRecordBatchBuilder.CODEC_ZSTD),
         None: (lambda: True, LegacyRecordBatchBuilder.CODEC_NONE),
     }
 
+    _COMPRESSION_LEVELS = {
+        'gzip': (0, 9),
+        'lz4': (0, 16),
+        'zstd': (1, 22),
+    }
+
     def __init__(self, **configs):
         log.debug("Starting the Kafka producer")  # trace
         self.config = copy.copy(self.DEFAULT_CONFIG)
@@ -370,20 +462,35 @@ class KafkaProducer(object):
         if self.config['api_version'] is None:
             self.config['api_version'] = client.config['api_version']
 
-        if self.config['compression_type'] == 'lz4':
-            assert self.config['api_version'] >= (0, 8, 2), 'LZ4 Requires >= Kafka 0.8.2 Brokers'
-
-        # Check compression_type for library support
-        ct = self.config['compression_type']
-        if ct not in self._COMPRESSORS:
-            raise ValueError("Not supported codec: {}".format(ct))
-        else:
-            checker, compression_attrs = self._COMPRESSORS[ct]
-            assert checker(), "Libraries for {} compression codec not found".format(ct)
-            self.config['compression_attrs'] = compression_attrs
+        self.config['compression_attrs'], self.config['compression_level'] = \
+            self._compression_settings(self.config['compression_type'],
+                                       self.config['compression_level'])
+        topic_compression_attrs = {}
+        for topic, setting in six.iteritems(self.config['topic_compression'] or {}):
+            if isinstance(setting, tuple):
+                ct, level = setting
+            else:
+                ct, level = setting, None
+            topic_compression_attrs[topic] = self._compression_settings(ct, level)
+        self.config['topic_compression_attrs'] = topic_compression_attrs
+
+        self._compression_pool = None
+        if self.config['compression_workers']:
+            self._compression_pool = WorkerPool(
+                self.config['compression_workers'],
+                name=self.config['client_id'] + '-compression')
+
+        self._spill = None
+        if self.config['buffer_overflow_policy'] == 'spill':
+            assert self.config['spill_dir'] is not None, (
+                'spill buffer_overflow_policy requires spill_dir')
+            self._spill = BatchSpill(self.config['spill_dir'])
 
         message_version = self._max_usable_produce_magic()
-        self._accumulator = RecordAccumulator(message_version=message_version, metrics=self._metrics, **self.config)
+        self._accumulator = RecordAccumulator(message_version=message_version, metrics=self._metrics,
+                                              compression_pool=self._compression_pool,
+                                              spill=self._spill,
+                                              wakeup=client.wakeup, **self.config)
         self._metadata = client.cluster
         guarantee_message_order = bool(self.config['max_in_flight_requests_per_connection'] == 1)
         self._sender = Sender(client, self._metadata,
@@ -475,6 +582,10 @@ class KafkaProducer(object):
             if not invoked_from_callback:
                 self._sender.join()
 
+        if self._compression_pool is not None:
+            self._compression_pool.close()
+        if self._spill is not None:
+            self._spill.close()
         self._metrics.close()
         try:
             self.config['key_serializer'].close()
@@ -492,6 +603,37 @@ class KafkaProducer(object):
         max_wait = self.config['max_block_ms'] / 1000.0
         return self._wait_on_metadata(topic, max_wait)
 
+    def _compression_settings(self, ct, level):
+        """Validate a codec name and level, return (compression_attrs, level)"""
+        if ct == 'lz4':
+            assert self.config['api_version'] >= (0, 8, 2), 'LZ4 Requires >= Kafka 0.8.2 Brokers'
+
+        if ct == 'zstd':
+            assert self.config['api_version'] >= (2, 1, 0), 'Zstd Requires >= Kafka 2.1.0 Brokers'
+
+        # Check compression_type for library support
+        if ct not in self._COMPRESSORS:
+            raise ValueError("Not supported codec: {}".format(ct))
+        checker, compression_attrs = self._COMPRESSORS[ct]
+        assert checker(), "Libraries for {} compression codec not found".format(ct)
+
+        if level is not None and ct is not None:
+            if ct not in self._COMPRESSION_LEVELS:
+                raise ValueError("Codec {} does not support compression levels".format(ct))
+            min_level, max_level = self._COMPRESSION_LEVELS[ct]
+            if not min_level <= level <= max_level:
+                raise ValueError("Invalid {} compression level {}, expected {}-{}".format(
+                    ct, level, min_level, max_level))
+        return compression_attrs, level
+
+    def _compression_type(self, topic):
+        """Return the compression_type used for records of topic"""
+        setting = (self.config['topic_compression'] or {}).get(
+            topic, self.config['compression_type'])
+        if isinstance(setting, tuple):
+            return setting[0]
+        return setting
+
     def _max_usable_produce_magic(self):
         if self.config['api_version'] >= (0, 11):
             return 2
@@ -500,14 +642,14 @@ class KafkaProducer(object):
         else:
             return 0
 
-    def _estimate_size_in_bytes(self, key, value, headers=[]):
+    def _estimate_size_in_bytes(self, topic, key, value, headers=[]):
         magic = self._max_usable_produce_magic()
         if magic == 2:
             return DefaultRecordBatchBuilder.estimate_size_in_bytes(
                 key, value, headers)
         else:
             return LegacyRecordBatchBuilder.estimate_size_in_bytes(
-                magic, self.config['compression_type'], key, value)
+                magic, self._compression_type(topic), key, value)
 
     def send(self, topic, value=None, key=None, partition=None, timestamp_ms=None):
         """Publish a message to a topic.
@@ -534,11 +676,13 @@ class KafkaProducer(object):
                 to use as the message timestamp. Defaults to current time.
 
         Returns:
-            FutureRecordMetadata: resolves to RecordMetadata
+            FutureRecordMetadata: resolves to RecordMetadata, or None if the
+                record_futures config is False
 
         Raises:
             KafkaTimeoutError: if unable to fetch topic metadata, or unable
-                to obtain memory buffer prior to configured max_block_ms
+                to obtain memory buffer as configured by max_block_ms and
+                buffer_overflow_policy
         """
         assert value is not None or self.config['api_version'] >= (0, 8, 1), (
             'Null messages require kafka >= 0.8.1')
@@ -556,30 +700,64 @@ class KafkaProducer(object):
             assert type(key_bytes) in (bytes, bytearray, memoryview, type(None))
             assert type(value_bytes) in (bytes, bytearray, memoryview, type(None))
 
+            requested_partition = partition
             partition = self._partition(topic, partition, key, value,
                                         key_bytes, value_bytes)
 
-            message_size = self._estimate_size_in_bytes(key_bytes, value_bytes)
+            message_size = self._estimate_size_in_bytes(topic, key_bytes, value_bytes)
             self._ensure_valid_record_size(message_size)
 
             tp = TopicPartition(topic, partition)
             log.debug("Sending (key=%r value=%r) to %s", key, value, tp)
+            # Let sticky partitioners switch partitions before a new batch
+            on_new_batch = self._sticky_on_new_batch()
+            abort_on_new_batch = (on_new_batch is not None and
+                                  requested_partition is None and
+                                  key_bytes is None)
             result = self._accumulator.append(tp, timestamp_ms,
                                               key_bytes, value_bytes,
                                               self.config['max_block_ms'],
-                                              estimated_size=message_size)
+                                              estimated_size=message_size,
+                                              abort_on_new_batch=abort_on_new_batch,
+                                              record_future=self.config['record_futures'])
+            if result[0] is None:
+                kwargs = {}
+                if getattr(self.config['partitioner'], 'adaptive', False):
+                    kwargs['partition_load'] = self._accumulator.partition_load(
+                        self._metadata, topic)
+                on_new_batch(topic,
+                             sorted(self._metadata.partitions_for_topic(topic)),
+                             list(self._metadata.available_partitions_for_topic(topic)),
+                             partition, **kwargs)
+                partition = self._partition(topic, None, key, value,
+                                            key_bytes, value_bytes)
+                tp = TopicPartition(topic, partition)
+                log.debug("Sending (key=%r value=%r) to %s after new batch",
+                          key, value, tp)  # trace
+                result = self._accumulator.append(tp, timestamp_ms,
+                                                  key_bytes, value_bytes,
+                                                  self.config['max_block_ms'],
+                                                  estimated_size=message_size,
+                                                  record_future=self.config['record_futures'])
             future, batch_is_full, new_batch_created = result
             if batch_is_full or new_batch_created:
                 log.debug("Waking up the sender since %s is either full or"
                           " getting a new batch", tp)
                 self._sender.wakeup()
 
+            if future is True:
+                return None  # record_futures is False
             return future
             # handling exceptions and record the errors;
             # for API exceptions return them in the future,
             # for other exceptions raise directly
         except Errors.BrokerResponseError as e:
             log.debug("Exception occurred during message send: %s", e)
+            if not self.config['record_futures']:
+                if self.config['delivery_callback'] is not None:
+                    self.config['delivery_callback'](
+                        TopicPartition(topic, partition), -1, 1, e)
+                return None
             return FutureRecordMetadata(
                 FutureProduceResult(TopicPartition(topic, partition)),
                 -1, None, None,
@@ -587,6 +765,130 @@ class KafkaProducer(object):
                 len(value_bytes) if value_bytes is not None else -1
             ).failure(e)
 
+    def send_many(self, topic, records, partition=None, timestamp_ms=None,
+                  record_futures=False):
+        """Publish many messages to a topic.
+
+        Cheaper than calling :meth:`~kafka.KafkaProducer.send` for each
+        message: metadata is checked once, messages are grouped by partition
+        and each group is appended under one lock acquisition per batch.
+        Messages are partitioned as by send(), except that sticky
+        partitioners are asked to switch partitions only after the
+        messages were appended, if messages with a None key started a new
+        batch, so they apply to the next call.
+
+        Arguments:
+            topic (str): topic where the messages will be published
+            records (iterable): (key, value) pairs, serialized with the
+                configured key_serializer and value_serializer like the key
+                and value arguments of send()
+            partition (int, optional): partition for all messages. If not
+                set, each message is partitioned by the configured
+                'partitioner'.
+            timestamp_ms (int, optional): epoch milliseconds (from Jan 1 1970
+                UTC) to use as the timestamp of all messages. Defaults to
+                current time.
+            record_futures (bool): also return a FutureRecordMetadata per
+                message, which costs about as much as send(). Default: False.
+
+        Returns:
+            FutureRecordSet: resolves to the number of messages once all were
+                acknowledged, or fails with the first error. If
+                record_futures is True, a tuple of it and the list of
+                FutureRecordMetadata, in the order of records.
+
+        Raises:
+            KafkaTimeoutError: if unable to fetch topic metadata, or unable
+                to obtain memory buffer as configured by max_block_ms and
+                buffer_overflow_policy
+        """
+        record_set = FutureRecordSet()
+        futures = [] if record_futures else None
+        try:
+            self._wait_on_metadata(topic, self.config['max_block_ms'] / 1000.0)
+            if partition is not None:
+                self._partition(topic, partition, None, None, None, None)
+            else:
+                all_partitions = sorted(self._metadata.partitions_for_topic(topic))
+                available = list(self._metadata.available_partitions_for_topic(topic))
+                partitioner = self.config['partitioner']
+                kwargs = {}
+                if hasattr(partitioner, 'on_new_batch'):
+                    kwargs['topic'] = topic
+            on_new_batch = None
+            if partition is None:
+                on_new_batch = self._sticky_on_new_batch()
+            keyless = set()  # partitions of messages with a None key
+
+            key_serializer = self.config['key_serializer']
+            value_serializer = self.config['value_serializer']
+            groups = collections.OrderedDict()  # partition: [record]
+            indexes = collections.defaultdict(list)  # partition: [index]
+            for i, (key, value) in enumerate(records):
+                assert not (value is None and key is None), 'Need at least one: key or value'
+                key_bytes = self._serialize(key_serializer, topic, key)
+                value_bytes = self._serialize(value_serializer, topic, value)
+                assert type(key_bytes) in (bytes, bytearray, memoryview, type(None))
+                assert type(value_bytes) in (bytes, bytearray, memoryview, type(None))
+                message_size = self._estimate_size_in_bytes(topic, key_bytes, value_bytes)
+                self._ensure_valid_record_size(message_size)
+
+                record_partition = partition
+                if record_partition is None:
+                    record_partition = partitioner(key_bytes, all_partitions,
+                                                   available, **kwargs)
+                    if key_bytes is None:
+                        keyless.add(record_partition)
+                if record_partition not in groups:
+                    groups[record_partition] = []
+                groups[record_partition].append(
+                    (timestamp_ms, key_bytes, value_bytes, message_size))
+                if record_futures:
+                    indexes[record_partition].append(i)
+
+            if record_futures:
+                ordered = [None] * sum(len(group) for group in groups.values())
+            wakeup = False
+            for record_partition, group in six.iteritems(groups):
+                tp = TopicPartition(topic, record_partition)
+                log.debug("Sending %d messages to %s", len(group), tp)
+                group_futures = [] if record_futures else None
+                batch_is_full, new_batch_created = self._accumulator.append_many(
+                    tp, group, self.config['max_block_ms'], record_set,
+                    group_futures)
+                wakeup = wakeup or batch_is_full or new_batch_created
+                if record_futures:
+                    for i, future in zip(indexes[record_partition], group_futures):
+                        ordered[i] = future
+                if (on_new_batch is not None and new_batch_created and
+                        record_partition in keyless):
+                    load = {}
+                    if getattr(partitioner, 'adaptive', False):
+                        load['partition_load'] = self._accumulator.partition_load(
+                            self._metadata, topic)
+                    on_new_batch(topic, all_partitions, available,
+                                 record_partition, **load)
+            if wakeup:
+                self._sender.wakeup()
+            if record_futures:
+                futures = ordered
+        # handling exceptions and record the errors;
+        # for API exceptions return them in the future,
+        # for other exceptions raise directly
+        except Errors.BrokerResponseError as e:
+            log.debug("Exception occurred during message send_many: %s", e)
+            record_set.fail(e)
+        except Exception as e:
+            # Messages appended so far are still sent, but the set would
+            # never complete
+            record_set.fail(e)
+            raise
+        else:
+            record_set.seal()
+        if record_futures:
+            return record_set, futures
+        return record_set
+
     def flush(self, timeout=None):
         """
         Invoking this method makes all buffered records immediately available
@@ -679,6 +981,13 @@ class KafkaProducer(object):
             return f.serialize(topic, data)
         return f(data)
 
+    def _sticky_on_new_batch(self):
+        """Return the on_new_batch method of a sticky partitioner, or None"""
+        partitioner = self.config['partitioner']
+        if not getattr(partitioner, 'sticky', False):
+            return None
+        return getattr(partitioner, 'on_new_batch', None)
+
     def _partition(self, topic, partition, key, value,
                    serialized_key, serialized_value):
         if partition is not None:
@@ -688,9 +997,13 @@ class KafkaProducer(object):
 
         all_partitions = sorted(self._metadata.partitions_for_topic(topic))
         available = list(self._metadata.available_partitions_for_topic(topic))
-        return self.config['partitioner'](serialized_key,
-                                          all_partitions,
-                                          available)
+        partitioner = self.config['partitioner']
+        if hasattr(partitioner, 'on_new_batch'):
+            return partitioner(serialized_key, all_partitions, available,
+                               topic=topic)
+        return partitioner(serialized_key,
+                           all_partitions,
+                           available)
 
     def metrics(self, raw=False):
         """Get metrics on producer performance.
@@ -0,0 +1,626 @@
+from __future__ import absolute_import, division
+
+import collections
+import copy
+import ctypes
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import struct
+import threading
+import time
+
+import kafka.errors as Errors
+from kafka.future import Future
+from kafka.partitioner.default import DefaultPartitioner
+from kafka.partitioner.hashed import murmur2
+from kafka.producer.future import FutureProduceResult, FutureRecordMetadata
+from kafka.producer.kafka import KafkaProducer, PRODUCER_CLIENT_ID_SEQUENCE
+from kafka.serializer import Serializer
+from kafka.structs import TopicPartition
+
+
+log = logging.getLogger(__name__)
+
+
+class RingBuffer(object):
+    """
+    A queue of byte strings in shared memory, written by one process and
+    read by another.
+
+    Messages are copied into a circular buffer of capacity bytes, each
+    prefixed by its length. The write and read positions live in shared
+    memory too, so neither side takes a lock; semaphores only wake up a
+    reader waiting for messages or a writer waiting for space.
+
+    Only one thread may put() and one thread may get() at a time. Create
+    the buffer before starting the process that uses the other end.
+
+    Arguments:
+        capacity (int): bytes of shared memory for queued messages
+        ctx (multiprocessing context, optional): used to create the shared
+            memory and semaphores. Default: the multiprocessing module
+    """
+    _HEADER = struct.Struct('=I')
+    _WRAP = 0xFFFFFFFF  # the next message starts at the buffer start
+    _WRITE, _READ, _READER_WAITING, _WRITER_WAITING = range(4)
+    # Bounds the delay of a wakeup lost to the unordered flag checks
+    _POLL_SECS = 0.1
+
+    def __init__(self, capacity, ctx=None):
+        ctx = ctx or multiprocessing
+        self.capacity = capacity
+        self._data = ctx.RawArray(ctypes.c_char, capacity)
+        self._positions = ctx.RawArray(ctypes.c_longlong, 4)
+        self._readable = ctx.Semaphore(0)
+        self._writable = ctx.Semaphore(0)
+
+    def put(self, message, timeout=None):
+        """Copy message into the buffer, waiting for space up to timeout
+        seconds, or forever if None.
+
+        Returns:
+            bool: False if there was no space within timeout
+
+        Raises:
+            ValueError: if the message can never fit in the buffer
+        """
+        size = len(message)
+        capacity = self.capacity
+        if size + self._HEADER.size >= capacity:
+            raise ValueError('Message of %d bytes does not fit in a %d byte'
+                             ' ring buffer' % (size, capacity))
+        positions = self._positions
+        write = positions[self._WRITE]
+        index = write % capacity
+        skip = 0
+        if index + self._HEADER.size + size > capacity:
+            skip = capacity - index
+        needed = skip + self._HEADER.size + size
+        if capacity - (write - positions[self._READ]) < needed:
+            if not self._wait(self._writable, self._WRITER_WAITING, timeout,
+                              lambda: capacity - (write - positions[self._READ]) >= needed):
+                return False
+
+        address = ctypes.addressof(self._data)
+        if skip:
+            if skip >= self._HEADER.size:
+                ctypes.memmove(address + index, self._HEADER.pack(self._WRAP),
+                               self._HEADER.size)
+            index = 0
+        ctypes.memmove(address + index, self._HEADER.pack(size), self._HEADER.size)
+        ctypes.memmove(address + index + self._HEADER.size, message, size)
+        positions[self._WRITE] = write + needed
+        if positions[self._READER_WAITING]:
+            positions[self._READER_WAITING] = 0
+            self._readable.release()
+        return True
+
+    def get(self, timeout=None):
+        """Remove and return the oldest message, waiting for one up to
+        timeout seconds, or forever if None.
+
+        Returns:
+            bytes: the message, or None if there was none within timeout
+        """
+        positions = self._positions
+        read = positions[self._READ]
+        if positions[self._WRITE] == read:
+            if not self._wait(self._readable, self._READER_WAITING, timeout,
+                              lambda: positions[self._WRITE] != read):
+                return None
+
+        capacity = self.capacity
+        address = ctypes.addressof(self._data)
+        index = read % capacity
+        size = self._WRAP
+        if capacity - index >= self._HEADER.size:
+            size, = self._HEADER.unpack(
+                ctypes.string_at(address + index, self._HEADER.size))
+        if size == self._WRAP:
+            read += capacity - index
+            index = 0
+            size, = self._HEADER.unpack(
+                ctypes.string_at(address, self._HEADER.size))
+        message = ctypes.string_at(address + index + self._HEADER.size, size)
+        positions[self._READ] = read + self._HEADER.size + size
+        if positions[self._WRITER_WAITING]:
+            positions[self._WRITER_WAITING] = 0
+            self._writable.release()
+        return message
+
+    def _wait(self, semaphore, flag, timeout, ready):
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            # Ask the other side for a wakeup, then check again in case it
+            # made progress before it could see the flag
+            self._positions[flag] = 1
+            if ready():
+                self._positions[flag] = 0
+                return True
+            wait = self._POLL_SECS
+            if timeout is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    self._positions[flag] = 0
+                    return False
+            semaphore.acquire(True, wait)
+
+
+# Messages from the pool to its producer processes
+_SEND = struct.Struct('>BqiqHii')  # type, id, partition, timestamp_ms, topic, key, value sizes
+_PARTITIONS = struct.Struct('>BqH')  # type, id, topic size
+_FLUSH = struct.Struct('>B')
+_CLOSE = struct.Struct('>Bd')  # type, timeout secs (-1 for None)
+_SEND_TYPE, _PARTITIONS_TYPE, _FLUSH_TYPE, _CLOSE_TYPE = range(4)
+
+# Acknowledgements from the producer processes, several per message
+_ACK = struct.Struct('>Bqqq')  # type, id, offset, timestamp_ms
+_ACK_ERROR = struct.Struct('>BqI')  # type, id, size, followed by the pickled error
+_ACK_PARTITIONS = struct.Struct('>BqI')  # type, id, count, followed by int32 ids
+_ACK_CLOSED = struct.Struct('>B')
+_ACK_TYPE, _ACK_ERROR_TYPE, _ACK_PARTITIONS_TYPE, _ACK_CLOSED_TYPE = range(4)
+
+
+def _ack_error(request_id, error):
+    try:
+        data = pickle.dumps(error, 2)
+        pickle.loads(data)
+    except Exception:
+        data = pickle.dumps(Errors.KafkaError(repr(error)), 2)
+    return _ACK_ERROR.pack(_ACK_ERROR_TYPE, request_id, len(data)) + data
+
+
+def _run_producer(configs, requests, acks, parent_pid):
+    """Main loop of a pool producer process: send the records of requests
+    with a KafkaProducer and write their results to acks."""
+    # Results are queued by this thread and the sender thread of the
+    # producer, and written by another thread, packing all results of a
+    # produce response into one message
+    queued = collections.deque()
+    ready = threading.Event()
+
+    def ack(message):
+        queued.append(message)
+        if not ready.is_set():
+            ready.set()
+
+    def write_acks():
+        max_size = acks.capacity // 4
+        while True:
+            ready.wait()
+            ready.clear()
+            while queued:
+                parts = [queued.popleft()]
+                size = len(parts[0])
+                while queued and size + len(queued[0]) <= max_size:
+                    parts.append(queued.popleft())
+                    size += len(parts[-1])
+                while not acks.put(b''.join(parts), timeout=1):
+                    if os.getppid() != parent_pid:
+                        os._exit(1)
+                if ord(parts[-1][0:1]) == _ACK_CLOSED_TYPE:
+                    return
+
+    writer = threading.Thread(target=write_acks, name='kafka-producer-pool-acks')
+    writer.daemon = True
+    writer.start()
+
+    def acked(request_id, metadata):
+        ack(_ACK.pack(_ACK_TYPE, request_id, metadata.offset,
+                      metadata.timestamp if metadata.timestamp is not None else -1))
+
+    def failed(request_id, error):
+        ack(_ack_error(request_id, error))
+
+    # Future is not thread-safe: a callback added while the sender thread
+    # completes the future may never be called. So the request loop also
+    # acks futures that are done once their callbacks were added, and
+    # pending.pop() (atomic) makes sure each request is acked once.
+    pending = {}  # request id: FutureRecordMetadata
+
+    def complete(request_id, _=None):
+        future = pending.pop(request_id, None)
+        if future is None:
+            return
+        if future.failed():
+            failed(request_id, future.exception)
+        else:
+            acked(request_id, future.value)
+
+    producer = KafkaProducer(**configs)
+    while True:
+        message = requests.get(timeout=1)
+        if message is None:
+            if os.getppid() != parent_pid:
+                producer.close(timeout=0)
+                return
+            continue
+        message_type = ord(message[0:1])
+        if message_type == _SEND_TYPE:
+            (_, request_id, partition, timestamp_ms,
+             topic_size, key_size, value_size) = _SEND.unpack_from(message)
+            pos = _SEND.size
+            topic = message[pos:pos + topic_size].decode('utf-8')
+            pos += topic_size
+            key = value = None
+            if key_size >= 0:
+                key = message[pos:pos + key_size]
+                pos += key_size
+            if value_size >= 0:
+                value = message[pos:pos + value_size]
+            if timestamp_ms < 0:
+                timestamp_ms = None
+            try:
+                future = producer.send(topic, value, key=key, partition=partition,
+                                       timestamp_ms=timestamp_ms)
+            except Exception as e:
+                failed(request_id, e)
+            else:
+                pending[request_id] = future
+                future.add_both(complete, request_id)
+                if future.is_done:
+                    complete(request_id)
+        elif message_type == _PARTITIONS_TYPE:
+            _, request_id, topic_size = _PARTITIONS.unpack_from(message)
+            topic = message[_PARTITIONS.size:_PARTITIONS.size + topic_size].decode('utf-8')
+            try:
+                partitions = sorted(producer.partitions_for(topic))
+            except Exception as e:
+                failed(request_id, e)
+            else:
+                ack(_ACK_PARTITIONS.pack(_ACK_PARTITIONS_TYPE, request_id, len(partitions)) +
+                    struct.pack('>%di' % len(partitions), *partitions))
+        elif message_type == _FLUSH_TYPE:
+            producer.flush()
+        elif message_type == _CLOSE_TYPE:
+            _, timeout = _CLOSE.unpack(message)
+            producer.close(timeout=timeout if timeout >= 0 else None)
+            ack(_ACK_CLOSED.pack(_ACK_CLOSED_TYPE))
+            writer.join()
+            return
+
+
+class ProducerProcess(object):
+    """A pool producer process and the parent side of its ring buffers."""
+    def __init__(self, ctx, configs, ring_buffer_bytes, name):
+        self.requests = RingBuffer(ring_buffer_bytes, ctx=ctx)
+        self.acks = RingBuffer(ring_buffer_bytes, ctx=ctx)
+        self.lock = threading.Lock()  # Held to write requests
+        self.pending = {}  # request id: Future
+        self._ids = itertools.count()
+        self.process = ctx.Process(
+            target=_run_producer, name=name,
+            args=(configs, self.requests, self.acks, os.getpid()))
+        self.process.daemon = True
+        self.process.start()
+        self._reader = threading.Thread(target=self._read_acks, name=name + '-acks')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def request(self, message_fn, future, timeout):
+        """Write the message built by message_fn(request_id) and complete
+        future with its acknowledgement.
+
+        Raises:
+            KafkaTimeoutError: if the message could not be written within
+                timeout seconds
+        """
+        with self.lock:
+            request_id = next(self._ids)
+            self.pending[request_id] = future
+            if not self.requests.put(message_fn(request_id), timeout):
+                del self.pending[request_id]
+                raise Errors.KafkaTimeoutError(
+                    "Failed to hand off the record to the producer process"
+                    " after %.1f secs." % timeout)
+
+    def notify(self, message, timeout):
+        """Write a message that is not acknowledged, return whether it was
+        written within timeout seconds."""
+        with self.lock:
+            return self.requests.put(message, timeout)
+
+    def _read_acks(self):
+        while True:
+            message = self.acks.get(timeout=1)
+            if message is None:
+                if not self.process.is_alive():
+                    break
+                continue
+            if not self._complete(message):
+                break
+        self.fail_pending(Errors.KafkaConnectionError(
+            'Producer process %s exited' % self.process.name))
+
+    def _complete(self, message):
+        """Complete the futures acknowledged by message, return False once
+        the producer process closed."""
+        pos = 0
+        while pos < len(message):
+            message_type = ord(message[pos:pos + 1])
+            if message_type == _ACK_TYPE:
+                _, request_id, offset, timestamp_ms = _ACK.unpack_from(message, pos)
+                pos += _ACK.size
+                result = (offset, timestamp_ms)
+            elif message_type == _ACK_ERROR_TYPE:
+                _, request_id, size = _ACK_ERROR.unpack_from(message, pos)
+                pos += _ACK_ERROR.size + size
+                result = pickle.loads(message[pos - size:pos])
+            elif message_type == _ACK_PARTITIONS_TYPE:
+                _, request_id, count = _ACK_PARTITIONS.unpack_from(message, pos)
+                result = list(struct.unpack_from('>%di' % count, message,
+                                                 pos + _ACK_PARTITIONS.size))
+                pos += _ACK_PARTITIONS.size + 4 * count
+            else:  # _ACK_CLOSED_TYPE
+                return False
+            # The future is gone if close() failed it already
+            future = self.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if message_type == _ACK_ERROR_TYPE:
+                future.failure(result)
+            else:
+                future.success(result)
+        return True
+
+    def fail_pending(self, error):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.failure(error)
+
+    def join(self, timeout=None):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            log.warning('Terminating producer process %s that did not exit'
+                        ' in time', self.process.name)
+            self.process.terminate()
+            self.process.join()
+        self._reader.join()
+
+
+class KafkaProducerPool(object):
+    """Publishes records through several producer processes, to spread
+    record encoding, compression and network I/O over more than one core.
+
+    Each process runs a :class:`~kafka.KafkaProducer` and owns a share of
+    the partitions of every topic, so records of a partition are always
+    sent by the same process, in the order they were handed off.
+    :meth:`send` serializes and partitions records in the calling process
+    and copies them to the process owning the partition through a shared
+    memory ring buffer. The returned futures resolve when that process
+    acknowledges the record through another ring buffer.
+
+    Configs not listed below are passed on to the KafkaProducer of each
+    process, so they must be picklable with the 'spawn' and 'forkserver'
+    start methods (e.g. no ssl_context). record_futures and
+    delivery_callback are not supported.
+
+    Keyword Arguments:
+        producer_processes (int): number of producer processes. Default: 2
+        ring_buffer_bytes (int): shared memory for the records queued for
+            each process, and for their acknowledgements. send() blocks up
+            to max_block_ms while the ring buffer of a process is full.
+            Default: 8388608 (8MB)
+        start_method (str): multiprocessing start method for the producer
+            processes, 'fork', 'spawn' or 'forkserver'. Forking a process
+            that runs other threads, e.g. a KafkaConsumer, can deadlock.
+            Default: None (the platform default)
+        client_id (str): used as the prefix of the client_id of each
+            producer, followed by the process number.
+            Default: 'kafka-python-producer-pool-#' (appended with a unique
+            number per instance)
+        key_serializer (callable): used to convert user-supplied keys to bytes
+            in the calling process. Default: None.
+        value_serializer (callable): used to convert user-supplied message
+            values to bytes in the calling process. Default: None.
+        partitioner (callable): chooses the partition of records with no
+            partition set, called with the serialized key, all partitions
+            and all partitions again, as the calling process does not track
+            partition leaders. Default: DefaultPartitioner()
+        max_block_ms (int): Number of milliseconds to block during
+            :meth:`send` for partition metadata or ring buffer space.
+            Also passed to the producers. Default: 60000.
+        metadata_max_age_ms (int): how long the partitions of a topic are
+            cached before asking a producer process again. Also passed to
+            the producers. Default: 300000
+    """
+    DEFAULT_CONFIG = {
+        'producer_processes': 2,
+        'ring_buffer_bytes': 8 * 1024 * 1024,
+        'start_method': None,
+        'client_id': None,
+        'key_serializer': None,
+        'value_serializer': None,
+        'partitioner': DefaultPartitioner(),
+        'max_block_ms': 60000,
+        'metadata_max_age_ms': 300000,
+    }
+
+    def __init__(self, **configs):
+        self.config = copy.copy(self.DEFAULT_CONFIG)
+        for key in self.config:
+            if key in configs:
+                self.config[key] = configs.pop(key)
+        assert self.config['producer_processes'] > 0, 'producer_processes must be positive'
+        for key in ('record_futures', 'delivery_callback'):
+            assert key not in configs, '%s is not supported by KafkaProducerPool' % key
+        for key in configs:
+            assert key in KafkaProducer.DEFAULT_CONFIG, 'Unrecognized configs: %s' % key
+
+        if self.config['client_id'] is None:
+            self.config['client_id'] = 'kafka-python-producer-pool-%s' % \
+                                       PRODUCER_CLIENT_ID_SEQUENCE.increment()
+        configs['max_block_ms'] = self.config['max_block_ms']
+        configs['metadata_max_age_ms'] = self.config['metadata_max_age_ms']
+
+        ctx = multiprocessing
+        if self.config['start_method'] is not None:
+            ctx = multiprocessing.get_context(self.config['start_method'])
+        self._metadata_lock = threading.Lock()
+        self._partitions = {}  # topic: (partitions, topic hash, fetched at)
+        self._closed = False
+        self._processes = []
+        try:
+            for i in range(self.config['producer_processes']):
+                client_id = '%s-%d' % (self.config['client_id'], i)
+                process_configs = dict(configs, client_id=client_id)
+                self._processes.append(ProducerProcess(
+                    ctx, process_configs, self.config['ring_buffer_bytes'],
+                    client_id))
+        except Exception:
+            self.close(timeout=0)
+            raise
+        log.debug("Kafka producer pool started")
+
+    def send(self, topic, value=None, key=None, partition=None, timestamp_ms=None):
+        """Publish a message to a topic, see :meth:`KafkaProducer.send`.
+
+        Returns:
+            FutureRecordMetadata: resolves to RecordMetadata once the
+                producer process owning the partition acknowledged the
+                record; checksum is always None
+
+        Raises:
+            KafkaTimeoutError: if unable to fetch topic metadata, or unable
+                to hand off the record within max_block_ms
+        """
+        assert not self._closed, 'KafkaProducerPool is closed'
+        assert not (value is None and key is None), 'Need at least one: key or value'
+        timeout = self.config['max_block_ms'] / 1000.0
+        key_bytes = self._serialize(self.config['key_serializer'], topic, key)
+        value_bytes = self._serialize(self.config['value_serializer'], topic, value)
+        partitions, topic_hash = self._wait_on_metadata(topic, timeout)
+        if partition is None:
+            partition = self.config['partitioner'](key_bytes, partitions, partitions)
+        else:
+            assert partition in partitions, 'Unrecognized partition'
+        process = self._processes[(topic_hash + partition) % len(self._processes)]
+
+        produce_future = FutureProduceResult(TopicPartition(topic, partition))
+        future = FutureRecordMetadata(
+            produce_future, 0, timestamp_ms, None,
+            len(key_bytes) if key_bytes is not None else -1,
+            len(value_bytes) if value_bytes is not None else -1)
+        topic_bytes = topic.encode('utf-8')
+
+        def message(request_id):
+            parts = [_SEND.pack(_SEND_TYPE, request_id, partition,
+                                timestamp_ms if timestamp_ms is not None else -1,
+                                len(topic_bytes),
+                                len(key_bytes) if key_bytes is not None else -1,
+                                len(value_bytes) if value_bytes is not None else -1),
+                     topic_bytes]
+            if key_bytes is not None:
+                parts.append(bytes(key_bytes))
+            if value_bytes is not None:
+                parts.append(bytes(value_bytes))
+            return b''.join(parts)
+
+        process.request(message, produce_future, timeout)
+        return future
+
+    def flush(self, timeout=None):
+        """Send all records handed off so far right away, and block until
+        they completed, see :meth:`KafkaProducer.flush`.
+
+        Raises:
+            KafkaTimeoutError: failure to flush buffered records within the
+                provided timeout
+        """
+        pending = []
+        for process in self._processes:
+            with process.lock:
+                pending.extend(process.pending.values())
+        # Written after the pending records, so they are all flushed
+        for process in self._processes:
+            process.notify(_FLUSH.pack(_FLUSH_TYPE), timeout)
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for future in pending:
+            remaining = None
+            if timeout is not None:
+                remaining = max(deadline - time.time(), 0)
+            if not future.wait(remaining):
+                raise Errors.KafkaTimeoutError(
+                    "Failed to flush buffered records within %s secs" % timeout)
+
+    def partitions_for(self, topic):
+        """Returns the list of all partitions of the topic."""
+        return list(self._wait_on_metadata(
+            topic, self.config['max_block_ms'] / 1000.0)[0])
+
+    def close(self, timeout=None):
+        """Close the producer of each process, then wait for the processes
+        to exit. Records not acknowledged by then fail.
+
+        Arguments:
+            timeout (float, optional): timeout in seconds for each producer
+                to complete sending its records.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        log.info("Closing the Kafka producer pool with %s secs timeout.", timeout)
+        message = _CLOSE.pack(_CLOSE_TYPE, timeout if timeout is not None else -1)
+        for process in self._processes:
+            if not process.notify(message, timeout):
+                log.warning('Could not ask producer process %s to close',
+                            process.process.name)
+        for process in self._processes:
+            # Give the producer time to close before terminating it
+            process.join(timeout + 5 if timeout is not None else None)
+            process.fail_pending(Errors.IllegalStateError(
+                'Producer pool closed before the record was acknowledged'))
+        for serializer in (self.config['key_serializer'], self.config['value_serializer']):
+            try:
+                serializer.close()
+            except AttributeError:
+                pass
+        log.debug("The Kafka producer pool has closed.")
+
+    def _wait_on_metadata(self, topic, max_wait):
+        """Return the partitions of the topic and the hash to assign them to
+        processes, asking a producer process if they are not cached.
+
+        Raises:
+            KafkaTimeoutError: if partitions for topic were not obtained before
+                specified max_wait timeout
+        """
+        now = time.time()
+        cached = self._partitions.get(topic)
+        if (cached is not None and
+                now - cached[2] < self.config['metadata_max_age_ms'] / 1000.0):
+            return cached[0], cached[1]
+
+        topic_bytes = topic.encode('utf-8')
+        topic_hash = murmur2(topic_bytes) & 0x7fffffff
+        future = Future()
+        done = threading.Event()
+        future.add_both(lambda _: done.set())
+        process = self._processes[topic_hash % len(self._processes)]
+        process.request(
+            lambda request_id: _PARTITIONS.pack(_PARTITIONS_TYPE, request_id,
+                                                len(topic_bytes)) + topic_bytes,
+            future, max_wait)
+        # The producer process waits up to max_block_ms itself
+        if not done.wait(max_wait + 1) and not done.is_set():
+            raise Errors.KafkaTimeoutError(
+                "Failed to update metadata after %.1f secs." % max_wait)
+        if future.failed():
+            raise future.exception # pylint: disable-msg=raising-bad-type
+        partitions = tuple(future.value)
+        with self._metadata_lock:
+            self._partitions[topic] = (partitions, topic_hash, now)
+        return partitions, topic_hash
+
+    def _serialize(self, f, topic, data):
+        if not f:
+            return data
+        if isinstance(f, Serializer):
+            return f.serialize(topic, data)
+        return f(data)
@@ -2,14 +2,18 @@ from __future__ import absolute_import
 
 import collections
 import copy
+import heapq
 import logging
 import threading
 import time
 
 import kafka.errors as Errors
-from kafka.producer.buffer import SimpleBufferPool
+from kafka.metrics.measurable import AnonMeasurable
+from kafka.metrics.stats import Rate
+from kafka.producer.buffer import BufferPool
 from kafka.producer.future import FutureRecordMetadata, FutureProduceResult
-from kafka.record.memory_records import MemoryRecordsBuilder
+from kafka.producer.spill import SpilledRecords
+from kafka.record.memory_records import MemoryRecords, MemoryRecordsBuilder
 from kafka.record.legacy_records import LegacyRecordBatchBuilder
 from kafka.structs import TopicPartition
 
@@ -36,8 +40,59 @@ class AtomicInteger(object):
         return self._val
 
 
+class PartitionLocks(object):
+    """A fixed set of locks shared by all TopicPartitions.
+
+    Each TopicPartition always maps to the same lock, so the locks can be
+    created up front and looked up without any locking of their own.
+    Partitions that share a lock only contend when appended to at the same
+    time.
+    """
+    def __init__(self, stripes=64):
+        self._locks = tuple(threading.Lock() for _ in range(stripes))
+
+    def __getitem__(self, tp):
+        return self._locks[hash(tp) % len(self._locks)]
+
+    def __iter__(self):
+        return iter(self._locks)
+
+
+class CompressionRatioEstimator(object):
+    """Tracks the compression ratio of closed batches per topic and codec.
+
+    Like the java client, the estimate starts at 1.0, improves slowly when
+    batches compress better than estimated and deteriorates quickly when
+    they compress worse, so that batches rarely overshoot batch_size.
+    """
+    IMPROVING_STEP = 0.005
+    DETERIORATE_STEP = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ratios = {}  # (topic, compression_attrs): ratio
+
+    def estimation(self, topic, compression_attrs):
+        return self._ratios.get((topic, compression_attrs), 1.0)
+
+    def reset(self, topic, compression_attrs):
+        with self._lock:
+            self._ratios.pop((topic, compression_attrs), None)
+
+    def update(self, topic, compression_attrs, observed_ratio):
+        key = (topic, compression_attrs)
+        with self._lock:
+            current = self._ratios.get(key, 1.0)
+            if observed_ratio > current:
+                current = max(current + self.DETERIORATE_STEP, observed_ratio)
+            elif observed_ratio < current:
+                current = max(current - self.IMPROVING_STEP, observed_ratio)
+            self._ratios[key] = current
+            return current
+
+
 class ProducerBatch(object):
-    def __init__(self, tp, records, buffer):
+    def __init__(self, tp, records, buffer, delivery_callback=None):
         self.max_record_size = 0
         now = time.time()
         self.created = now
@@ -48,26 +103,119 @@ class ProducerBatch(object):
         self.records = records
         self.topic_partition = tp
         self.produce_future = FutureProduceResult(tp)
+        self.closing = None  # WorkerFuture of records.close()
+        self.split_batches = None  # Batches records moved to when split
+        self._record_futures = []
         self._retry = False
-        self._buffer = buffer  # We only save it, we don't write to it
+        self._buffer = buffer  # Pooled buffer records are written to, if any
+        self.reserved = 0  # Buffer memory used beyond the pooled buffer
+        self._delivery_callback = delivery_callback
 
     @property
     def record_count(self):
         return self.records.next_offset()
 
-    def try_append(self, timestamp_ms, key, value):
+    def try_append(self, timestamp_ms, key, value, future=None):
+        """Append a record, return its FutureRecordMetadata or None if the
+        batch is full. future is the existing future of a record moved from
+        a batch that was split, or False to not track the record with a
+        future, in which case True is returned once appended."""
+        if self.closing is not None:
+            return None
         metadata = self.records.append(timestamp_ms, key, value)
         if metadata is None:
             return None
 
         self.max_record_size = max(self.max_record_size, metadata.size)
         self.last_append = time.time()
-        future = FutureRecordMetadata(self.produce_future, metadata.offset,
-                                      metadata.timestamp, metadata.crc,
-                                      len(key) if key is not None else -1,
-                                      len(value) if value is not None else -1)
+        if future is False:
+            self._record_futures.append(False)
+            return True
+        elif future is None:
+            future = FutureRecordMetadata(self.produce_future, metadata.offset,
+                                          metadata.timestamp, metadata.crc,
+                                          len(key) if key is not None else -1,
+                                          len(value) if value is not None else -1)
+        else:
+            future.rebind(self.produce_future, metadata.offset)
+        self._record_futures.append(future)
         return future
 
+    def try_append_many(self, records, start, record_set, futures=None):
+        """Append records[start:] until the batch is full, return the index
+        of the first record not appended.
+
+        Appended records are tracked by record_set, through a
+        FutureRecordMetadata per record appended to futures if it is a list.
+        """
+        if self.closing is not None:
+            return start
+        append = self.records.append
+        produce_future = self.produce_future
+        record_futures = self._record_futures
+        max_record_size = self.max_record_size
+        i = start
+        for i in range(start, len(records)):
+            timestamp_ms, key, value = records[i][:3]
+            metadata = append(timestamp_ms, key, value)
+            if metadata is None:
+                break
+            if metadata.size > max_record_size:
+                max_record_size = metadata.size
+            if futures is None:
+                record_futures.append(record_set)
+                continue
+            future = FutureRecordMetadata(produce_future, metadata.offset,
+                                          metadata.timestamp, metadata.crc,
+                                          len(key) if key is not None else -1,
+                                          len(value) if value is not None else -1)
+            record_futures.append(future)
+            record_set.add_record(future)
+            futures.append(future)
+        else:
+            i = len(records)
+        if i > start:
+            self.max_record_size = max_record_size
+            self.last_append = time.time()
+            if futures is None:
+                record_set.add_batch(produce_future, i - start)
+        return i
+
+    def split(self, batch_size, records_factory):
+        """Re-encode the records of this closed batch into batches of at
+        most batch_size bytes and half its records, moving the record
+        futures along.
+
+        Arguments:
+            batch_size (int): size of the new batches
+            records_factory (callable): returns a MemoryRecordsBuilder for
+                the given batch size
+
+        Returns:
+            list of ProducerBatch, in record order
+        """
+        batches = []
+        max_records = (len(self._record_futures) + 1) // 2
+        futures = iter(self._record_futures)
+        records = MemoryRecords(self.records.buffer())
+        while records.has_next():
+            for record in records.next_batch():
+                future = next(futures)
+                if (batches and batches[-1].record_count < max_records and
+                        batches[-1].try_append(record.timestamp, record.key,
+                                               record.value, future)):
+                    continue
+                # Batch buffers only bound memory use, which the split
+                # batches share with this one until it is deallocated
+                batch = ProducerBatch(self.topic_partition,
+                                      records_factory(batch_size), None,
+                                      self._delivery_callback)
+                batch.try_append(record.timestamp, record.key, record.value,
+                                 future)
+                batches.append(batch)
+        self.split_batches = batches
+        return batches
+
     def done(self, base_offset=None, timestamp_ms=None, exception=None):
         log.debug("Produced messages to topic-partition %s with base offset"
                   " %s and error %s.", self.topic_partition, base_offset,
@@ -79,6 +227,12 @@ class ProducerBatch(object):
             self.produce_future.success((base_offset, timestamp_ms))
         else:
             self.produce_future.failure(exception)
+        if self._delivery_callback is not None:
+            try:
+                self._delivery_callback(self.topic_partition, base_offset,
+                                        self.record_count, exception)
+            except Exception:
+                log.exception('Error processing delivery callback')
 
     def maybe_expire(self, request_timeout_ms, retry_backoff_ms, linger_ms, is_full):
         """Expire batches if metadata is not available
@@ -107,13 +261,51 @@ class ProducerBatch(object):
             error = "%d seconds have passed since last attempt plus backoff time" % since_backoff
 
         if error:
-            self.records.close()
+            self.close()
             self.done(-1, None, Errors.KafkaTimeoutError(
                 "Batch for %s containing %s record(s) expired: %s" % (
                 self.topic_partition, self.records.next_offset(), error)))
             return True
         return False
 
+    def close_async(self, pool, callback=None):
+        """Close (and compress) records on a WorkerPool thread.
+
+        The caller must hold the partition lock, so that no record is
+        appended once closing started.
+
+        Arguments:
+            pool (WorkerPool): pool to close records on
+            callback (callable, optional): called with the result once
+                records are closed, if this call starts closing them
+
+        Returns:
+            WorkerFuture: resolves once records are closed
+        """
+        if self.closing is None:
+            self.closing = pool.submit(self.records.close, callback=callback)
+        return self.closing
+
+    def close(self):
+        """Close records, waiting for a close started by close_async."""
+        if self.closing is not None:
+            self.closing.wait()
+        # No-op unless the asynchronous close failed, in which case the
+        # error is raised here
+        self.records.close()
+
+    def spill(self, spill):
+        """Close records and write them to spill (BatchSpill), after which
+        the pooled buffer is no longer used."""
+        self.close()
+        self.records = SpilledRecords(spill, self.records)
+        buf, self._buffer = self._buffer, None
+        return buf
+
+    @property
+    def spilled(self):
+        return isinstance(self.records, SpilledRecords)
+
     def in_retry(self):
         return self._retry
 
@@ -143,17 +335,41 @@ class RecordAccumulator(object):
             throughput (a batch size of zero will disable batching entirely).
             Default: 16384
         buffer_memory (int): The total bytes of memory the producer should use
-            to buffer records waiting to be sent to the server. If records are
-            sent faster than they can be delivered to the server the producer
-            will block up to max_block_ms, raising an exception on timeout.
-            In the current implementation, this setting is an approximation.
+            to buffer records waiting to be sent to the server, including
+            batches in flight. If records are sent faster than they can be
+            delivered to the server, buffer_overflow_policy applies.
             Default: 33554432 (32MB)
+        buffer_overflow_policy (str): What append does when buffer_memory
+            is exhausted: 'block' up to max_time_to_block_ms, 'fail' right
+            away, 'drop_oldest' batches not sent yet, failing their records,
+            or 'spill' full batches not sent yet to the spill files, until
+            the new batch fits. With 'spill', appends block once no batch
+            is left to spill. Appends raise BufferExhaustedError if memory
+            is still not available. Default: 'block'
+        spill (BatchSpill): Stores the batches spilled by the 'spill'
+            buffer_overflow_policy. Default: None
         compression_attrs (int): The compression type for all data generated by
             the producer. Valid values are gzip(1), snappy(2), lz4(3), or
             none(0).
             Compression is of full batches of data, so the efficacy of batching
             will also impact the compression ratio (more batching means better
             compression). Default: None.
+        streaming_compression (bool): Compress records as they are
+            appended, and apply batch_size to the compressed size (v2
+            message format only). Default: False
+        compression_pool (WorkerPool): If set, batches are closed and
+            compressed on these threads instead of the sender thread. Full
+            batches start compressing right away; other batches once they
+            are ready to send. Batches are only drained when compressed.
+            Default: None
+        wakeup (callable): Called when a batch compressed by
+            compression_pool becomes sendable, i.e. KafkaClient.wakeup.
+            Default: None
+        compression_level (int): The level used by compression_attrs, or
+            None for the codec default. Default: None.
+        topic_compression_attrs (dict): Maps topic names to the
+            (compression_attrs, compression_level) used for their batches
+            instead of the defaults above. Default: None.
         linger_ms (int): An artificial delay time to add before declaring a
             messageset (that isn't full) ready for sending. This allows
             time for more records to arrive. Setting a non-zero linger_ms
@@ -166,38 +382,99 @@ class RecordAccumulator(object):
     """
     DEFAULT_CONFIG = {
         'buffer_memory': 33554432,
+        'buffer_overflow_policy': 'block',
+        'spill': None,
         'batch_size': 16384,
         'compression_attrs': 0,
+        'compression_level': None,
+        'topic_compression_attrs': None,
+        'streaming_compression': False,
+        'compression_pool': None,
+        'delivery_callback': None,
+        'wakeup': None,
         'linger_ms': 0,
         'retry_backoff_ms': 100,
         'message_version': 0,
         'metrics': None,
         'metric_group_prefix': 'producer-metrics',
     }
+    OVERFLOW_POLICIES = ('block', 'fail', 'drop_oldest', 'spill')
 
     def __init__(self, **configs):
         self.config = copy.copy(self.DEFAULT_CONFIG)
         for key in self.config:
             if key in configs:
                 self.config[key] = configs.pop(key)
+        assert self.config['buffer_overflow_policy'] in self.OVERFLOW_POLICIES, (
+            'buffer_overflow_policy must be one of %s' % (self.OVERFLOW_POLICIES,))
+        assert (self.config['buffer_overflow_policy'] != 'spill' or
+                self.config['spill'] is not None), 'spill policy requires spill'
 
         self._closed = False
         self._flushes_in_progress = AtomicInteger()
-        self._appends_in_progress = AtomicInteger()
         self._batches = collections.defaultdict(collections.deque) # TopicPartition: [ProducerBatch]
-        self._tp_locks = {None: threading.Lock()} # TopicPartition: Lock, plus a lock to add entries
-        self._free = SimpleBufferPool(self.config['buffer_memory'],
-                                      self.config['batch_size'],
-                                      metrics=self.config['metrics'],
-                                      metric_group_prefix=self.config['metric_group_prefix'])
+        self._tp_locks = PartitionLocks()
+        self._free = BufferPool(self.config['buffer_memory'],
+                                self.config['batch_size'],
+                                metrics=self.config['metrics'],
+                                metric_group_prefix=self.config['metric_group_prefix'])
         self._incomplete = IncompleteProducerBatches()
+        self._compression_ratios = CompressionRatioEstimator()
+        # Leaders the sender could not send to when it last tried, and when,
+        # read by threads choosing partitions in partition_load()
+        self._unready_nodes = {}
         # The following variables should only be accessed by the sender thread,
         # so we don't need to protect them w/ locking.
         self.muted = set()
         self._drain_index = 0
+        # Partitions with batches, and when their first batch becomes
+        # sendable by linger_ms or retry_backoff_ms (0 if full). Only due
+        # partitions are checked by ready(), only indexed ones drained.
+        self._index_lock = threading.Lock()
+        self._deadlines = {}  # TopicPartition: deadline
+        self._deadline_heap = []  # (deadline, TopicPartition), lazily pruned
+        self._due = set()  # Partitions past their deadline, sender only
+        # Full batches, oldest first, that the spill policy may write out,
+        # as keys. Batches leave when spilled, drained or deallocated.
+        self._spill_lock = threading.Lock()
+        self._spill_candidates = collections.OrderedDict()
+
+        self._drop_sensor = None
+        if self.config['metrics']:
+            self._register_metrics(self.config['metrics'],
+                                   self.config['metric_group_prefix'])
+
+    def _register_metrics(self, metrics, group):
+        def add_gauge(name, description, measure):
+            metrics.add_metric(metrics.metric_name(name, group, description),
+                               AnonMeasurable(lambda *_: measure()))
+        pool = self._free
+        add_gauge('waiting-threads',
+                  'The number of threads blocked waiting for buffer memory.',
+                  pool.queued)
+        add_gauge('buffer-total-bytes',
+                  'The maximum amount of buffer memory the producer can use.',
+                  pool.total_memory)
+        add_gauge('buffer-available-bytes',
+                  'The total amount of buffer memory that is not being used'
+                  ' (either unallocated or in the free list).',
+                  pool.available_memory)
+        add_gauge('buffer-utilization',
+                  'The fraction of buffer memory used by batches.',
+                  lambda: 1 - pool.available_memory() / float(pool.total_memory()))
+        self._drop_sensor = metrics.sensor('dropped-records')
+        self._drop_sensor.add(metrics.metric_name(
+            'record-drop-rate', group,
+            'The average per-second number of records dropped by the'
+            ' drop_oldest buffer_overflow_policy.'), Rate())
+        spill = self.config['spill']
+        if spill is not None:
+            add_gauge('spilled-bytes',
+                      'The bytes of batches spilled to disk and not yet'
+                      ' acknowledged.', spill.spilled_bytes)
 
     def append(self, tp, timestamp_ms, key, value, max_time_to_block_ms,
-               estimated_size=0):
+               estimated_size=0, abort_on_new_batch=False, record_future=True):
         """Add a record to the accumulator, return the append result.
 
         The append result will contain the future metadata, and flag for
@@ -211,66 +488,332 @@ class RecordAccumulator(object):
             value (bytes): The value for the record
             max_time_to_block_ms (int): The maximum time in milliseconds to
                 block for buffer memory to be available
+            abort_on_new_batch (bool): Return without appending if the
+                record does not fit in an existing batch, so the caller can
+                choose another partition before a new batch is created
+            record_future (bool): Create a FutureRecordMetadata for the
+                record. If False, future is True once the record is appended
 
         Returns:
-            tuple: (future, batch_is_full, new_batch_created)
+            tuple: (future, batch_is_full, new_batch_created), future is None
+                if the append was aborted for abort_on_new_batch
         """
         assert isinstance(tp, TopicPartition), 'not TopicPartition'
         assert not self._closed, 'RecordAccumulator is closed'
-        # We keep track of the number of appending thread to make sure we do
-        # not miss batches in abortIncompleteBatches().
-        self._appends_in_progress.increment()
-        try:
-            if tp not in self._tp_locks:
-                with self._tp_locks[None]:
-                    if tp not in self._tp_locks:
-                        self._tp_locks[tp] = threading.Lock()
+        future_arg = None if record_future else False  # see try_append()
+        lock = self._tp_locks[tp]
+        with lock:
+            # check if we have an in-progress batch
+            dq = self._batches[tp]
+            if dq:
+                last = dq[-1]
+                future = last.try_append(timestamp_ms, key, value, future_arg)
+                if future is not None:
+                    return future, self._appended(tp, dq), False
+                self._batch_full(last)
+
+        if abort_on_new_batch:
+            return None, False, False
+
+        size = max(self.config['batch_size'], estimated_size)
+        log.debug("Allocating a new %d byte message buffer for %s", size, tp) # trace
+        buf = self._allocate(size, max_time_to_block_ms)
+        with lock:
+            # Need to check if producer is closed again after grabbing the
+            # dequeue lock. abort_incomplete_batches() relies on this.
+            assert not self._closed, 'RecordAccumulator is closed'
+
+            if dq:
+                last = dq[-1]
+                future = last.try_append(timestamp_ms, key, value, future_arg)
+                if future is not None:
+                    # Somebody else found us a batch, return the one we
+                    # waited for! Hopefully this doesn't happen often...
+                    self._free.deallocate(buf)
+                    return future, self._appended(tp, dq), False
+
+            if dq:
+                self._batch_full(dq[-1])
+            records = self._records_builder(tp.topic, buffer=buf)
+            batch = ProducerBatch(tp, records, buf,
+                                  self.config['delivery_callback'])
+            future = batch.try_append(timestamp_ms, key, value, future_arg)
+            if not future:
+                raise Exception()
+
+            dq.append(batch)
+            self._incomplete.add(batch)
+            self._schedule(tp, dq)
+            return future, self._appended(tp, dq, new_batch=True), True
+
+    def _appended(self, tp, dq, new_batch=False):
+        """Update the send index after records were added to the last batch
+        of dq, under the partition lock.
 
-            with self._tp_locks[tp]:
-                # check if we have an in-progress batch
-                dq = self._batches[tp]
-                if dq:
-                    last = dq[-1]
-                    future = last.try_append(timestamp_ms, key, value)
-                    if future is not None:
-                        batch_is_full = len(dq) > 1 or last.records.is_full()
-                        return future, batch_is_full, False
+        Returns:
+            bool: whether a batch of the partition is full
+        """
+        if dq[-1].records.is_full():
+            # Only happens once per batch, as a full batch takes no more
+            # records
+            self._reserve_overflow(dq[-1])
+            self._schedule(tp, dq)
+            self._compress_full_batches(dq)
+            return True
+        if len(dq) > 1:
+            # The batches before the last one were reserved when they
+            # refused a record and scheduled when the next one was created
+            if new_batch:
+                self._compress_full_batches(dq)
+            return True
+        return False
+
+    def append_many(self, tp, records, max_time_to_block_ms, record_set,
+                    futures=None):
+        """Add records to the accumulator, taking the partition lock once
+        per batch rather than once per record.
 
-            size = max(self.config['batch_size'], estimated_size)
+        Arguments:
+            tp (TopicPartition): The topic/partition of the records
+            records (list): (timestamp_ms, key, value, estimated_size) tuples
+            max_time_to_block_ms (int): The maximum time in milliseconds to
+                block for buffer memory to be available
+            record_set (FutureRecordSet): tracks the appended records
+            futures (list, optional): if set, a FutureRecordMetadata is
+                created for each record and appended to it, in order
+
+        Returns:
+            tuple: (batch_is_full, new_batch_created)
+        """
+        assert isinstance(tp, TopicPartition), 'not TopicPartition'
+        assert not self._closed, 'RecordAccumulator is closed'
+        new_batch_created = False
+        i = 0
+        lock = self._tp_locks[tp]
+        with lock:
+            dq = self._batches[tp]
+            if dq:
+                i = dq[-1].try_append_many(records, i, record_set, futures)
+                if i == len(records):
+                    return self._appended(tp, dq), False
+                self._batch_full(dq[-1])
+
+        while i < len(records):
+            size = max(self.config['batch_size'], records[i][3])
             log.debug("Allocating a new %d byte message buffer for %s", size, tp) # trace
-            buf = self._free.allocate(size, max_time_to_block_ms)
-            with self._tp_locks[tp]:
-                # Need to check if producer is closed again after grabbing the
-                # dequeue lock.
+            buf = self._allocate(size, max_time_to_block_ms)
+            with lock:
                 assert not self._closed, 'RecordAccumulator is closed'
-
                 if dq:
-                    last = dq[-1]
-                    future = last.try_append(timestamp_ms, key, value)
-                    if future is not None:
-                        # Somebody else found us a batch, return the one we
-                        # waited for! Hopefully this doesn't happen often...
+                    i = dq[-1].try_append_many(records, i, record_set, futures)
+                    if i == len(records):
                         self._free.deallocate(buf)
-                        batch_is_full = len(dq) > 1 or last.records.is_full()
-                        return future, batch_is_full, False
-
-                records = MemoryRecordsBuilder(
-                    self.config['message_version'],
-                    self.config['compression_attrs'],
-                    self.config['batch_size']
-                )
-
-                batch = ProducerBatch(tp, records, buf)
-                future = batch.try_append(timestamp_ms, key, value)
-                if not future:
-                    raise Exception()
-
+                        break
+                    self._batch_full(dq[-1])
+                batch = ProducerBatch(tp, self._records_builder(tp.topic, buffer=buf), buf,
+                                      self.config['delivery_callback'])
+                i = batch.try_append_many(records, i, record_set, futures)
+                if i < len(records):
+                    self._batch_full(batch)
                 dq.append(batch)
                 self._incomplete.add(batch)
-                batch_is_full = len(dq) > 1 or batch.records.is_full()
-                return future, batch_is_full, True
-        finally:
-            self._appends_in_progress.decrement()
+                new_batch_created = True
+
+        with lock:
+            if not dq:
+                return False, new_batch_created
+            self._schedule(tp, dq)
+            return self._appended(tp, dq, new_batch_created), new_batch_created
+
+    def _allocate(self, size, max_time_to_block_ms):
+        """Allocate a batch buffer as configured by buffer_overflow_policy."""
+        policy = self.config['buffer_overflow_policy']
+        if policy == 'block':
+            return self._free.allocate(size, max_time_to_block_ms)
+        while True:
+            try:
+                return self._free.allocate(size, 0)
+            except Errors.BufferExhaustedError:
+                if policy == 'drop_oldest' and self._drop_oldest_batch():
+                    continue
+                elif policy == 'spill':
+                    if self._spill_batch():
+                        continue
+                    # Only batches being filled or sent hold memory now
+                    return self._free.allocate(size, max_time_to_block_ms)
+                raise
+
+    def _batch_full(self, batch):
+        """Called with the partition lock held once batch has no room for a
+        record, which makes its size final."""
+        self._reserve_overflow(batch)
+        if self.config['buffer_overflow_policy'] == 'spill':
+            with self._spill_lock:
+                self._spill_candidates[batch] = None
+
+    def _discard_spill_candidate(self, batch):
+        if self.config['buffer_overflow_policy'] == 'spill':
+            with self._spill_lock:
+                self._spill_candidates.pop(batch, None)
+
+    def _spill_batch(self):
+        """Write the oldest full batch not drained yet to the spill files
+        and free its memory, return False if there is none."""
+        while True:
+            with self._spill_lock:
+                if not self._spill_candidates:
+                    return False
+                batch, _ = self._spill_candidates.popitem(last=False)
+            with self._tp_locks[batch.topic_partition]:
+                # It stays in its deque, keeping the order of partition
+                # batches
+                if (batch.drained is not None or batch.spilled or
+                        batch.produce_future.is_done):
+                    continue
+                try:
+                    buf = batch.spill(self.config['spill'])
+                except (IOError, OSError) as e:
+                    log.error("Failed to spill batch for %s: %s",
+                              batch.topic_partition, e)
+                    return False
+            log.debug("Spilled %s", batch)  # trace
+            if buf is not None:
+                self._free.deallocate(buf)
+            if batch.reserved:
+                self._free.release(batch.reserved)
+                batch.reserved = 0
+            return True
+
+    def _drop_oldest_batch(self):
+        """Fail and deallocate the oldest batch not drained yet, return
+        False if there is none."""
+        oldest = None
+        for tp in self._pending_partitions():
+            try:
+                batch = self._batches[tp][0]
+            except IndexError:
+                continue
+            if oldest is None or batch.created < oldest.created:
+                oldest = batch
+        if oldest is None:
+            return False
+
+        tp = oldest.topic_partition
+        with self._tp_locks[tp]:
+            dq = self._batches[tp]
+            if not dq or dq[0] is not oldest:
+                # Drained or dropped meanwhile, freeing memory anyway
+                return True
+            dq.popleft()
+            self._schedule(tp, dq)
+            oldest.close()
+        log.warning("Dropping %d record(s) for %s to free buffer memory",
+                    oldest.record_count, tp)
+        if self._drop_sensor is not None:
+            self._drop_sensor.record(oldest.record_count)
+        oldest.done(-1, None, Errors.BufferExhaustedError(
+            "Batch for %s containing %s record(s) dropped to free buffer"
+            " memory" % (tp, oldest.record_count)))
+        self.deallocate(oldest)
+        return True
+
+    def _head_deadline(self, dq):
+        """Return when the first batch of dq becomes sendable if the
+        accumulator is not exhausted or flushing, 0 if it is full."""
+        batch = dq[0]
+        full = len(dq) > 1 or batch.records.is_full()
+        if batch.attempts > 0:
+            backoff_end = batch.last_attempt + self.config['retry_backoff_ms'] / 1000.0
+            if full:
+                return backoff_end
+            return max(backoff_end,
+                       batch.last_attempt + self.config['linger_ms'] / 1000.0)
+        elif full:
+            return 0
+        return batch.last_attempt + self.config['linger_ms'] / 1000.0
+
+    def _schedule(self, tp, dq, force=False):
+        """Index tp by the deadline of its first batch, or remove it if dq
+        is empty. Caller holds the partition lock."""
+        deadline = self._head_deadline(dq) if dq else None
+        if not force and self._deadlines.get(tp) == deadline:
+            return
+        with self._index_lock:
+            if deadline is None:
+                self._deadlines.pop(tp, None)
+            else:
+                self._deadlines[tp] = deadline
+                heapq.heappush(self._deadline_heap, (deadline, tp))
+
+    def _pending_partitions(self):
+        """Return the partitions that have batches."""
+        with self._index_lock:
+            return list(self._deadlines)
+
+    def _reserve_overflow(self, batch):
+        """Account in the buffer pool for the bytes batch uses beyond its
+        pooled buffer, e.g. records appended on an estimated compression
+        ratio or compression overhead."""
+        buffer = batch.buffer()
+        overflow = batch.records.memory_size()
+        if buffer is not None:
+            overflow = max(0, overflow - len(buffer))
+        if overflow > batch.reserved:
+            self._free.reserve(overflow - batch.reserved)
+        elif overflow < batch.reserved:
+            self._free.release(batch.reserved - overflow)
+        batch.reserved = overflow
+
+    def _compress_full_batches(self, dq):
+        # Caller holds the partition lock
+        if self.config['compression_pool'] is None:
+            return
+        for batch in dq:
+            if batch.closing is None and (batch is not dq[-1] or
+                                          batch.records.is_full()):
+                self._close_async(batch)
+
+    def _close_async(self, batch):
+        """Start closing batch on the compression pool if needed, return
+        whether its records are closed and it may be drained."""
+        if self.config['compression_pool'] is None:
+            return True
+        if batch.closing is None:
+            wakeup = self.config['wakeup']
+            callback = None
+            if wakeup is not None:
+                callback = lambda _: wakeup()
+            batch.close_async(self.config['compression_pool'], callback)
+        return batch.closing.is_done
+
+    def _records_builder(self, topic, batch_size=None, ratio=None, buffer=None):
+        compression_attrs, compression_level = self._compression(topic)
+        if compression_attrs and ratio is None:
+            ratio = self._compression_ratios.estimation(
+                topic, compression_attrs)
+        return MemoryRecordsBuilder(
+            self.config['message_version'],
+            compression_attrs,
+            batch_size or self.config['batch_size'],
+            compression_level=compression_level,
+            streaming_compression=self.config['streaming_compression'],
+            estimated_compression_ratio=ratio,
+            buffer=buffer
+        )
+
+    def _update_compression_ratio(self, batch):
+        topic = batch.topic_partition.topic
+        compression_attrs = self._compression(topic)[0]
+        if compression_attrs:
+            self._compression_ratios.update(
+                topic, compression_attrs, batch.records.compression_rate())
+
+    def _compression(self, topic):
+        """Return (compression_attrs, compression_level) for topic batches"""
+        topic_compression = self.config['topic_compression_attrs']
+        if topic_compression and topic in topic_compression:
+            return topic_compression[topic]
+        return self.config['compression_attrs'], self.config['compression_level']
 
     def abort_expired_batches(self, request_timeout_ms, cluster):
         """Abort the batches that have been sitting in RecordAccumulator for
@@ -287,8 +830,7 @@ class RecordAccumulator(object):
         expired_batches = []
         to_remove = []
         count = 0
-        for tp in list(self._batches.keys()):
-            assert tp in self._tp_locks, 'TopicPartition not in locks dict'
+        for tp in self._pending_partitions():
 
             # We only check if the batch should be expired if the partition
             # does not have a batch in flight. This is to avoid the later
@@ -325,6 +867,7 @@ class RecordAccumulator(object):
                     for batch in to_remove:
                         dq.remove(batch)
                     to_remove = []
+                    self._schedule(tp, dq)
 
         if expired_batches:
             log.debug("Expired %d batches in accumulator", count) # trace
@@ -338,13 +881,47 @@ class RecordAccumulator(object):
         batch.last_attempt = now
         batch.last_append = now
         batch.set_retry()
-        assert batch.topic_partition in self._tp_locks, 'TopicPartition not in locks dict'
         assert batch.topic_partition in self._batches, 'TopicPartition not in batches'
         dq = self._batches[batch.topic_partition]
         with self._tp_locks[batch.topic_partition]:
             dq.appendleft(batch)
+            self._schedule(batch.topic_partition, dq)
+
+    def split_and_reenqueue(self, batch):
+        """Split a batch the broker rejected as too large into smaller
+        batches and re-enqueue them in order, to be sent right away.
 
-    def ready(self, cluster):
+        The new batches hold at most half the records of the rejected one,
+        so records are eventually sent one per batch if need be.
+
+        Returns:
+            int: the number of batches the records were split into
+        """
+        tp = batch.topic_partition
+        compression_attrs = self._compression(tp.topic)[0]
+        ratio = None
+        if compression_attrs:
+            # The estimate was too optimistic, start over
+            self._compression_ratios.reset(tp.topic, compression_attrs)
+            ratio = batch.records.compression_rate()
+        batch_size = min(self.config['batch_size'],
+                         batch.records.size_in_bytes() // 2)
+        batches = batch.split(
+            batch_size,
+            lambda size: self._records_builder(tp.topic, size, ratio))
+        for split_batch in batches:
+            split_batch.records.close()
+            self._reserve_overflow(split_batch)
+            self._incomplete.add(split_batch)
+        with self._tp_locks[tp]:
+            self._batches[tp].extendleft(reversed(batches))
+            self._schedule(tp, self._batches[tp])
+        # Wake up threads waiting on the batch, they will find the
+        # split_batches or the rebound record futures
+        batch.produce_future.release()
+        return len(batches)
+
+    def ready(self, cluster, throttle_delay=None):
         """
         Get a list of nodes whose partitions are ready to be sent, and the
         earliest time at which any non-sendable partition will be ready;
@@ -356,6 +933,7 @@ class RecordAccumulator(object):
          * There is at least one partition that is not backing off its send
          * and those partitions are not muted (to prevent reordering if
            max_in_flight_requests_per_connection is set to 1)
+         * and the node is not throttled by a broker quota
          * and any of the following are true:
 
            * The record set is full
@@ -368,6 +946,8 @@ class RecordAccumulator(object):
 
         Arguments:
             cluster (ClusterMetadata):
+            throttle_delay (callable, optional): returns the milliseconds a
+                node_id remains throttled, e.g. KafkaClient.throttle_delay
 
         Returns:
             tuple:
@@ -381,10 +961,22 @@ class RecordAccumulator(object):
         now = time.time()
 
         exhausted = bool(self._free.queued() > 0)
-        # several threads are accessing self._batches -- to simplify
-        # concurrent access, we iterate over a snapshot of partitions
-        # and lock each partition separately as needed
-        partitions = list(self._batches.keys())
+        urgent = exhausted or self._closed or self._flush_in_progress()
+        with self._index_lock:
+            heap = self._deadline_heap
+            while heap and heap[0][0] <= now:
+                deadline, tp = heapq.heappop(heap)
+                if self._deadlines.get(tp) == deadline:
+                    self._due.add(tp)
+            if heap:
+                # May be outdated, which only wakes the sender up early
+                next_ready_check = max(heap[0][0] - now, 0)
+            # Partitions are otherwise not sendable before their deadline
+            if urgent:
+                partitions = list(self._deadlines)
+            else:
+                partitions = list(self._due)
+        throttled = {}
         for tp in partitions:
             leader = cluster.leader_for_partition(tp)
             if leader is None or leader == -1:
@@ -394,10 +986,17 @@ class RecordAccumulator(object):
                 continue
             elif tp in self.muted:
                 continue
+            elif throttle_delay is not None:
+                if leader not in throttled:
+                    throttled[leader] = throttle_delay(leader) / 1000.0
+                if throttled[leader] > 0:
+                    next_ready_check = min(throttled[leader], next_ready_check)
+                    continue
 
             with self._tp_locks[tp]:
                 dq = self._batches[tp]
                 if not dq:
+                    self._due.discard(tp)
                     continue
                 batch = dq[0]
                 retry_backoff = self.config['retry_backoff_ms'] / 1000.0
@@ -410,11 +1009,16 @@ class RecordAccumulator(object):
                 full = bool(len(dq) > 1 or batch.records.is_full())
                 expired = bool(waited_time >= time_to_wait)
 
-                sendable = (full or expired or exhausted or self._closed or
-                            self._flush_in_progress())
+                sendable = full or expired or urgent
 
                 if sendable and not backing_off:
-                    ready_nodes.add(leader)
+                    # Batches compressing on the pool wake up the sender
+                    # once they are done. Check again after retry_backoff in
+                    # case the wakeup is missed, e.g. without a wakeup config.
+                    if self._close_async(batch):
+                        ready_nodes.add(leader)
+                    else:
+                        next_ready_check = min(retry_backoff, next_ready_check)
                 else:
                     # Note that this results in a conservative estimate since
                     # an un-sendable partition may have a leader that will
@@ -422,12 +1026,54 @@ class RecordAccumulator(object):
                     # good enough since we'll just wake up and then sleep again
                     # for the remaining time.
                     next_ready_check = min(time_left, next_ready_check)
+                    if tp in self._due:
+                        # Its first batch changed since, e.g. to a retry
+                        self._due.discard(tp)
+                        self._schedule(tp, dq, force=True)
 
         return ready_nodes, next_ready_check, unknown_leaders_exist
 
+    def update_node_readiness(self, node_id, ready):
+        """Record whether the sender could send to node_id."""
+        if ready:
+            self._unready_nodes.pop(node_id, None)
+        else:
+            self._unready_nodes[node_id] = time.time()
+
+    def partition_load(self, cluster, topic):
+        """Return the bytes queued in each partition of topic.
+
+        Partitions whose leader is unknown, or was not ready the last time
+        the sender had data for it within retry_backoff_ms, are left out.
+
+        Arguments:
+            cluster (ClusterMetadata): current metadata
+            topic (str): topic name
+
+        Returns:
+            dict: {partition: queued bytes}
+        """
+        load = {}
+        backoff_start = time.time() - self.config['retry_backoff_ms'] / 1000.0
+        unready_nodes = set(node_id for node_id, unready_since
+                            in list(self._unready_nodes.items())
+                            if unready_since > backoff_start)
+        for partition in cluster.partitions_for_topic(topic) or ():
+            tp = TopicPartition(topic, partition)
+            leader = cluster.leader_for_partition(tp)
+            if leader is None or leader == -1 or leader in unready_nodes:
+                continue
+            queued = 0
+            if self._batches.get(tp):
+                with self._tp_locks[tp]:
+                    queued = sum(batch.records.size_in_bytes()
+                                 for batch in self._batches[tp])
+            load[partition] = queued
+        return load
+
     def has_unsent(self):
         """Return whether there is any unsent record in the accumulator."""
-        for tp in list(self._batches.keys()):
+        for tp in self._pending_partitions():
             with self._tp_locks[tp]:
                 dq = self._batches[tp]
                 if len(dq):
@@ -454,10 +1100,17 @@ class RecordAccumulator(object):
 
         now = time.time()
         batches = {}
+        # Leaders may change with metadata, so group partitions by node here
+        partitions_by_node = collections.defaultdict(list)
+        for tp in self._pending_partitions():
+            partitions_by_node[cluster.leader_for_partition(tp)].append(tp)
         for node_id in nodes:
             size = 0
-            partitions = list(cluster.partitions_for_broker(node_id))
+            partitions = partitions_by_node.get(node_id)
             ready = []
+            if not partitions:
+                batches[node_id] = ready
+                continue
             # to make starvation less likely this loop doesn't start at 0
             self._drain_index %= len(partitions)
             start = self._drain_index
@@ -475,7 +1128,8 @@ class RecordAccumulator(object):
                                      > now)
                             )
                             # Only drain the batch if it is not during backoff
-                            if not backoff:
+                            # and done compressing
+                            if not backoff and self._close_async(first):
                                 if (size + first.records.size_in_bytes() > max_size
                                     and len(ready) > 0):
                                     # there is a rare case that a single batch
@@ -486,7 +1140,12 @@ class RecordAccumulator(object):
                                     break
                                 else:
                                     batch = dq.popleft()
-                                    batch.records.close()
+                                    self._schedule(tp, dq)
+                                    self._discard_spill_candidate(batch)
+                                    batch.close()
+                                    self._reserve_overflow(batch)
+                                    if batch.drained is None:
+                                        self._update_compression_ratio(batch)
                                     size += batch.records.size_in_bytes()
                                     ready.append(batch)
                                     batch.drained = now
@@ -502,7 +1161,14 @@ class RecordAccumulator(object):
     def deallocate(self, batch):
         """Deallocate the record batch."""
         self._incomplete.remove(batch)
-        self._free.deallocate(batch.buffer())
+        self._discard_spill_candidate(batch)
+        if batch.buffer() is not None:
+            self._free.deallocate(batch.buffer())
+        if batch.reserved:
+            self._free.release(batch.reserved)
+            batch.reserved = 0
+        if batch.spilled:
+            batch.records.release()
 
     def _flush_in_progress(self):
         """Are there any threads currently waiting on a flush?"""
@@ -520,11 +1186,16 @@ class RecordAccumulator(object):
         Mark all partitions as ready to send and block until the send is complete
         """
         try:
-            for batch in self._incomplete.all():
+            batches = collections.deque(self._incomplete.all())
+            while batches:
+                batch = batches.popleft()
                 log.debug('Waiting on produce to %s',
                           batch.produce_future.topic_partition)
                 if not batch.produce_future.wait(timeout=timeout):
                     raise Errors.KafkaTimeoutError('Timeout waiting for future')
+                if batch.split_batches is not None:
+                    batches.extend(batch.split_batches)
+                    continue
                 if not batch.produce_future.is_done:
                     raise Errors.UnknownError('Future not done')
 
@@ -538,19 +1209,20 @@ class RecordAccumulator(object):
         This function is only called when sender is closed forcefully. It will fail all the
         incomplete batches and return.
         """
-        # We need to keep aborting the incomplete batch until no thread is trying to append to
-        # 1. Avoid losing batches.
-        # 2. Free up memory in case appending threads are blocked on buffer full.
-        # This is a tight loop but should be able to get through very quickly.
-        while True:
-            self._abort_batches()
-            if not self._appends_in_progress.get():
-                break
-        # After this point, no thread will append any messages because they will see the close
-        # flag set. We need to do the last abort after no thread was appending in case the there was a new
-        # batch appended by the last appending thread.
+        # Aborting frees up memory in case appending threads are blocked on
+        # buffer full. Appends check the close flag before adding a batch
+        # under the partition lock, so once every lock was taken no thread
+        # adds any more batches, and the last abort catches the batches added
+        # by threads that held a lock before.
+        self._abort_batches()
+        for lock in self._tp_locks:
+            with lock:
+                pass
         self._abort_batches()
         self._batches.clear()
+        with self._index_lock:
+            self._deadlines.clear()
+            del self._deadline_heap[:]
 
     def _abort_batches(self):
         """Go through incomplete batches and abort them."""
@@ -559,7 +1231,7 @@ class RecordAccumulator(object):
             tp = batch.topic_partition
             # Close the batch before aborting
             with self._tp_locks[tp]:
-                batch.records.close()
+                batch.close()
             batch.done(exception=error)
             self.deallocate(batch)
 
@@ -93,7 +93,7 @@ class Sender(threading.Thread):
             self._client.add_topic(self._topics_to_add.pop())
 
         # get the list of partitions with data ready to send
-        result = self._accumulator.ready(self._metadata)
+        result = self._accumulator.ready(self._metadata, self._client.throttle_delay)
         ready_nodes, next_ready_check_delay, unknown_leaders_exist = result
 
         # if there are any partitions whose leaders are not known yet, force
@@ -110,6 +110,9 @@ class Sender(threading.Thread):
                 ready_nodes.remove(node)
                 not_ready_timeout = min(not_ready_timeout,
                                         self._client.connection_delay(node))
+                self._accumulator.update_node_readiness(node, False)
+            else:
+                self._accumulator.update_node_readiness(node, True)
 
         # create produce requests
         batches_by_node = self._accumulator.drain(
@@ -198,7 +201,7 @@ class Sender(threading.Thread):
                         partition, error_code, offset = partition_info
                         ts = None
                     else:
-                        partition, error_code, offset, ts = partition_info
+                        partition, error_code, offset, ts = partition_info[:4]
                     tp = TopicPartition(topic, partition)
                     error = Errors.for_code(error_code)
                     batch = batches_by_partition[tp]
@@ -225,7 +228,18 @@ class Sender(threading.Thread):
         if error is Errors.NoError:
             error = None
 
-        if error is not None and self._can_retry(batch, error):
+        if (error is Errors.MessageSizeTooLargeError and
+                batch.record_count > 1 and not batch.produce_future.is_done):
+            # the batch may have grown too large for the broker due to
+            # compression, retry its records in smaller batches
+            count = self._accumulator.split_and_reenqueue(batch)
+            log.warning("Got error produce response on topic-partition %s,"
+                        " splitting %d records into %d batches. Error: %s",
+                        batch.topic_partition, batch.record_count, count,
+                        error)
+            self._accumulator.deallocate(batch)
+            self._sensors.record_batch_split()
+        elif error is not None and self._can_retry(batch, error):
             # retry
             log.warning("Got error produce response on topic-partition %s,"
                         " retrying (%d attempts left). Error: %s",
@@ -292,7 +306,10 @@ class Sender(threading.Thread):
             produce_records_by_partition[topic][partition] = buf
 
         kwargs = {}
-        if self.config['api_version'] >= (0, 11):
+        if self.config['api_version'] >= (2, 1):
+            version = 7
+            kwargs = dict(transactional_id=None)
+        elif self.config['api_version'] >= (0, 11):
             version = 3
             kwargs = dict(transactional_id=None)
         elif self.config['api_version'] >= (0, 10):
@@ -376,6 +393,12 @@ class SenderMetrics(object):
                         sensor_name=sensor_name,
                         description='The average per-second number of retried record sends')
 
+        sensor_name = 'batch-split'
+        self.batch_split_sensor = self.metrics.sensor(sensor_name)
+        self.add_metric('batch-split-rate', Rate(),
+                        sensor_name=sensor_name,
+                        description='The average number of batch splits per second')
+
         sensor_name = 'errors'
         self.error_sensor = self.metrics.sensor(sensor_name)
         self.add_metric('record-error-rate', Rate(),
@@ -486,6 +509,9 @@ class SenderMetrics(object):
         if sensor:
             sensor.record(count)
 
+    def record_batch_split(self):
+        self.batch_split_sensor.record()
+
     def record_errors(self, topic, count):
         self.error_sensor.record(count)
         sensor = self.metrics.get_sensor('topic.' + topic + '.record-errors')
@@ -0,0 +1,170 @@
+from __future__ import absolute_import, division
+
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class SpillSegment(object):
+    """An append-only spill file, read through a memory map."""
+    def __init__(self, path):
+        self.path = path
+        self.position = 0
+        self.live = 0  # Batches written and not released
+        self._file = open(path, 'w+b')
+        self._mmap = None
+
+    def write(self, data):
+        position = self.position
+        self._file.write(data)
+        # Make the batch visible to the map
+        self._file.flush()
+        self.position += len(data)
+        self.live += 1
+        return position
+
+    def read(self, position, size):
+        if self._mmap is None or position + size > len(self._mmap):
+            # Map the file again to include batches written since
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), self.position,
+                                   access=mmap.ACCESS_READ)
+        return self._mmap[position:position + size]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+        os.remove(self.path)
+
+
+class BatchSpill(object):
+    """
+    Stores record batches that do not fit in the producer buffer memory on
+    disk, so that long broker outages do not grow the Python heap.
+
+    Batches are appended as raw record batch bytes to segment files in a
+    private directory under directory, and read back through memory maps
+    when they are sent. Once segment_bytes were written to a segment a new
+    one is started, and segments are deleted when all of their batches are
+    released.
+
+    Arguments:
+        directory (str): directory to create the spill files in
+        segment_bytes (int): bytes written to a spill file before
+            starting a new one. Default: 67108864 (64MB)
+    """
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024):
+        self._directory = tempfile.mkdtemp(prefix='kafka-producer-',
+                                           dir=directory)
+        self._segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._segment = None
+        self._segments = set()
+        self._next_segment = 0
+        self._spilled_bytes = 0
+
+    def write(self, data):
+        """Append a record batch to the spill files.
+
+        Returns:
+            tuple: (segment, position) to read the batch back with
+
+        Raises:
+            IOError, OSError: if the batch could not be written
+        """
+        with self._lock:
+            if (self._segment is None or
+                    self._segment.position >= self._segment_bytes):
+                self._roll()
+            position = self._segment.write(data)
+            self._spilled_bytes += len(data)
+            return self._segment, position
+
+    def _roll(self):
+        if self._segment is not None and not self._segment.live:
+            self._remove(self._segment)
+        path = os.path.join(self._directory, '%020d.spill' % self._next_segment)
+        self._next_segment += 1
+        self._segment = SpillSegment(path)
+        self._segments.add(self._segment)
+
+    def _remove(self, segment):
+        self._segments.discard(segment)
+        segment.close()
+
+    def read(self, segment, position, size):
+        """Read back a batch written with write()."""
+        with self._lock:
+            return segment.read(position, size)
+
+    def release(self, segment, size):
+        """Free the disk space of a batch that is no longer needed."""
+        with self._lock:
+            segment.live -= 1
+            self._spilled_bytes -= size
+            if not segment.live and segment is not self._segment:
+                self._remove(segment)
+
+    def spilled_bytes(self):
+        """The bytes of batches written and not released."""
+        return self._spilled_bytes
+
+    def close(self):
+        """Delete all spill files."""
+        with self._lock:
+            for segment in list(self._segments):
+                self._remove(segment)
+            self._segment = None
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+
+class SpilledRecords(object):
+    """Stands in for the closed MemoryRecordsBuilder of a spilled batch,
+    reading the batch back from the spill files when it is sent."""
+    def __init__(self, spill, records):
+        data = records.buffer()
+        self._spill = spill
+        self._size = len(data)
+        self._segment, self._position = spill.write(data)
+        self._next_offset = records.next_offset()
+        self._compression_rate = records.compression_rate()
+        self._released = False
+
+    def append(self, timestamp, key, value, headers=[]):
+        return None
+
+    def close(self):
+        pass
+
+    def is_full(self):
+        return True
+
+    def next_offset(self):
+        return self._next_offset
+
+    def size_in_bytes(self):
+        return self._size
+
+    def memory_size(self):
+        return 0
+
+    def compression_rate(self):
+        return self._compression_rate
+
+    def buffer(self):
+        assert not self._released, 'Spilled records were released'
+        return self._spill.read(self._segment, self._position, self._size)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._spill.release(self._segment, self._size)
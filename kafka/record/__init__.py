@@ -1,3 +1,4 @@
 from kafka.record.memory_records import MemoryRecords, MemoryRecordsBuilder
+from kafka.record.segment import SegmentReader
 
-__all__ = ["MemoryRecords", "MemoryRecordsBuilder"]
+__all__ = ["MemoryRecords", "MemoryRecordsBuilder", "SegmentReader"]
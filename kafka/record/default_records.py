@@ -62,10 +62,13 @@ from kafka.record.util import (
 )
 from kafka.errors import CorruptRecordException, UnsupportedCodecError
 from kafka.codec import (
-    gzip_encode, snappy_encode, lz4_encode,
-    gzip_decode, snappy_decode, lz4_decode
+    gzip_encode, snappy_encode, lz4_encode, zstd_encode,
+    gzip_decode, snappy_decode_buffer, lz4_decode, zstd_decode,
+    GzipStreamCompressor, SnappyStreamCompressor, Lz4StreamCompressor,
+    ZstdStreamCompressor
 )
 import kafka.codec as codecs
+from kafka.vendor import six
 
 
 class DefaultRecordBase(object):
@@ -89,12 +92,14 @@ class DefaultRecordBase(object):
     ATTRIBUTES_OFFSET = struct.calcsize(">qiibI")
     CRC_OFFSET = struct.calcsize(">qiib")
     AFTER_LEN_OFFSET = struct.calcsize(">qi")
+    LAST_OFFSET_DELTA_OFFSET = struct.calcsize(">qiibIh")
 
     CODEC_MASK = 0x07
     CODEC_NONE = 0x00
     CODEC_GZIP = 0x01
     CODEC_SNAPPY = 0x02
     CODEC_LZ4 = 0x03
+    CODEC_ZSTD = 0x04
     TIMESTAMP_TYPE_MASK = 0x08
     TRANSACTIONAL_MASK = 0x10
     CONTROL_MASK = 0x20
@@ -109,6 +114,8 @@ class DefaultRecordBase(object):
             checker, name = codecs.has_snappy, "snappy"
         elif compression_type == self.CODEC_LZ4:
             checker, name = codecs.has_lz4, "lz4"
+        elif compression_type == self.CODEC_ZSTD:
+            checker, name = codecs.has_zstd, "zstd"
         if not checker():
             raise UnsupportedCodecError(
                 "Libraries for {} compression codec not found".format(name))
@@ -128,6 +135,10 @@ class DefaultRecordBatch(DefaultRecordBase, ABCRecordBatch):
     def base_offset(self):
         return self._header_data[0]
 
+    @property
+    def last_offset(self):
+        return self._header_data[0] + self._header_data[6]
+
     @property
     def magic(self):
         return self._header_data[3]
@@ -173,10 +184,14 @@ class DefaultRecordBatch(DefaultRecordBase, ABCRecordBatch):
                 if compression_type == self.CODEC_GZIP:
                     uncompressed = gzip_decode(data)
                 if compression_type == self.CODEC_SNAPPY:
-                    uncompressed = snappy_decode(data.tobytes())
+                    uncompressed = snappy_decode_buffer(data)
                 if compression_type == self.CODEC_LZ4:
                     uncompressed = lz4_decode(data.tobytes())
-                self._buffer = bytearray(uncompressed)
+                if compression_type == self.CODEC_ZSTD:
+                    uncompressed = zstd_decode(data)
+                if not isinstance(uncompressed, bytearray):
+                    uncompressed = bytearray(uncompressed)
+                self._buffer = uncompressed
                 self._pos = 0
         self._decompressed = True
 
@@ -356,10 +371,13 @@ class DefaultRecordBatchBuilder(DefaultRecordBase, ABCRecordBatchBuilder):
 
     def __init__(
             self, magic, compression_type, is_transactional,
-            producer_id, producer_epoch, base_sequence, batch_size):
+            producer_id, producer_epoch, base_sequence, batch_size,
+            compression_level=None, streaming_compression=False,
+            estimated_compression_ratio=None, buffer=None):
         assert magic >= 2
         self._magic = magic
         self._compression_type = compression_type & self.CODEC_MASK
+        self._compression_level = compression_level
         self._batch_size = batch_size
         self._is_transactional = bool(is_transactional)
         # KIP-98 fields for EOS
@@ -372,7 +390,75 @@ class DefaultRecordBatchBuilder(DefaultRecordBase, ABCRecordBatchBuilder):
         self._last_offset = 0
         self._num_records = 0
 
-        self._buffer = bytearray(self.HEADER_STRUCT.size)
+        # Records are written at _pos into a preallocated buffer, if one is
+        # given, or a bytearray that grows as needed. A buffer that is too
+        # small is copied to a larger bytearray rather than resized, as it
+        # is owned by the caller.
+        self._owns_buffer = buffer is None
+        if buffer is None:
+            buffer = bytearray(self.HEADER_STRUCT.size)
+        self._buffer = buffer
+        self._pos = self.HEADER_STRUCT.size
+        self._uncompressed_size = self.HEADER_STRUCT.size
+
+        # In streaming mode records are compressed as they are appended and
+        # _buffer holds the compressed output. _pending_size estimates the
+        # uncompressed bytes held back by the compressor.
+        self._compressor = None
+        self._pending_size = 0
+        if streaming_compression and self._compression_type != self.CODEC_NONE:
+            self._assert_has_codec(self._compression_type)
+            self._compressor = self._stream_compressor()
+
+        # Otherwise records are compressed in build(), and batch_size is
+        # applied to the uncompressed size scaled by the estimated ratio.
+        self._size_ratio = 1.0
+        if (self._compressor is None and estimated_compression_ratio and
+                self._compression_type != self.CODEC_NONE):
+            self._size_ratio = min(estimated_compression_ratio, 1.0)
+
+    def _stream_compressor(self):
+        level = self._compression_level
+        if self._compression_type == self.CODEC_GZIP:
+            return GzipStreamCompressor(level)
+        elif self._compression_type == self.CODEC_SNAPPY:
+            return SnappyStreamCompressor()
+        elif self._compression_type == self.CODEC_LZ4:
+            if codecs.has_lz4_stream():
+                return Lz4StreamCompressor(level)
+            return None  # Old python-lz4, compress in build()
+        elif self._compression_type == self.CODEC_ZSTD:
+            return ZstdStreamCompressor(level)
+
+    def _write(self, data):
+        end = self._pos + len(data)
+        if end > len(self._buffer):
+            self._grow(end)
+        self._buffer[self._pos:end] = data
+        self._pos = end
+
+    def _grow(self, size):
+        capacity = max(size, 2 * len(self._buffer))
+        if self._owns_buffer:
+            self._buffer.extend(bytearray(capacity - len(self._buffer)))
+        else:
+            buffer = bytearray(capacity)
+            buffer[:self._pos] = memoryview(self._buffer)[:self._pos]
+            self._buffer = buffer
+            self._owns_buffer = True
+        return self._buffer
+
+    def _compress_chunk(self, data):
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._write(compressed)
+            self._pending_size = 0
+        else:
+            self._pending_size += len(data)
+
+    def _sync_compressor(self):
+        self._write(self._compressor.sync())
+        self._pending_size = 0
 
     def _get_attributes(self, include_compression_type=True):
         attrs = 0
@@ -452,27 +538,47 @@ class DefaultRecordBatchBuilder(DefaultRecordBase, ABCRecordBatchBuilder):
                 write_byte(zero_len_varint)
 
         message_len = len_func(message_buffer)
-        main_buffer = self._buffer
+        compressor = self._compressor
 
         required_size = message_len + size_of_varint(message_len)
         # Check if we can write this message
-        if (required_size + len_func(main_buffer) > self._batch_size and
-                not first_message):
-            return None
+        if (self._estimated_size(required_size + self._pos +
+                                 self._pending_size) >
+                self._batch_size and not first_message):
+            if not self._pending_size:
+                return None
+            # Find out how much the held back data really takes
+            self._sync_compressor()
+            if required_size + self._pos > self._batch_size:
+                return None
 
         # Those should be updated after the length check
         if self._max_timestamp < timestamp:
             self._max_timestamp = timestamp
         self._num_records += 1
         self._last_offset = offset
-
-        encode_varint(message_len, main_buffer.append)
-        main_buffer.extend(message_buffer)
+        self._uncompressed_size += required_size
+
+        length_buffer = bytearray_type()
+        encode_varint(message_len, length_buffer.append)
+        if compressor is None:
+            pos = self._pos
+            end = pos + required_size
+            main_buffer = self._buffer
+            if end > len_func(main_buffer):
+                main_buffer = self._grow(end)
+            start = end - message_len
+            main_buffer[pos:start] = length_buffer
+            main_buffer[start:end] = message_buffer
+            self._pos = end
+        else:
+            self._compress_chunk(length_buffer)
+            self._compress_chunk(message_buffer)
 
         return DefaultRecordMetadata(offset, required_size, timestamp)
 
     def write_header(self, use_compression_type=True):
-        batch_len = len(self._buffer)
+        batch_len = self._pos
         self.HEADER_STRUCT.pack_into(
             self._buffer, 0,
             0,  # BaseOffset, set by broker
@@ -489,42 +595,80 @@ class DefaultRecordBatchBuilder(DefaultRecordBase, ABCRecordBatchBuilder):
             self._base_sequence,
             self._num_records
         )
-        crc = calc_crc32c(self._buffer[self.ATTRIBUTES_OFFSET:])
+        if six.PY2:
+            crc = calc_crc32c(self._buffer[self.ATTRIBUTES_OFFSET:batch_len])
+        else:
+            crc = calc_crc32c(
+                memoryview(self._buffer)[self.ATTRIBUTES_OFFSET:batch_len])
         struct.pack_into(">I", self._buffer, self.CRC_OFFSET, crc)
 
     def _maybe_compress(self):
         if self._compression_type != self.CODEC_NONE:
             self._assert_has_codec(self._compression_type)
             header_size = self.HEADER_STRUCT.size
-            data = bytes(self._buffer[header_size:])
+            data = bytes(memoryview(self._buffer)[header_size:self._pos])
+            level = self._compression_level
             if self._compression_type == self.CODEC_GZIP:
-                compressed = gzip_encode(data)
+                compressed = gzip_encode(data, compresslevel=level)
             elif self._compression_type == self.CODEC_SNAPPY:
                 compressed = snappy_encode(data)
             elif self._compression_type == self.CODEC_LZ4:
-                compressed = lz4_encode(data)
+                compressed = lz4_encode(data, compresslevel=level)
+            elif self._compression_type == self.CODEC_ZSTD:
+                compressed = zstd_encode(data, compresslevel=level)
             compressed_size = len(compressed)
             if len(data) <= compressed_size:
                 # We did not get any benefit from compression, lets send
                 # uncompressed
                 return False
             else:
-                # Trim bytearray to the required size
+                # Compressed data is smaller, so it fits in place
                 needed_size = header_size + compressed_size
-                del self._buffer[needed_size:]
                 self._buffer[header_size:needed_size] = compressed
+                self._pos = needed_size
                 return True
         return False
 
+    def _estimated_size(self, size):
+        if self._size_ratio == 1.0:
+            return size
+        header_size = self.HEADER_STRUCT.size
+        return header_size + int((size - header_size) * self._size_ratio)
+
     def build(self):
-        send_compressed = self._maybe_compress()
+        self._size_ratio = 1.0
+        if self._compressor is not None:
+            # Streamed batches are sent compressed even without benefit, as
+            # the uncompressed records are not kept around
+            self._write(self._compressor.flush())
+            self._compressor = None
+            self._pending_size = 0
+            send_compressed = True
+        else:
+            send_compressed = self._maybe_compress()
         self.write_header(send_compressed)
-        return self._buffer
+        if self._owns_buffer:
+            del self._buffer[self._pos:]
+            return self._buffer
+        # Not copied, the caller owns the buffer
+        return memoryview(self._buffer)[:self._pos]
 
     def size(self):
-        """ Return current size of data written to buffer
+        """ Return current size of data written to buffer. With compression
+            this is an estimate of the compressed size until build().
+        """
+        return self._estimated_size(self._pos + self._pending_size)
+
+    def uncompressed_size(self):
+        """ Return the size of the batch before compression
+        """
+        return self._uncompressed_size
+
+    def memory_size(self):
+        """ Return the bytes of memory held by the batch, which may exceed
+            size() before build() with compression
         """
-        return len(self._buffer)
+        return self._pos + self._pending_size
 
     def size_in_bytes(self, offset, timestamp, key, value, headers):
         if self._first_timestamp is not None:
@@ -49,7 +49,7 @@ from kafka.record.util import calc_crc32
 
 from kafka.codec import (
     gzip_encode, snappy_encode, lz4_encode, lz4_encode_old_kafka,
-    gzip_decode, snappy_decode, lz4_decode, lz4_decode_old_kafka,
+    gzip_decode, snappy_decode_buffer, lz4_decode, lz4_decode_old_kafka,
 )
 import kafka.codec as codecs
 from kafka.errors import CorruptRecordException, UnsupportedCodecError
@@ -80,6 +80,9 @@ class LegacyRecordBase(object):
     MAGIC_OFFSET = LOG_OVERHEAD + struct.calcsize(
         ">I"  # CRC
     )
+    ATTRIBUTES_OFFSET = MAGIC_OFFSET + struct.calcsize(
+        ">b"  # magic
+    )
     # Those are used for fast size calculations
     RECORD_OVERHEAD_V0 = struct.calcsize(
         ">I"  # CRC
@@ -182,7 +185,7 @@ class LegacyRecordBatch(ABCRecordBatch, LegacyRecordBase):
         if compression_type == self.CODEC_GZIP:
             uncompressed = gzip_decode(data)
         elif compression_type == self.CODEC_SNAPPY:
-            uncompressed = snappy_decode(data.tobytes())
+            uncompressed = snappy_decode_buffer(data)
         elif compression_type == self.CODEC_LZ4:
             if self._magic == 0:
                 uncompressed = lz4_decode_old_kafka(data.tobytes())
@@ -336,11 +339,17 @@ class LegacyRecord(ABCRecord):
 
 class LegacyRecordBatchBuilder(ABCRecordBatchBuilder, LegacyRecordBase):
 
-    def __init__(self, magic, compression_type, batch_size):
+    def __init__(self, magic, compression_type, batch_size,
+                 compression_level=None, estimated_compression_ratio=None):
         self._magic = magic
         self._compression_type = compression_type
+        self._compression_level = compression_level
         self._batch_size = batch_size
         self._buffer = bytearray()
+        # batch_size applies to the estimated compressed size
+        self._size_ratio = 1.0
+        if estimated_compression_ratio and compression_type:
+            self._size_ratio = min(estimated_compression_ratio, 1.0)
 
     def append(self, offset, timestamp, key, value, headers=None):
         """ Append message to batch.
@@ -370,7 +379,8 @@ class LegacyRecordBatchBuilder(ABCRecordBatchBuilder, LegacyRecordBase):
         pos = len(self._buffer)
         size = self.size_in_bytes(offset, timestamp, key, value)
         # We always allow at least one record to be appended
-        if offset != 0 and pos + size >= self._batch_size:
+        estimated_size = int((pos + size) * self._size_ratio)
+        if offset != 0 and estimated_size >= self._batch_size:
             return None
 
         # Allocate proper buffer length
@@ -434,15 +444,17 @@ class LegacyRecordBatchBuilder(ABCRecordBatchBuilder, LegacyRecordBase):
         if self._compression_type:
             self._assert_has_codec(self._compression_type)
             data = bytes(self._buffer)
+            level = self._compression_level
             if self._compression_type == self.CODEC_GZIP:
-                compressed = gzip_encode(data)
+                compressed = gzip_encode(data, compresslevel=level)
             elif self._compression_type == self.CODEC_SNAPPY:
                 compressed = snappy_encode(data)
             elif self._compression_type == self.CODEC_LZ4:
                 if self._magic == 0:
-                    compressed = lz4_encode_old_kafka(data)
+                    compressed = lz4_encode_old_kafka(
+                        data, compresslevel=level)
                 else:
-                    compressed = lz4_encode(data)
+                    compressed = lz4_encode(data, compresslevel=level)
             size = self.size_in_bytes(
                 0, timestamp=0, key=None, value=compressed)
             # We will try to reuse the same buffer if we have enough space
@@ -459,11 +471,25 @@ class LegacyRecordBatchBuilder(ABCRecordBatchBuilder, LegacyRecordBase):
 
     def build(self):
         """Compress batch to be ready for send"""
+        self._size_ratio = 1.0
         self._maybe_compress()
         return self._buffer
 
     def size(self):
-        """ Return current size of data written to buffer
+        """ Return current size of data written to buffer. With compression
+            this is an estimate of the compressed size until build().
+        """
+        return int(len(self._buffer) * self._size_ratio)
+
+    def uncompressed_size(self):
+        """ Return the size of the batch before compression, which is only
+            known before build()
+        """
+        return len(self._buffer)
+
+    def memory_size(self):
+        """ Return the bytes of memory held by the batch, which may exceed
+            size() before build() with compression
         """
         return len(self._buffer)
 
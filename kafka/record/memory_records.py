@@ -23,6 +23,7 @@ from __future__ import division
 import struct
 
 from kafka.errors import CorruptRecordException
+from kafka.vendor import six
 from kafka.record.abc import ABCRecords
 from kafka.record.legacy_records import LegacyRecordBatch, LegacyRecordBatchBuilder
 from kafka.record.default_records import DefaultRecordBatch, DefaultRecordBatchBuilder
@@ -90,6 +91,41 @@ class MemoryRecords(ABCRecords):
     def has_next(self):
         return self._next_slice is not None
 
+    def next_batch_offsets(self, _magic_offset=MAGIC_OFFSET):
+        """ Return (base_offset, last_offset) of the next batch, read from
+            its header without parsing the batch, or None if there is no next
+            batch. base_offset is None for compressed v0/v1 wrapper messages,
+            whose header only holds the offset of the last inner message.
+        """
+        next_slice = self._next_slice
+        if next_slice is None:
+            return None
+        magic, = struct.unpack_from(">b", next_slice, _magic_offset)
+        if magic >= 2:
+            if len(next_slice) < DefaultRecordBatch.HEADER_STRUCT.size:
+                raise CorruptRecordException(
+                    "Record batch size is less than the batch header size")
+            offset, = struct.unpack_from(">q", next_slice, 0)
+            delta, = struct.unpack_from(
+                ">i", next_slice, DefaultRecordBatch.LAST_OFFSET_DELTA_OFFSET)
+            return offset, offset + delta
+        if len(next_slice) < self.MIN_SLICE:
+            raise CorruptRecordException(
+                "Record size is less than the minimum record overhead "
+                "({})".format(self.MIN_SLICE - self.LOG_OVERHEAD))
+        offset, = struct.unpack_from(">q", next_slice, 0)
+        attributes, = struct.unpack_from(
+            ">b", next_slice, LegacyRecordBatch.ATTRIBUTES_OFFSET)
+        if attributes & LegacyRecordBatch.CODEC_MASK:
+            return None, offset
+        return offset, offset
+
+    def skip_batch(self):
+        """ Skip the next batch without parsing it.
+        """
+        if self._next_slice is not None:
+            self._cache_next()
+
     # NOTE: same cache for LOAD_FAST as above
     def next_batch(self, _min_slice=MIN_SLICE,
                    _magic_offset=MAGIC_OFFSET):
@@ -110,18 +146,36 @@ class MemoryRecords(ABCRecords):
 
 class MemoryRecordsBuilder(object):
 
-    def __init__(self, magic, compression_type, batch_size):
+    # Margin applied to estimated compression ratios, as compression of a
+    # batch may turn out worse than that of the batches before it
+    COMPRESSION_RATE_ESTIMATION_FACTOR = 1.05
+
+    def __init__(self, magic, compression_type, batch_size,
+                 compression_level=None, streaming_compression=False,
+                 estimated_compression_ratio=None, buffer=None):
         assert magic in [0, 1, 2], "Not supported magic"
-        assert compression_type in [0, 1, 2, 3], "Not valid compression type"
+        assert compression_type in [0, 1, 2, 3, 4], "Not valid compression type"
+        assert magic >= 2 or compression_type != 4, \
+            "zstd compression requires magic 2"
+        if estimated_compression_ratio is not None:
+            estimated_compression_ratio *= \
+                self.COMPRESSION_RATE_ESTIMATION_FACTOR
         if magic >= 2:
             self._builder = DefaultRecordBatchBuilder(
                 magic=magic, compression_type=compression_type,
                 is_transactional=False, producer_id=-1, producer_epoch=-1,
-                base_sequence=-1, batch_size=batch_size)
+                base_sequence=-1, batch_size=batch_size,
+                compression_level=compression_level,
+                streaming_compression=streaming_compression,
+                estimated_compression_ratio=estimated_compression_ratio,
+                buffer=buffer)
         else:
+            # Only v2 batches are written into the given buffer, for v0/v1
+            # it just reserves their memory
             self._builder = LegacyRecordBatchBuilder(
                 magic=magic, compression_type=compression_type,
-                batch_size=batch_size)
+                batch_size=batch_size, compression_level=compression_level,
+                estimated_compression_ratio=estimated_compression_ratio)
         self._batch_size = batch_size
         self._buffer = None
 
@@ -134,11 +188,12 @@ class MemoryRecordsBuilder(object):
 
         Returns: RecordMetadata or None if unable to append
         """
-        if self._closed:
+        builder = self._builder
+        if builder is None:
             return None
 
         offset = self._next_offset
-        metadata = self._builder.append(offset, timestamp, key, value, headers)
+        metadata = builder.append(offset, timestamp, key, value, headers)
         # Return of None means there's no space to add a new message
         if metadata is None:
             return None
@@ -152,15 +207,34 @@ class MemoryRecordsBuilder(object):
         # we need to make sure we only close it out once
         # otherwise compressed messages may be double-compressed
         # see Issue 718
+        # The builder may be closed on another thread than the one checking
+        # is_full() or size_in_bytes(). Those read self._builder once and
+        # use self._buffer if it is None, so it is set before dropping the
+        # builder
         if not self._closed:
-            self._bytes_written = self._builder.size()
-            self._buffer = bytes(self._builder.build())
+            self._bytes_written = self._builder.uncompressed_size()
+            # Not copied: v2 batches built in a given buffer are a
+            # memoryview of it, valid until the buffer is reused
+            buffer = self._builder.build()
+            if six.PY2 and isinstance(buffer, memoryview):
+                buffer = buffer.tobytes()  # Can not be concatenated
+            self._buffer = buffer
+            self._closed = True
             self._builder = None
-        self._closed = True
 
     def size_in_bytes(self):
-        if not self._closed:
-            return self._builder.size()
+        builder = self._builder
+        if builder is not None:
+            return builder.size()
+        else:
+            return len(self._buffer)
+
+    def memory_size(self):
+        """Bytes of memory held by the records: their uncompressed size
+        until closed, unlike size_in_bytes()."""
+        builder = self._builder
+        if builder is not None:
+            return builder.memory_size()
         else:
             return len(self._buffer)
 
@@ -169,10 +243,11 @@ class MemoryRecordsBuilder(object):
         return self.size_in_bytes() / self._bytes_written
 
     def is_full(self):
-        if self._closed:
+        builder = self._builder
+        if builder is None:
             return True
         else:
-            return self._builder.size() >= self._batch_size
+            return builder.size() >= self._batch_size
 
     def next_offset(self):
         return self._next_offset
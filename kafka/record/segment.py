@@ -0,0 +1,218 @@
+"""Read Kafka log segment files, as stored in a broker's log directories.
+
+A segment is a ``<base offset>.log`` file holding record batches exactly as
+they are sent in fetch responses, optionally accompanied by:
+
+* ``<base offset>.index``: sparse offset index, entries of
+  (offset - base offset: Int32, file position: Int32)
+* ``<base offset>.timeindex``: sparse time index, entries of
+  (max timestamp so far: Int64, offset - base offset: Int32)
+
+Index files of the active segment are preallocated and padded with zeros.
+"""
+from __future__ import absolute_import
+
+import mmap
+import os
+import struct
+
+from kafka.record.default_records import DefaultRecordBatch
+from kafka.record.memory_records import MemoryRecords
+from kafka.vendor import six
+
+
+def _mmap_file(path):
+    """Return a read-only mmap of the file at path, or None if it is empty
+    or does not exist."""
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+
+class _SegmentIndex(object):
+    """Binary search over the sorted, fixed size entries of an index file."""
+
+    def __init__(self, path, entry_struct, offset_field):
+        self._mmap = _mmap_file(path)
+        self._struct = entry_struct
+        self._offset_field = offset_field
+        self.entries = 0
+        if self._mmap is not None:
+            self.entries = self._valid_entries(len(self._mmap) // entry_struct.size)
+
+    def entry(self, i):
+        return self._struct.unpack_from(self._mmap, i * self._struct.size)
+
+    def _valid_entries(self, count):
+        # Relative offsets increase, so zero after the first entry is padding
+        lo, hi = 1, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[self._offset_field] == 0:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo if count else 0
+
+    def lookup(self, key, field):
+        """Return the last entry with entry[field] <= key, or None."""
+        lo, hi = 0, self.entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[field] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.entry(lo - 1) if lo else None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class SegmentReader(object):
+    """Iterate the record batches of a log segment file through mmap.
+
+    Batches are parsed straight from the mapped file, so only the pages
+    that are read are loaded, and seeking by offset or timestamp uses the
+    segment's .index and .timeindex files when they are present.
+
+    Arguments:
+        path (str): path of the .log segment file.
+        base_offset (int, optional): offset the segment starts at. Default:
+            parsed from the file name, else the offset of the first batch.
+
+    Batches and records returned by the reader must not be used after it
+    is closed. Control batches (transaction markers) are returned by
+    batches() but skipped by records().
+    """
+    OFFSET_INDEX_ENTRY = struct.Struct('>ii')
+    TIME_INDEX_ENTRY = struct.Struct('>qi')
+    # Batch header fields shared by all message formats, see MemoryRecords
+    HEADER = struct.Struct('>qi')
+    MAGIC_OFFSET = struct.calcsize('>qii')
+    LAST_OFFSET_DELTA_OFFSET = DefaultRecordBatch.LAST_OFFSET_DELTA_OFFSET
+
+    def __init__(self, path, base_offset=None):
+        self.path = path
+        stem = os.path.splitext(path)[0]
+        self._mmap = _mmap_file(path)
+        if self._mmap is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._offset_index = _SegmentIndex(
+            stem + '.index', self.OFFSET_INDEX_ENTRY, 0)
+        self._time_index = _SegmentIndex(
+            stem + '.timeindex', self.TIME_INDEX_ENTRY, 1)
+        if base_offset is None:
+            try:
+                base_offset = int(os.path.basename(stem))
+            except ValueError:
+                header = self._header(0)
+                base_offset = header[0] if header else 0
+        self.base_offset = base_offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def size_in_bytes(self):
+        return len(self._mmap) if self._mmap is not None else 0
+
+    def _header(self, pos):
+        """Return (offset, length, magic) of the batch at pos, or None at
+        the end of the segment, including a truncated last batch."""
+        if pos + self.MAGIC_OFFSET + 1 > self.size_in_bytes():
+            return None
+        offset, length = self.HEADER.unpack_from(self._mmap, pos)
+        if pos + self.HEADER.size + length > len(self._mmap):
+            return None
+        magic, = struct.unpack_from('>b', self._mmap, pos + self.MAGIC_OFFSET)
+        return offset, length, magic
+
+    def _last_offset(self, pos, header):
+        offset, _, magic = header
+        if magic < 2:
+            # The offset of legacy (wrapper) messages is their last offset
+            return offset
+        delta, = struct.unpack_from(
+            '>i', self._mmap, pos + self.LAST_OFFSET_DELTA_OFFSET)
+        return offset + delta
+
+    def position_for_offset(self, offset):
+        """Return the file position of the batch containing offset or the
+        first batch after it, or None if offset is past the segment."""
+        pos = 0
+        entry = self._offset_index.lookup(offset - self.base_offset, 0)
+        if entry is not None:
+            pos = entry[1]
+        while True:
+            header = self._header(pos)
+            if header is None:
+                return None
+            if self._last_offset(pos, header) >= offset:
+                return pos
+            pos += self.HEADER.size + header[1]
+
+    def batches(self, offset=None):
+        """Iterate the record batches of the segment, starting with the batch
+        that contains offset if given."""
+        pos = 0
+        if offset is not None:
+            pos = self.position_for_offset(offset)
+            if pos is None:
+                return
+        if self._mmap is None:
+            return
+        if six.PY2:
+            # mmap does not support memoryview on python 2
+            records = MemoryRecords(self._mmap[pos:])
+        else:
+            records = MemoryRecords(memoryview(self._mmap)[pos:])
+        while records.has_next():
+            yield records.next_batch()
+
+    def records(self, offset=None):
+        """Iterate the records of the segment, starting at offset if given."""
+        for batch in self.batches(offset):
+            if isinstance(batch, DefaultRecordBatch) and batch.is_control_batch:
+                continue
+            for record in batch:
+                if offset is None or record.offset >= offset:
+                    yield record
+
+    def offset_for_timestamp(self, timestamp):
+        """Return the earliest offset whose timestamp is greater than or equal
+        to timestamp (ms), or None if there is none in the segment."""
+        offset = None
+        # Records before the entry's offset have smaller timestamps
+        entry = self._time_index.lookup(timestamp - 1, 0)
+        if entry is not None:
+            offset = self.base_offset + entry[1]
+        for batch in self.batches(offset):
+            if isinstance(batch, DefaultRecordBatch):
+                if batch.max_timestamp < timestamp or batch.is_control_batch:
+                    continue
+            for record in batch:
+                if record.timestamp is not None and record.timestamp >= timestamp:
+                    return record.offset
+        return None
+
+    def close(self):
+        self._offset_index.close()
+        self._time_index.close()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # Still referenced by legacy batches, closed with them
+            self._mmap = None
@@ -0,0 +1,127 @@
+"""Socket transports used by BrokerConnection.
+
+A transport decides how a BrokerConnection reaches a broker: which addresses
+to try, what kind of socket to create and how bytes are moved in and out of
+it. The connection state machine (SSL handshake, SASL, request pipelining)
+is the same for every transport. Transports are shared by all connections of
+a client and must not keep per-connection state on themselves.
+
+Sockets returned by a transport must work with selectors (i.e. have a real
+file descriptor) and support non-blocking mode.
+"""
+from __future__ import absolute_import
+
+import logging
+import socket
+
+# Although this looks unused, it actually monkey-patches socket.socketpair()
+# and should be left in as long as we're using socket.socketpair() in this file
+from kafka.vendor import socketpair
+
+log = logging.getLogger(__name__)
+
+# Not available on windows
+AF_UNIX = getattr(socket, 'AF_UNIX', None)
+
+
+class Transport(object):
+    """Base class for BrokerConnection transports."""
+
+    def addresses(self, host, port, afi):
+        """Return a list of (afi, sockaddr) tuples to try, in order.
+
+        An empty list is treated as a DNS failure.
+        """
+        raise NotImplementedError
+
+    def socket(self, afi, sockaddr, node_id):
+        """Create a new unconnected socket for sockaddr."""
+        raise NotImplementedError
+
+    def configure(self, sock, socket_options):
+        """Apply socket_options (tuple-arguments to setsockopt) to sock."""
+        for option in socket_options:
+            log.debug('setting socket option %s', option)
+            sock.setsockopt(*option)
+
+    def connect(self, sock, sockaddr):
+        """Start or check a non-blocking connect, return an errno (0 is done)."""
+        return sock.connect_ex(sockaddr)
+
+    def recv_into(self, sock, buf):
+        """Read into the writable buffer buf, return the number of bytes read.
+
+        Must raise like socket.recv_into if no bytes are available and return
+        0 if the peer closed the connection.
+        """
+        return sock.recv_into(buf)
+
+    def send(self, sock, data):
+        """Write from the buffer data, return the number of bytes written."""
+        return sock.send(data)
+
+
+class TcpTransport(Transport):
+    """Connect to brokers over TCP. This is the default transport."""
+
+    def addresses(self, host, port, afi):
+        from kafka.conn import dns_lookup
+        return [(gai[0], gai[4]) for gai in dns_lookup(host, port, afi)]
+
+    def socket(self, afi, sockaddr, node_id):
+        return socket.socket(afi, socket.SOCK_STREAM)
+
+
+class UnixSocketTransport(Transport):
+    """Connect to brokers through unix domain sockets, i.e. via a local proxy.
+
+    Arguments:
+        path (str): socket path. It may reference the broker address as
+            ``{host}`` and ``{port}``, for a proxy that listens on one
+            socket per broker, e.g. '/run/kafka-proxy/{host}-{port}.sock'.
+    """
+    def __init__(self, path):
+        assert AF_UNIX is not None, 'Unix domain sockets are not available'
+        self.path = path
+
+    def addresses(self, host, port, afi):
+        return [(AF_UNIX, self.path.format(host=host, port=port))]
+
+    def socket(self, afi, sockaddr, node_id):
+        return socket.socket(AF_UNIX, socket.SOCK_STREAM)
+
+    def configure(self, sock, socket_options):
+        # TCP options such as the default TCP_NODELAY do not apply
+        super(UnixSocketTransport, self).configure(
+            sock, [option for option in socket_options
+                   if option[0] != socket.IPPROTO_TCP])
+
+
+class InMemoryTransport(Transport):
+    """Connect to an in-process server through local socket pairs.
+
+    Nothing goes through the network stack, which makes this transport
+    useful to benchmark client-side processing against an in-process broker
+    such as ``test.fake_broker.FakeKafkaBroker``.
+
+    Arguments:
+        server (callable): called with the server end of each new socket
+            pair and the (host, port) the client wanted to connect to.
+    """
+    def __init__(self, server):
+        self.server = server
+
+    def addresses(self, host, port, afi):
+        # Advertised hosts need not resolve
+        return [(AF_UNIX or socket.AF_INET, (host, port))]
+
+    def socket(self, afi, sockaddr, node_id):
+        sock, peer = socket.socketpair()
+        self.server(peer, sockaddr)
+        return sock
+
+    def configure(self, sock, socket_options):
+        pass
+
+    def connect(self, sock, sockaddr):
+        return 0
@@ -8,8 +8,10 @@ from threading import Thread, Event
 import weakref
 
 from kafka.vendor import six
+from kafka.vendor.six.moves import queue # pylint: disable=import-error
 
 from kafka.errors import BufferUnderflowError
+from kafka.future import Future
 
 
 if six.PY3:
@@ -131,6 +133,103 @@ class ReentrantTimer(object):
         self.stop()
 
 
+class WorkerFuture(Future):
+    """A Future completed by a WorkerPool thread, which other threads can
+    wait for."""
+    def __init__(self):
+        super(WorkerFuture, self).__init__()
+        self._event = Event()
+
+    def success(self, value):
+        try:
+            return super(WorkerFuture, self).success(value)
+        finally:
+            self._event.set()
+
+    def failure(self, e):
+        try:
+            return super(WorkerFuture, self).failure(e)
+        finally:
+            self._event.set()
+
+    def wait(self, timeout=None):
+        """Block until done, return whether the future is done."""
+        self._event.wait(timeout)
+        return self.is_done
+
+
+class WorkerPool(object):
+    """
+    A fixed set of daemon threads running submitted calls in FIFO order.
+
+    Useful to move cpu-bound work that releases the GIL (zlib, lz4, zstd)
+    off the network threads.
+
+    Arguments:
+
+        num_workers: number of threads to start
+        name: thread name prefix
+    """
+    def __init__(self, num_workers, name='kafka-worker'):
+        if num_workers <= 0:
+            raise ValueError('Invalid number of workers')
+        self._queue = queue.Queue()
+        self._threads = []
+        for i in range(num_workers):
+            thread = Thread(target=self._run, args=(self._queue,),
+                            name='%s-%d' % (name, i))
+            thread.daemon = True  # So the app exits when main thread exits
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _run(tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            fn, args, future = task
+            try:
+                result = fn(*args)
+            except Exception as e:
+                future.failure(e)
+            else:
+                future.success(result)
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args) on a worker thread.
+
+        Keyword Arguments:
+            callback (callable, optional): added with add_both() before fn
+                is scheduled, so it is called even if fn is done before
+                submit() returns. Callbacks added to the returned future
+                race with the worker, as Future is not thread-safe.
+                Default: None
+
+        Returns:
+            WorkerFuture: resolves to the return value of fn, or fails with
+                the exception it raised. Callbacks run on the worker thread.
+        """
+        callback = kwargs.pop('callback', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % list(kwargs))
+        if not self._threads:
+            raise RuntimeError('WorkerPool is closed')
+        future = WorkerFuture()
+        if callback is not None:
+            future.add_both(callback)
+        self._queue.put((fn, args, future))
+        return future
+
+    def close(self, timeout=None):
+        """Stop the workers once previously submitted calls are done."""
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+
 class WeakMethod(object):
     """
     Callable that weakly references a method and the object it is bound to. It
@@ -0,0 +1,947 @@
+"""In-process fake Kafka broker.
+
+FakeKafkaBroker speaks the Kafka wire protocol on a localhost socket using the
+Request / Response structs from kafka.protocol, and keeps topics, offsets and
+consumer groups in memory. It is meant for benchmarks and tests that need a
+broker to talk to but do not care about replication, persistence or the JVM.
+
+Supported apis: ApiVersions, Metadata, Produce, Fetch, ListOffsets,
+FindCoordinator, JoinGroup, SyncGroup, Heartbeat, LeaveGroup, OffsetCommit and
+OffsetFetch. Every version of those apis known to kafka.protocol is accepted;
+responses are built for the version that was requested.
+
+Run it standalone to point the benchmarks (or any other client) at it::
+
+    python -m test.fake_broker --port 9092
+    python benchmarks/producer_performance.py \\
+        --producer-config bootstrap_servers=localhost:9092
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import bisect
+import collections
+import errno
+import io
+import logging
+import socket
+import struct
+import threading
+import time
+import uuid
+
+# selectors in stdlib as of py3.4
+try:
+    import selectors  # pylint: disable=import-error
+except ImportError:
+    # vendored backport module
+    from kafka.vendor import selectors34 as selectors
+
+import kafka.errors as Errors
+from kafka.protocol.admin import ApiVersionRequest
+from kafka.protocol.api import RequestHeader
+from kafka.protocol.commit import (
+    GroupCoordinatorRequest, OffsetCommitRequest, OffsetFetchRequest)
+from kafka.protocol.fetch import FetchRequest
+from kafka.protocol.group import (
+    HeartbeatRequest, JoinGroupRequest, LeaveGroupRequest, SyncGroupRequest)
+from kafka.protocol.metadata import MetadataRequest
+from kafka.protocol.offset import OffsetRequest, OffsetResetStrategy
+from kafka.protocol.produce import ProduceRequest
+from kafka.protocol.types import (
+    Array, Boolean, Int8, Int16, Int32, Int64, Schema)
+from kafka.record.default_records import DefaultRecordBatch
+from kafka.record.legacy_records import LegacyRecordBatch
+from kafka.structs import TopicPartition
+
+log = logging.getLogger(__name__)
+
+
+SUPPORTED_REQUESTS = dict(
+    (versions[0].API_KEY, versions) for versions in (
+        ProduceRequest, FetchRequest, OffsetRequest, MetadataRequest,
+        OffsetCommitRequest, OffsetFetchRequest, GroupCoordinatorRequest,
+        JoinGroupRequest, HeartbeatRequest, LeaveGroupRequest,
+        SyncGroupRequest, ApiVersionRequest,
+    )
+)
+
+_INT_TYPES = (Int8, Int16, Int32, Int64)
+_RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def build_response(response_type, values):
+    """Build a Response struct of response_type from a dict of field values.
+
+    Handlers describe a response once, using a superset of the field names of
+    every version; only the fields in the requested version's schema are
+    kept. Missing fields get a neutral default (0, False, null or empty).
+    """
+    return response_type(*_project(response_type.SCHEMA, values))
+
+
+def _project(schema, values):
+    items = []
+    for name, field in zip(schema.names, schema.fields):
+        value = values.get(name)
+        if isinstance(field, Array):
+            if value is None:
+                value = []
+            elif isinstance(field.array_of, Schema):
+                value = [tuple(_project(field.array_of, item)) for item in value]
+        elif value is None:
+            if field is Boolean:
+                value = False
+            elif field in _INT_TYPES:
+                value = 0
+        items.append(value)
+    return items
+
+
+class PartitionLog(object):
+    """Append-only in-memory log of record batches for a single partition."""
+
+    LOG_OVERHEAD = struct.calcsize('>qi')
+    MAGIC_OFFSET = struct.calcsize('>qii')
+
+    def __init__(self):
+        self._batches = []
+        self._last_offsets = []
+        self._max_timestamps = []
+        self.log_start_offset = 0
+        self.next_offset = 0
+
+    def append(self, records):
+        """Assign offsets to every batch in records and store them.
+
+        Returns:
+            int: offset assigned to the first appended record
+        """
+        base_offset = self.next_offset
+        pos = 0
+        while pos + self.LOG_OVERHEAD <= len(records):
+            length, = struct.unpack_from('>i', records, pos + 8)
+            end = pos + self.LOG_OVERHEAD + length
+            batch = bytearray(records[pos:end])
+            pos = end
+
+            magic, = struct.unpack_from('>b', batch, self.MAGIC_OFFSET)
+            if magic >= 2:
+                header = DefaultRecordBatch.HEADER_STRUCT.unpack_from(batch)
+                count = header[6] + 1  # LastOffsetDelta
+                max_timestamp = header[8]
+                offset = self.next_offset
+            else:
+                inner = list(LegacyRecordBatch(batch, magic))
+                count = len(inner)
+                max_timestamp = max(record.timestamp or -1 for record in inner)
+                # Compressed legacy wrappers carry the offset of their last
+                # inner message; uncompressed messages have count == 1
+                offset = self.next_offset + count - 1
+            struct.pack_into('>q', batch, 0, offset)
+
+            self.next_offset += count
+            self._batches.append(bytes(batch))
+            self._last_offsets.append(self.next_offset - 1)
+            self._max_timestamps.append(max_timestamp)
+        return base_offset
+
+    def read(self, offset, max_bytes):
+        """Return stored batches starting with the one containing offset.
+
+        At least one batch is returned if any is available, even if it is
+        larger than max_bytes, so consumers can always make progress.
+        """
+        i = bisect.bisect_left(self._last_offsets, offset)
+        chunks = []
+        size = 0
+        for batch in self._batches[i:]:
+            if chunks and size + len(batch) > max_bytes:
+                break
+            chunks.append(batch)
+            size += len(batch)
+        return b''.join(chunks)
+
+    def offset_for_timestamp(self, timestamp):
+        if timestamp == OffsetResetStrategy.LATEST:
+            return self.next_offset
+        elif timestamp == OffsetResetStrategy.EARLIEST:
+            return self.log_start_offset
+        for i, max_timestamp in enumerate(self._max_timestamps):
+            if max_timestamp >= timestamp:
+                return self._last_offsets[i - 1] + 1 if i else self.log_start_offset
+        return self.next_offset
+
+
+class GroupState(object):
+    EMPTY = 'Empty'
+    PREPARING_REBALANCE = 'PreparingRebalance'
+    AWAITING_SYNC = 'AwaitingSync'
+    STABLE = 'Stable'
+
+
+class GroupMember(object):
+    def __init__(self, member_id, session_timeout_ms, rebalance_timeout_ms,
+                 protocol_type, protocols):
+        self.member_id = member_id
+        self.session_timeout_ms = session_timeout_ms
+        self.rebalance_timeout_ms = rebalance_timeout_ms
+        self.protocol_type = protocol_type
+        self.protocols = protocols
+        self.assignment = None
+        self.joined = False
+        self.last_heartbeat = time.time()
+
+
+class Group(object):
+    """Minimal group coordinator state machine for a single consumer group.
+
+    A rebalance waits until every known member has re-joined, or until the
+    largest rebalance timeout expires, in which case stragglers are evicted.
+    """
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self.state = GroupState.EMPTY
+        self.generation_id = 0
+        self.protocol = None
+        self.leader_id = None
+        self.members = collections.OrderedDict()
+        self.offsets = {}
+        self._rebalance_deadline = None
+
+    def prepare_rebalance(self):
+        if self.state is GroupState.PREPARING_REBALANCE:
+            return
+        log.debug('Group %s preparing to rebalance', self.group_id)
+        self.state = GroupState.PREPARING_REBALANCE
+        for member in self.members.values():
+            member.joined = False
+            member.assignment = None
+        timeout_ms = max([m.rebalance_timeout_ms for m in self.members.values()] or [0])
+        self._rebalance_deadline = time.time() + timeout_ms / 1000.0
+
+    def maybe_complete_join(self):
+        """Finish a pending rebalance if possible. Returns True if stable."""
+        if self.state is not GroupState.PREPARING_REBALANCE:
+            return True
+        if not all(m.joined for m in self.members.values()):
+            if time.time() < self._rebalance_deadline:
+                return False
+            for member_id, member in list(self.members.items()):
+                if not member.joined:
+                    log.debug('Group %s evicting member %s that did not rejoin',
+                              self.group_id, member_id)
+                    del self.members[member_id]
+
+        self.generation_id += 1
+        if not self.members:
+            self.state = GroupState.EMPTY
+            self.leader_id = None
+            self.protocol = None
+            return True
+        if self.leader_id not in self.members:
+            self.leader_id = next(iter(self.members))
+        leader = self.members[self.leader_id]
+        for name, _ in leader.protocols:
+            if all(name in dict(m.protocols) for m in self.members.values()):
+                self.protocol = name
+                break
+        self.state = GroupState.AWAITING_SYNC
+        log.debug('Group %s completed join for generation %d with %d members',
+                  self.group_id, self.generation_id, len(self.members))
+        return True
+
+    def remove_member(self, member_id):
+        self.members.pop(member_id, None)
+        if self.leader_id == member_id:
+            self.leader_id = None
+        if self.members:
+            self.prepare_rebalance()
+        else:
+            self.state = GroupState.EMPTY
+            self.generation_id += 1
+
+    def expire_members(self, now):
+        for member_id, member in list(self.members.items()):
+            # Members parked in a pending join do not heartbeat
+            if self.state is GroupState.PREPARING_REBALANCE and member.joined:
+                continue
+            if member.last_heartbeat + member.session_timeout_ms / 1000.0 < now:
+                log.debug('Group %s member %s session expired',
+                          self.group_id, member_id)
+                self.remove_member(member_id)
+
+
+class _PendingResponse(object):
+    """A response slot in a connection's ordered output queue.
+
+    build() is retried on every loop iteration after ready_at until it returns
+    a response; it may also return NO_RESPONSE for requests that do not expect
+    one (acks=0 produce).
+    """
+    NO_RESPONSE = object()
+
+    def __init__(self, correlation_id, ready_at, build):
+        self.correlation_id = correlation_id
+        self.ready_at = ready_at
+        self.build = build
+
+
+class _FakeConnection(object):
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.rbuf = bytearray()
+        self.wbuf = bytearray()
+        self.pending = collections.deque()
+
+
+class FakeKafkaBroker(object):
+    """A single-node Kafka broker stand-in served from a background thread.
+
+    Keyword Arguments:
+        host (str): interface to listen on. Default: '127.0.0.1'
+        port (int): port to listen on. Default: 0 (pick a free port)
+        node_id (int): broker id advertised in metadata. Default: 0
+        num_partitions (int): partitions for auto-created topics. Default: 4
+        auto_create_topics (bool): create unknown topics requested via
+            Metadata or Produce. Default: True
+        latency_ms (int): delay applied to every response. Default: 0
+        throttle_time_ms (int): quota throttle time reported in every response
+            that carries a throttle_time_ms field. Like a real broker, those
+            responses are also held back for the throttle time. Default: 0
+        cluster_id (str): cluster id advertised in metadata. Default: random
+        message_max_bytes (int): produced record batches larger than this
+            are rejected with MessageSizeTooLargeError. Default: None
+
+    latency_ms and throttle_time_ms may be changed while the broker is
+    running; new values apply to requests received afterwards.
+    """
+
+    API_VERSIONS = [
+        (api_key, 0, len(versions) - 1)
+        for api_key, versions in sorted(SUPPORTED_REQUESTS.items())
+    ]
+
+    def __init__(self, host='127.0.0.1', port=0, node_id=0, num_partitions=4,
+                 auto_create_topics=True, latency_ms=0, throttle_time_ms=0,
+                 cluster_id=None, message_max_bytes=None):
+        self.node_id = node_id
+        self.num_partitions = num_partitions
+        self.auto_create_topics = auto_create_topics
+        self.latency_ms = latency_ms
+        self.throttle_time_ms = throttle_time_ms
+        self.cluster_id = cluster_id or uuid.uuid4().hex
+        self.message_max_bytes = message_max_bytes
+        self.topics = {}  # topic -> list of PartitionLog
+        self.groups = {}  # group_id -> Group
+        self.request_counts = collections.Counter()
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(128)
+        self._server.setblocking(False)
+        self.host, self.port = self._server.getsockname()[:2]
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._conns = {}
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._thread = None
+
+        self._handlers = {
+            0: self._handle_produce,
+            1: self._handle_fetch,
+            2: self._handle_list_offsets,
+            3: self._handle_metadata,
+            8: self._handle_offset_commit,
+            9: self._handle_offset_fetch,
+            10: self._handle_find_coordinator,
+            11: self._handle_join_group,
+            12: self._handle_heartbeat,
+            13: self._handle_leave_group,
+            14: self._handle_sync_group,
+            18: self._handle_api_versions,
+        }
+
+    def __str__(self):
+        return '<FakeKafkaBroker node_id=%s %s:%d>' % (self.node_id, self.host, self.port)
+
+    def bootstrap_server(self):
+        return '%s:%d' % (self.host, self.port)
+
+    def open(self):
+        """Start serving requests in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=str(self))
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stop serving and close every client connection."""
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for conn in list(self._conns.values()):
+            self._close_conn(conn)
+        self._selector.close()
+        self._server.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def create_topics(self, topic_names, num_partitions=None):
+        with self._lock:
+            for topic in topic_names:
+                self._create_topic(topic, num_partitions)
+
+    def _create_topic(self, topic, num_partitions=None):
+        if topic not in self.topics:
+            num_partitions = num_partitions or self.num_partitions
+            log.debug('%s: creating topic %s with %d partitions',
+                      self, topic, num_partitions)
+            self.topics[topic] = [PartitionLog() for _ in range(num_partitions)]
+        return self.topics[topic]
+
+    def partition_log(self, topic, partition):
+        logs = self.topics.get(topic)
+        if logs is None or not 0 <= partition < len(logs):
+            return None
+        return logs[partition]
+
+    # -- network loop ------------------------------------------------------
+
+    def _run(self):
+        while not self._closed.is_set():
+            timeout = 0.05
+            with self._lock:
+                if any(conn.pending for conn in self._conns.values()):
+                    timeout = 0.005
+            for key, events in self._selector.select(timeout):
+                if key.fileobj is self._server:
+                    self._accept()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(conn)
+                if events & selectors.EVENT_WRITE and conn.sock is not None:
+                    self._write(conn)
+            with self._lock:
+                now = time.time()
+                for group in self.groups.values():
+                    group.expire_members(now)
+                for conn in list(self._conns.values()):
+                    self._flush_pending(conn, now)
+
+    def serve_socket(self, sock, addr=None):
+        """Serve a client already connected through sock.
+
+        sock may be one end of a socket pair or a connection accepted on a
+        unix domain socket. This method can be passed as the server of a
+        kafka.transport.InMemoryTransport.
+        """
+        sock.setblocking(False)
+        conn = _FakeConnection(sock, addr)
+        with self._lock:
+            self._conns[sock.fileno()] = conn
+            self._selector.register(sock, selectors.EVENT_READ, conn)
+        log.debug('%s: serving connection from %s', self, addr)
+
+    def _accept(self):
+        try:
+            sock, addr = self._server.accept()
+        except socket.error:
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.serve_socket(sock, addr)
+
+    def _close_conn(self, conn):
+        if conn.sock is None:
+            return
+        self._conns.pop(conn.sock.fileno(), None)
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        conn.sock = None
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except socket.error as e:
+            if e.errno in _RETRY_ERRNOS:
+                return
+            data = b''
+        if not data:
+            self._close_conn(conn)
+            return
+        conn.rbuf.extend(data)
+        while len(conn.rbuf) >= 4:
+            size, = struct.unpack_from('>i', conn.rbuf)
+            if len(conn.rbuf) < 4 + size:
+                break
+            frame = bytes(conn.rbuf[4:4 + size])
+            del conn.rbuf[:4 + size]
+            if not self._handle_frame(conn, frame):
+                self._close_conn(conn)
+                return
+
+    def _write(self, conn):
+        if conn.wbuf:
+            try:
+                sent = conn.sock.send(conn.wbuf)
+            except socket.error as e:
+                if e.errno not in _RETRY_ERRNOS:
+                    self._close_conn(conn)
+                    return
+                sent = 0
+            del conn.wbuf[:sent]
+        events = selectors.EVENT_READ
+        if conn.wbuf:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(conn.sock, events, conn)
+
+    def _flush_pending(self, conn, now):
+        # Responses go out in request order: a slow (delayed or parked)
+        # response holds back every response queued behind it
+        while conn.pending and conn.pending[0].ready_at <= now:
+            response = conn.pending[0].build()
+            if response is None:
+                break
+            pending = conn.pending.popleft()
+            if response is _PendingResponse.NO_RESPONSE:
+                continue
+            message = Int32.encode(pending.correlation_id) + response.encode()
+            conn.wbuf.extend(Int32.encode(len(message)) + message)
+        if conn.wbuf and conn.sock is not None:
+            self._write(conn)
+
+    def _handle_frame(self, conn, frame):
+        data = io.BytesIO(frame)
+        api_key, api_version, correlation_id, client_id = [
+            field.decode(data) for field in RequestHeader.SCHEMA.fields]
+        versions = SUPPORTED_REQUESTS.get(api_key)
+        if versions is None or not 0 <= api_version < len(versions):
+            # Real brokers drop the connection on unknown apis / versions
+            log.warning('%s: unsupported api %d v%d from %s, closing',
+                        self, api_key, api_version, client_id)
+            return False
+        request = versions[api_version].decode(data)
+        self.request_counts[api_key] += 1
+        log.debug('%s: request %d from %s: %s', self, correlation_id,
+                  client_id, request)
+
+        with self._lock:
+            build = self._handlers[api_key](request)
+
+        delay_ms = self.latency_ms
+        if 'throttle_time_ms' in request.RESPONSE_TYPE.SCHEMA.names:
+            delay_ms += self.throttle_time_ms
+        if not request.expect_response():
+            build = self._no_response(build)
+        ready_at = time.time() + delay_ms / 1000.0
+        conn.pending.append(_PendingResponse(correlation_id, ready_at, build))
+        return True
+
+    def _respond(self, request, values):
+        """Return a build() callable producing an immediate response."""
+        values.setdefault('throttle_time_ms', self.throttle_time_ms)
+        response = build_response(request.RESPONSE_TYPE, values)
+        return lambda: response
+
+    def _no_response(self, build):
+        def no_response():
+            if build() is None:
+                return None
+            return _PendingResponse.NO_RESPONSE
+        return no_response
+
+    # -- api handlers ------------------------------------------------------
+    # Each handler runs with self._lock held and returns a callable that
+    # builds the response, or returns None while the response is not ready.
+
+    def _handle_api_versions(self, request):
+        return self._respond(request, {
+            'error_code': 0,
+            'api_versions': [
+                {'api_key': api_key, 'min_version': min_version,
+                 'max_version': max_version}
+                for api_key, min_version, max_version in self.API_VERSIONS
+            ],
+        })
+
+    def _handle_metadata(self, request):
+        topics = request.topics
+        if not topics:
+            # v0 uses an empty array for all topics, v1+ a null array
+            if request.API_VERSION == 0 or topics is None:
+                topics = sorted(self.topics)
+            else:
+                topics = []
+        auto_create = getattr(request, 'allow_auto_topic_creation', True)
+
+        topic_metadata = []
+        for topic in topics:
+            if topic not in self.topics and self.auto_create_topics and auto_create:
+                self._create_topic(topic)
+            if topic not in self.topics:
+                topic_metadata.append({
+                    'error_code': Errors.UnknownTopicOrPartitionError.errno,
+                    'topic': topic,
+                })
+                continue
+            topic_metadata.append({
+                'error_code': 0,
+                'topic': topic,
+                'is_internal': False,
+                'partitions': [
+                    {'error_code': 0, 'partition': partition,
+                     'leader': self.node_id, 'replicas': [self.node_id],
+                     'isr': [self.node_id]}
+                    for partition in range(len(self.topics[topic]))
+                ],
+            })
+
+        return self._respond(request, {
+            'brokers': [{'node_id': self.node_id, 'host': self.host,
+                         'port': self.port}],
+            'cluster_id': self.cluster_id,
+            'controller_id': self.node_id,
+            'topics': topic_metadata,
+        })
+
+    def _handle_produce(self, request):
+        topics = []
+        for topic, partitions in request.topics:
+            if topic not in self.topics and self.auto_create_topics:
+                self._create_topic(topic)
+            results = []
+            for partition, records in partitions:
+                partition_log = self.partition_log(topic, partition)
+                if partition_log is None:
+                    results.append({
+                        'partition': partition,
+                        'error_code': Errors.UnknownTopicOrPartitionError.errno,
+                        'offset': -1, 'timestamp': -1, 'log_start_offset': -1,
+                    })
+                    continue
+                if (self.message_max_bytes is not None and
+                        len(records) > self.message_max_bytes):
+                    results.append({
+                        'partition': partition,
+                        'error_code': Errors.MessageSizeTooLargeError.errno,
+                        'offset': -1, 'timestamp': -1, 'log_start_offset': -1,
+                    })
+                    continue
+                try:
+                    offset = partition_log.append(records)
+                except Exception:
+                    log.exception('%s: failed to append to %s-%d',
+                                  self, topic, partition)
+                    results.append({
+                        'partition': partition,
+                        'error_code': Errors.CorruptRecordException.errno,
+                        'offset': -1, 'timestamp': -1, 'log_start_offset': -1,
+                    })
+                    continue
+                results.append({
+                    'partition': partition, 'error_code': 0, 'offset': offset,
+                    'timestamp': -1,
+                    'log_start_offset': partition_log.log_start_offset,
+                })
+            topics.append({'topic': topic, 'partitions': results})
+        return self._respond(request, {'topics': topics})
+
+    def _fetch_response(self, request):
+        max_bytes = getattr(request, 'max_bytes', None)
+        if max_bytes is None:
+            max_bytes = float('inf')
+        total_bytes = 0
+        topics = []
+        for topic, partitions in request.topics:
+            results = []
+            for partition_data in partitions:
+                # v9 added current_leader_epoch after the partition
+                offset_index = 2 if request.API_VERSION >= 9 else 1
+                partition, offset, partition_max_bytes = (
+                    partition_data[0], partition_data[offset_index],
+                    partition_data[-1])
+                partition_log = self.partition_log(topic, partition)
+                result = {'partition': partition, 'message_set': b''}
+                if partition_log is None:
+                    result['error_code'] = Errors.UnknownTopicOrPartitionError.errno
+                    result['highwater_offset'] = -1
+                    result['last_stable_offset'] = -1
+                    result['log_start_offset'] = -1
+                    results.append(result)
+                    continue
+                result['error_code'] = 0
+                result['highwater_offset'] = partition_log.next_offset
+                result['last_stable_offset'] = partition_log.next_offset
+                result['log_start_offset'] = partition_log.log_start_offset
+                if not (partition_log.log_start_offset <= offset
+                        <= partition_log.next_offset):
+                    result['error_code'] = Errors.OffsetOutOfRangeError.errno
+                elif total_bytes < max_bytes:
+                    limit = min(partition_max_bytes, max_bytes - total_bytes)
+                    records = partition_log.read(offset, limit)
+                    total_bytes += len(records)
+                    result['message_set'] = records
+                results.append(result)
+            topics.append({'topics': topic, 'partitions': results})
+        return topics, total_bytes
+
+    def _handle_fetch(self, request):
+        # Park the fetch until min_bytes are available or max_wait_time
+        # expires, like a real broker's purgatory
+        deadline = time.time() + request.max_wait_time / 1000.0
+
+        def build():
+            with self._lock:
+                topics, total_bytes = self._fetch_response(request)
+            if total_bytes < request.min_bytes and time.time() < deadline:
+                return None
+            return build_response(request.RESPONSE_TYPE, {
+                'throttle_time_ms': self.throttle_time_ms,
+                'topics': topics,
+            })
+        return build
+
+    def _handle_list_offsets(self, request):
+        topics = []
+        for topic, partitions in request.topics:
+            results = []
+            for partition_data in partitions:
+                partition, timestamp = partition_data[0], partition_data[1]
+                partition_log = self.partition_log(topic, partition)
+                if partition_log is None:
+                    results.append({
+                        'partition': partition,
+                        'error_code': Errors.UnknownTopicOrPartitionError.errno,
+                        'timestamp': -1, 'offset': -1, 'offsets': [],
+                    })
+                    continue
+                offset = partition_log.offset_for_timestamp(timestamp)
+                results.append({
+                    'partition': partition, 'error_code': 0,
+                    'timestamp': -1, 'offset': offset, 'offsets': [offset],
+                })
+            topics.append({'topic': topic, 'partitions': results})
+        return self._respond(request, {'topics': topics})
+
+    def _handle_find_coordinator(self, request):
+        return self._respond(request, {
+            'error_code': 0,
+            'coordinator_id': self.node_id,
+            'host': self.host,
+            'port': self.port,
+        })
+
+    def _get_group(self, group_id):
+        if group_id not in self.groups:
+            self.groups[group_id] = Group(group_id)
+        return self.groups[group_id]
+
+    def _handle_join_group(self, request):
+        group = self._get_group(request.group)
+        member_id = request.member_id
+        if member_id and member_id not in group.members:
+            return self._respond(request, {
+                'error_code': Errors.UnknownMemberIdError.errno,
+                'generation_id': -1, 'member_id': member_id,
+            })
+        if not member_id:
+            member_id = '%s-%s' % (request.group, uuid.uuid4())
+            group.members[member_id] = GroupMember(
+                member_id, request.session_timeout,
+                getattr(request, 'rebalance_timeout', request.session_timeout),
+                request.protocol_type, request.group_protocols)
+        member = group.members[member_id]
+        member.protocols = request.group_protocols
+        member.last_heartbeat = time.time()
+        group.prepare_rebalance()
+        member.joined = True
+
+        def build():
+            with self._lock:
+                if member_id not in group.members:
+                    return build_response(request.RESPONSE_TYPE, {
+                        'error_code': Errors.UnknownMemberIdError.errno,
+                        'generation_id': -1, 'member_id': member_id,
+                    })
+                if not group.maybe_complete_join():
+                    return None
+                members = []
+                if member_id == group.leader_id:
+                    members = [
+                        {'member_id': m.member_id,
+                         'member_metadata': dict(m.protocols)[group.protocol]}
+                        for m in group.members.values()
+                    ]
+                return build_response(request.RESPONSE_TYPE, {
+                    'throttle_time_ms': self.throttle_time_ms,
+                    'error_code': 0,
+                    'generation_id': group.generation_id,
+                    'group_protocol': group.protocol,
+                    'leader_id': group.leader_id,
+                    'member_id': member_id,
+                    'members': members,
+                })
+        return build
+
+    def _check_member(self, group, member_id, generation_id):
+        if group is None or member_id not in group.members:
+            return Errors.UnknownMemberIdError
+        if group.state is GroupState.PREPARING_REBALANCE:
+            return Errors.RebalanceInProgressError
+        if generation_id != group.generation_id:
+            return Errors.IllegalGenerationError
+        return Errors.NoError
+
+    def _handle_sync_group(self, request):
+        group = self.groups.get(request.group)
+        error_type = self._check_member(group, request.member_id,
+                                        request.generation_id)
+        if error_type is not Errors.NoError:
+            return self._respond(request, {'error_code': error_type.errno,
+                                           'member_assignment': b''})
+        if request.member_id == group.leader_id:
+            for member_id, assignment in request.group_assignment:
+                if member_id in group.members:
+                    group.members[member_id].assignment = assignment
+            for member in group.members.values():
+                if member.assignment is None:
+                    member.assignment = b''
+            group.state = GroupState.STABLE
+        generation_id = request.generation_id
+        member = group.members[request.member_id]
+
+        def build():
+            with self._lock:
+                error_type = Errors.NoError
+                if request.member_id not in group.members:
+                    error_type = Errors.UnknownMemberIdError
+                elif group.generation_id != generation_id:
+                    error_type = Errors.RebalanceInProgressError
+                elif group.state is GroupState.AWAITING_SYNC:
+                    return None
+                elif group.state is not GroupState.STABLE:
+                    error_type = Errors.RebalanceInProgressError
+                assignment = b''
+                if error_type is Errors.NoError:
+                    assignment = member.assignment
+                return build_response(request.RESPONSE_TYPE, {
+                    'throttle_time_ms': self.throttle_time_ms,
+                    'error_code': error_type.errno,
+                    'member_assignment': assignment,
+                })
+        return build
+
+    def _handle_heartbeat(self, request):
+        group = self.groups.get(request.group)
+        error_type = self._check_member(group, request.member_id,
+                                        request.generation_id)
+        if error_type is not Errors.UnknownMemberIdError:
+            group.members[request.member_id].last_heartbeat = time.time()
+        return self._respond(request, {'error_code': error_type.errno})
+
+    def _handle_leave_group(self, request):
+        group = self.groups.get(request.group)
+        if group is None or request.member_id not in group.members:
+            error_type = Errors.UnknownMemberIdError
+        else:
+            group.remove_member(request.member_id)
+            error_type = Errors.NoError
+        return self._respond(request, {'error_code': error_type.errno})
+
+    def _handle_offset_commit(self, request):
+        group = self._get_group(request.consumer_group)
+        generation_id = getattr(request, 'consumer_group_generation_id', -1)
+        member_id = getattr(request, 'consumer_id', None)
+        error_type = Errors.NoError
+        if generation_id == -1 and not group.members:
+            pass  # simple (non-group-managed) commit
+        elif member_id not in group.members:
+            error_type = Errors.UnknownMemberIdError
+        elif generation_id != group.generation_id:
+            error_type = Errors.IllegalGenerationError
+        elif group.state is GroupState.AWAITING_SYNC:
+            error_type = Errors.RebalanceInProgressError
+        topics = []
+        for topic, partitions in request.topics:
+            results = []
+            for partition_data in partitions:
+                partition, offset, metadata = (
+                    partition_data[0], partition_data[1], partition_data[-1])
+                if error_type is Errors.NoError:
+                    group.offsets[TopicPartition(topic, partition)] = (offset, metadata)
+                results.append({'partition': partition,
+                                'error_code': error_type.errno})
+            topics.append({'topic': topic, 'partitions': results})
+        return self._respond(request, {'topics': topics})
+
+    def _handle_offset_fetch(self, request):
+        group = self._get_group(request.consumer_group)
+        if request.topics is None:
+            requested = collections.defaultdict(list)
+            for tp in sorted(group.offsets):
+                requested[tp.topic].append(tp.partition)
+            requested = list(requested.items())
+        else:
+            requested = request.topics
+        topics = []
+        for topic, partitions in requested:
+            results = []
+            for partition in partitions:
+                offset, metadata = group.offsets.get(
+                    TopicPartition(topic, partition), (-1, ''))
+                results.append({'partition': partition, 'offset': offset,
+                                'metadata': metadata, 'error_code': 0})
+            topics.append({'topic': topic, 'partitions': results})
+        return self._respond(request, {'topics': topics, 'error_code': 0})
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Run an in-process fake Kafka broker.')
+    parser.add_argument(
+        '--host', type=str, default='127.0.0.1',
+        help='Interface to listen on')
+    parser.add_argument(
+        '--port', type=int, default=9092,
+        help='Port to listen on')
+    parser.add_argument(
+        '--partitions', type=int, default=4,
+        help='Number of partitions for auto-created topics')
+    parser.add_argument(
+        '--latency-ms', type=int, default=0,
+        help='Delay applied to every response')
+    parser.add_argument(
+        '--throttle-time-ms', type=int, default=0,
+        help='Quota throttle time reported (and applied) in responses')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_args_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    broker = FakeKafkaBroker(host=args.host, port=args.port,
+                             num_partitions=args.partitions,
+                             latency_ms=args.latency_ms,
+                             throttle_time_ms=args.throttle_time_ms)
+    print('Fake broker listening on {0}'.format(broker.bootstrap_server()))
+    broker.open()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        broker.close()
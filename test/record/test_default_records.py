@@ -13,7 +13,8 @@ from kafka.errors import UnsupportedCodecError
     DefaultRecordBatch.CODEC_NONE,
     DefaultRecordBatch.CODEC_GZIP,
     DefaultRecordBatch.CODEC_SNAPPY,
-    DefaultRecordBatch.CODEC_LZ4
+    DefaultRecordBatch.CODEC_LZ4,
+    DefaultRecordBatch.CODEC_ZSTD
 ])
 def test_read_write_serde_v2(compression_type):
     builder = DefaultRecordBatchBuilder(
@@ -175,7 +176,8 @@ def test_default_batch_size_limit():
 @pytest.mark.parametrize("compression_type,name,checker_name", [
     (DefaultRecordBatch.CODEC_GZIP, "gzip", "has_gzip"),
     (DefaultRecordBatch.CODEC_SNAPPY, "snappy", "has_snappy"),
-    (DefaultRecordBatch.CODEC_LZ4, "lz4", "has_lz4")
+    (DefaultRecordBatch.CODEC_LZ4, "lz4", "has_lz4"),
+    (DefaultRecordBatch.CODEC_ZSTD, "zstd", "has_zstd")
 ])
 @pytest.mark.parametrize("magic", [0, 1])
 def test_unavailable_codec(magic, compression_type, name, checker_name):
@@ -202,3 +204,91 @@ def test_unavailable_codec(magic, compression_type, name, checker_name):
         batch = DefaultRecordBatch(bytes(correct_buffer))
         with pytest.raises(UnsupportedCodecError, match=error_msg):
             list(batch)
+
+
+@pytest.mark.parametrize("compression_type", [
+    DefaultRecordBatch.CODEC_GZIP,
+    DefaultRecordBatch.CODEC_SNAPPY,
+    DefaultRecordBatch.CODEC_LZ4,
+    DefaultRecordBatch.CODEC_ZSTD
+])
+def test_streaming_compression(compression_type):
+    def build(streaming_compression):
+        builder = DefaultRecordBatchBuilder(
+            magic=2, compression_type=compression_type, is_transactional=0,
+            producer_id=-1, producer_epoch=-1, base_sequence=-1,
+            batch_size=16384, streaming_compression=streaming_compression)
+        offset = 0
+        while builder.append(offset, timestamp=9999999, key=None,
+                             value=b"Super" * 20, headers=[]) is not None:
+            offset += 1
+        uncompressed_size = builder.uncompressed_size()
+        return offset, uncompressed_size, builder.build()
+
+    count, _, _ = build(False)
+    streamed_count, uncompressed_size, buffer = build(True)
+    # batch_size limits the compressed size, which leaves room for more
+    assert streamed_count > count
+    assert uncompressed_size > 16384
+    assert len(buffer) <= 16384
+
+    reader = DefaultRecordBatch(bytes(buffer))
+    assert reader.compression_type == compression_type
+    msgs = list(reader)
+    assert len(msgs) == streamed_count
+    for offset, msg in enumerate(msgs):
+        assert msg.offset == offset
+        assert msg.value == b"Super" * 20
+
+
+def test_estimated_compression_ratio():
+    def build(compression_type, ratio):
+        builder = DefaultRecordBatchBuilder(
+            magic=2, compression_type=compression_type, is_transactional=0,
+            producer_id=-1, producer_epoch=-1, base_sequence=-1,
+            batch_size=16384, estimated_compression_ratio=ratio)
+        offset = 0
+        while builder.append(offset, timestamp=9999999, key=None,
+                             value=b"Super" * 20, headers=[]) is not None:
+            offset += 1
+        assert builder.size() <= 16384
+        return offset, builder.build()
+
+    count, _ = build(DefaultRecordBatch.CODEC_GZIP, None)
+    estimated_count, buffer = build(DefaultRecordBatch.CODEC_GZIP, 0.25)
+    assert estimated_count > 3 * count
+    assert len(buffer) <= 16384
+    assert len(list(DefaultRecordBatch(bytes(buffer)))) == estimated_count
+    # Uncompressed batches are not affected
+    assert build(DefaultRecordBatch.CODEC_NONE, 0.25)[0] == count
+
+
+@pytest.mark.parametrize("compression_type", [
+    DefaultRecordBatch.CODEC_NONE,
+    DefaultRecordBatch.CODEC_GZIP
+])
+def test_build_into_buffer(compression_type):
+    def build(buffer, count):
+        builder = DefaultRecordBatchBuilder(
+            magic=2, compression_type=compression_type, is_transactional=0,
+            producer_id=-1, producer_epoch=-1, base_sequence=-1,
+            batch_size=999999, buffer=buffer)
+        for offset in range(count):
+            builder.append(offset, timestamp=9999999, key=None,
+                           value=b"Super", headers=[])
+        return builder.build()
+
+    # Batches fitting in the buffer are written to it without copying
+    buffer = bytearray(b"\xff" * 1024)
+    built = build(buffer, 10)
+    assert isinstance(built, memoryview)
+    assert built.obj is buffer
+    assert bytes(built) == bytes(build(None, 10))
+
+    # Larger batches are copied to a new buffer, leaving the given one alone
+    buffer = bytearray(64)
+    built = build(buffer, 100)
+    assert built is not buffer
+    assert len(buffer) == 64
+    assert bytes(built) == bytes(build(None, 100))
+    assert len(list(DefaultRecordBatch(bytes(built)))) == 100
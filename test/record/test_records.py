@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import struct
+
 import pytest
 from kafka.record import MemoryRecords, MemoryRecordsBuilder
 from kafka.errors import CorruptRecordException
@@ -219,3 +221,60 @@ def test_memory_records_builder_full(magic, compression_type):
         key=None, timestamp=None, value=b"M")
     assert metadata is None
     assert builder.next_offset() == 1
+
+
+@pytest.mark.parametrize("magic", [0, 1])
+def test_memory_records_builder_zstd_requires_v2(magic):
+    with pytest.raises(AssertionError):
+        MemoryRecordsBuilder(
+            magic=magic, compression_type=4, batch_size=1024 * 10)
+
+
+def _three_batches(magic, compression_type):
+    """Return 3 batches of 5 records, with offsets set like a broker does."""
+    data = bytearray()
+    for base_offset in (0, 5, 10):
+        builder = MemoryRecordsBuilder(
+            magic=magic, compression_type=compression_type,
+            batch_size=1024 * 10)
+        for i in range(5):
+            builder.append(timestamp=None, key=None, value=b"Super")
+        builder.close()
+        batch = bytearray(builder.buffer())
+        # v0/v1 wrapper messages hold the offset of their last inner message
+        delta = 4 if magic < 2 and compression_type else 0
+        pos = 0
+        while pos < len(batch):
+            offset, length = struct.unpack_from(">qi", batch, pos)
+            struct.pack_into(">q", batch, pos, base_offset + offset + delta)
+            pos += 12 + length
+        data += batch
+    return bytes(data)
+
+
+@pytest.mark.parametrize("compression_type", [0, 1])
+@pytest.mark.parametrize("magic", [0, 1, 2])
+def test_memory_records_skip_batches(magic, compression_type):
+    data = _three_batches(magic, compression_type)
+    records = MemoryRecords(data)
+
+    offsets = []
+    while records.has_next():
+        offsets.append(records.next_batch_offsets())
+        records.skip_batch()
+    assert records.next_batch_offsets() is None
+    records.skip_batch()
+    if magic == 2:
+        assert offsets == [(0, 4), (5, 9), (10, 14)]
+    elif compression_type:
+        # Only the last offset is known before decompressing wrappers
+        assert offsets == [(None, 4), (None, 9), (None, 14)]
+    else:
+        assert offsets == [(i, i) for i in range(15)]
+
+    records = MemoryRecords(data)
+    while records.next_batch_offsets()[1] < 7:
+        records.skip_batch()
+    last_offset = 7 if magic < 2 and not compression_type else 9
+    assert records.next_batch_offsets()[1] == last_offset
+    assert records.next_batch() is not None
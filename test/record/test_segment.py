@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+
+import struct
+
+import pytest
+
+from kafka.record import MemoryRecordsBuilder, SegmentReader
+from test.fake_broker import PartitionLog
+
+
+def _write_segment(tmpdir, magic=2, compression_type=0, base_offset=100,
+                   index=True, padding=0):
+    """Write 10 batches of 10 records with timestamps 1000 + offset, and
+    index entries for every other batch like a broker would."""
+    log = PartitionLog()
+    log.next_offset = base_offset
+    for i in range(10):
+        builder = MemoryRecordsBuilder(magic, compression_type, 1024 * 1024)
+        for j in range(10):
+            offset = base_offset + i * 10 + j
+            builder.append(1000 + offset, None, b'value-%d' % offset)
+        builder.close()
+        log.append(builder.buffer())
+
+    name = tmpdir.join('%020d' % base_offset)
+    offset_index, time_index = [], []
+    pos = 0
+    for i, batch in enumerate(log._batches):
+        last_offset = log._last_offsets[i]
+        if index and i % 2:
+            offset_index.append(struct.pack('>ii', last_offset - base_offset, pos))
+            time_index.append(struct.pack('>qi', 1000 + last_offset,
+                                          last_offset - base_offset))
+        pos += len(batch)
+    name.new(ext='log').write_binary(b''.join(log._batches))
+    if index:
+        name.new(ext='index').write_binary(
+            b''.join(offset_index) + b'\x00' * 8 * padding)
+        name.new(ext='timeindex').write_binary(
+            b''.join(time_index) + b'\x00' * 12 * padding)
+    return str(name.new(ext='log'))
+
+
+@pytest.mark.parametrize("magic, compression_type", [
+    (2, 0), (2, 1), (1, 0), (1, 1)
+])
+@pytest.mark.parametrize("index", [True, False])
+def test_segment_reader(tmpdir, magic, compression_type, index):
+    path = _write_segment(tmpdir, magic, compression_type, index=index,
+                          padding=10)
+    with SegmentReader(path) as reader:
+        assert reader.base_offset == 100
+        offsets = [record.offset for record in reader.records()]
+        assert offsets == list(range(100, 200))
+
+        records = list(reader.records(offset=155))
+        assert records[0].offset == 155
+        assert records[0].value == b'value-155'
+        assert len(records) == 45
+        assert list(reader.records(offset=200)) == []
+
+        assert reader.position_for_offset(100) == 0
+        assert reader.position_for_offset(195) > reader.position_for_offset(185)
+
+        assert reader.offset_for_timestamp(0) == 100
+        assert reader.offset_for_timestamp(1000 + 163) == 163
+        assert reader.offset_for_timestamp(1000 + 200) is None
+
+
+def test_segment_reader_truncated(tmpdir):
+    path = _write_segment(tmpdir, index=False)
+    with open(path, 'rb+') as f:
+        f.truncate(f.seek(0, 2) - 10)
+    with SegmentReader(path, base_offset=100) as reader:
+        assert len(list(reader.batches())) == 9
+        assert reader.position_for_offset(195) is None
+
+
+def test_segment_reader_empty(tmpdir):
+    path = str(tmpdir.join('segment.log'))
+    open(path, 'wb').close()
+    with SegmentReader(path) as reader:
+        assert reader.base_offset == 0
+        assert list(reader.records()) == []
+        assert reader.offset_for_timestamp(0) is None
@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+
+import struct
+
+import pytest
+
+from kafka import KafkaConsumer, KafkaProducer
+from kafka.capture import (
+    CapturedExchange, WireCapture, WireReplay, read_capture)
+from kafka.protocol.metadata import MetadataRequest
+from kafka.protocol.parser import KafkaProtocol
+from test.fake_broker import FakeKafkaBroker
+
+
+def _frame(correlation_id, payload=b'\x00\x00'):
+    message = struct.pack('>i', correlation_id) + payload
+    return struct.pack('>i', len(message)) + message
+
+
+def test_capture_pairs_requests_and_responses(tmpdir):
+    filename = str(tmpdir.join('capture.bin'))
+    capture = WireCapture(filename)
+    protocol = KafkaProtocol(client_id='foo')
+    protocol.send_request(MetadataRequest[1]([]))
+    protocol.send_request(MetadataRequest[1]([]))
+    capture.record_sent(0, protocol.send_bytes(), 1.0)
+
+    # responses may arrive in arbitrary chunks
+    responses = _frame(1) + _frame(2)
+    capture.record_received(0, responses[:5], 1.5)
+    capture.record_received(0, responses[5:], 2.0)
+    capture.close()
+
+    exchanges = list(read_capture(filename))
+    assert len(exchanges) == 2
+    assert [e.node_id for e in exchanges] == ['0', '0']
+    assert [e.api_key for e in exchanges] == [3, 3]
+    assert [e.api_version for e in exchanges] == [1, 1]
+    assert exchanges[0].sent_us == 1000000
+    assert exchanges[0].received_us == 2000000
+    assert exchanges[0].response == _frame(1)
+    assert exchanges[1].response == _frame(2)
+
+
+def test_replay_rewrites_correlation_ids():
+    request = KafkaProtocol(client_id='foo')
+    request.send_request(MetadataRequest[1]([]), correlation_id=100)
+    exchange = CapturedExchange('0', 3, 1, 0, 0, request.send_bytes(), _frame(100))
+    replay = WireReplay([exchange])
+
+    sock = replay.socket(None, None, 0)
+    try:
+        protocol = KafkaProtocol(client_id='foo')
+        protocol.send_request(MetadataRequest[1]([]), correlation_id=7)
+        sock.send(protocol.send_bytes())
+        sock.settimeout(5)
+        assert sock.recv(4096) == _frame(7)
+        assert replay.exhausted()
+    finally:
+        sock.close()
+        replay.close()
+
+
+def test_replay_prefers_matching_requests():
+    def request(topic, correlation_id=0):
+        protocol = KafkaProtocol(client_id='foo')
+        protocol.send_request(MetadataRequest[1]([topic]),
+                              correlation_id=correlation_id)
+        return protocol.send_bytes()
+
+    exchanges = [
+        CapturedExchange(node_id, 3, 1, 0, 0, request(topic, i), _frame(i))
+        for i, (node_id, topic) in enumerate(
+            [('0', 'a'), ('0', 'b'), ('0', 'a'), ('1', 'c')])]
+    replay = WireReplay(exchanges)
+    try:
+        assert replay._next_exchange('0', 3, 1, request('b')) is exchanges[1]
+        # no match falls back to the oldest exchange
+        assert replay._next_exchange('0', 3, 1, request('d')) is exchanges[0]
+        assert replay._next_exchange('0', 3, 1, request('a')) is exchanges[2]
+        assert replay.remaining() == 1
+        # Metadata may be answered from another node's recording
+        assert replay._next_exchange('0', 3, 1, request('a')) is exchanges[3]
+        assert replay._next_exchange('0', 3, 1, request('a')) is None
+        assert replay._next_exchange('2', 0, 3, request('a')) is None
+        assert replay.exhausted()
+    finally:
+        replay.close()
+
+
+@pytest.mark.parametrize("speed", [None, 10.0])
+def test_record_and_replay_consumer(tmpdir, speed):
+    filename = str(tmpdir.join('capture.bin'))
+    # A single partition keeps the sequence of fetch requests independent
+    # of how the consumer interleaves partitions, so replay can match them
+    broker = FakeKafkaBroker(num_partitions=1).open()
+    try:
+        producer = KafkaProducer(bootstrap_servers=broker.bootstrap_server())
+        for i in range(20):
+            producer.send('foo', value=str(i).encode())
+        producer.close()
+
+        capture = WireCapture(filename)
+        consumer = KafkaConsumer(
+            'foo', bootstrap_servers=broker.bootstrap_server(),
+            group_id=None, auto_offset_reset='earliest',
+            consumer_timeout_ms=500, wire_capture=capture)
+        recorded = sorted(message.value for message in consumer)
+        consumer.close()
+        capture.close()
+    finally:
+        broker.close()
+    assert len(recorded) == 20
+
+    # The broker is gone: everything is served from the capture
+    replay = WireReplay(filename, speed=speed)
+    consumer = KafkaConsumer(
+        'foo', bootstrap_servers=broker.bootstrap_server(),
+        group_id=None, auto_offset_reset='earliest',
+        consumer_timeout_ms=500, transport=replay)
+    replayed = sorted(message.value for message in consumer)
+    consumer.close()
+    replay.close()
+    assert replayed == recorded
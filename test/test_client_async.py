@@ -12,7 +12,7 @@ import time
 
 import pytest
 
-from kafka.client_async import KafkaClient, IdleConnectionManager
+from kafka.client_async import KafkaClient, IdleConnectionManager, NodeLoadIndex
 from kafka.cluster import ClusterMetadata
 from kafka.conn import ConnectionStates
 import kafka.errors as Errors
@@ -278,8 +278,63 @@ def test_in_flight_request_count():
     pass
 
 
-def test_least_loaded_node():
-    pass
+def test_least_loaded_node(mocker, client):
+    client.cluster.update_metadata(MetadataResponse[0](
+        [(0, 'foo', 12), (1, 'bar', 34), (2, 'baz', 56)], []))
+    assert client.least_loaded_node() in (0, 1, 2)
+
+    mocker.patch.object(client, '_selector')
+    conns = {}
+    for node_id in range(3):
+        conns[node_id] = mocker.MagicMock()
+        conns[node_id].connected.return_value = True
+        conns[node_id].blacked_out.return_value = False
+        conns[node_id].in_flight_requests = [None] * (node_id + 1)
+        client._conns[node_id] = conns[node_id]
+        client._conn_state_change(node_id, conns[node_id])
+    assert client.least_loaded_node() == 0
+
+    # an established connection without in-flight requests is preferred
+    conns[2].in_flight_requests = []
+    client._update_node_load(2)
+    assert client.least_loaded_node() == 2
+
+    # unnoticed changes are caught when the node is picked
+    conns[2].in_flight_requests = [None] * 3
+    assert client.least_loaded_node() == 0
+
+    # nodes in reconnect backoff are skipped
+    conns[0].connected.return_value = False
+    conns[0].blacked_out.return_value = True
+    conns[0].connection_delay.return_value = 1000
+    conns[0].in_flight_requests = []
+    client._conn_state_change(0, conns[0])
+    assert client.least_loaded_node() == 1
+
+    # brokers removed from metadata are forgotten
+    client.cluster.update_metadata(MetadataResponse[0]([(2, 'baz', 56)], []))
+    assert client.least_loaded_node() == 2
+
+
+def test_node_load_index():
+    index = NodeLoadIndex()
+    for node_id in range(4):
+        index.update(node_id, False, 0)
+    # ties are broken randomly
+    picks = set([index.least_loaded(0) for _ in range(200)])
+    assert picks == set(range(4))
+
+    assert index.update(1, True, 2)
+    assert not index.update(1, True, 2)
+    index.update(2, True, 1)
+    index.update(3, True, 0)
+    index.update(0, False, 0, blacked_out_until=10)
+    assert index.least_loaded(0) == 3
+
+    index.remove(3)
+    assert index.least_loaded(0) == 2
+    assert index.least_loaded(10) == 0
+    assert index.nodes() == set([0, 1, 2])
 
 
 def test_set_topics(mocker):
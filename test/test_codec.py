@@ -6,12 +6,15 @@ import struct
 import pytest
 from six.moves import xrange
 
+import kafka.codec
 from kafka.codec import (
-    has_snappy, has_gzip, has_lz4,
+    GzipStreamCompressor, SnappyStreamCompressor,
+    has_snappy, has_gzip, has_lz4, has_zstd,
     gzip_encode, gzip_decode,
     snappy_encode, snappy_decode,
     lz4_encode, lz4_decode,
     lz4_encode_old_kafka, lz4_decode_old_kafka,
+    zstd_encode, zstd_decode,
 )
 
 from test.testutil import random_string
@@ -83,6 +86,27 @@ def test_snappy_encode_xerial():
     assert compressed == to_ensure
 
 
+@pytest.mark.skipif(not has_snappy() or kafka.codec.cramjam_snappy is None,
+                    reason="Snappy buffer api not available")
+def test_snappy_xerial_buffer_api(mocker):
+    payload = random_string(100000).encode('utf-8') + b'SNAPPY' * 20000
+    encoded = snappy_encode(payload)
+    stream = SnappyStreamCompressor()
+    streamed = stream.compress(payload[:50000]) + stream.flush()
+
+    # Same framing as the block by block fallback
+    mocker.patch('kafka.codec.cramjam_snappy', None)
+    assert encoded == snappy_encode(payload)
+    assert snappy_decode(encoded) == payload
+    stream = SnappyStreamCompressor()
+    assert streamed == stream.compress(payload[:50000]) + stream.flush()
+    mocker.stopall()
+
+    assert snappy_decode(memoryview(encoded)) == payload
+    assert isinstance(snappy_decode(encoded), bytes)
+    assert snappy_decode(memoryview(b'x' + streamed)[1:]) == payload[:50000]
+
+
 @pytest.mark.skipif(not has_lz4() or platform.python_implementation() == 'PyPy',
                     reason="python-lz4 crashes on old versions of pypy")
 def test_lz4():
@@ -113,3 +137,46 @@ def test_lz4_incremental():
         b2 = lz4_decode(lz4_encode(b1))
         assert len(b1) == len(b2)
         assert b1 == b2
+
+
+@pytest.mark.skipif(not has_zstd(), reason="Zstd not available")
+def test_zstd():
+    for i in xrange(1000):
+        b1 = random_string(100).encode('utf-8')
+        b2 = zstd_decode(zstd_encode(b1))
+        assert b1 == b2
+
+
+@pytest.mark.skipif(not has_zstd(), reason="Zstd not available")
+def test_zstd_streamed_frame():
+    # Frames written by streaming compressors (i.e. the java client's
+    # ZstdOutputStream) do not store the content size
+    import zstandard
+    b1 = random_string(100).encode('utf-8') * 1000
+    compressor = zstandard.ZstdCompressor(write_content_size=False)
+    cobj = compressor.compressobj()
+    assert zstd_decode(cobj.compress(b1) + cobj.flush()) == b1
+
+
+@pytest.mark.parametrize("encode, decode, levels", [
+    (gzip_encode, gzip_decode, [1, 9]),
+    (lz4_encode, lz4_decode, [0, 16]),
+    (zstd_encode, zstd_decode, [1, 22]),
+])
+def test_compression_levels(encode, decode, levels):
+    if encode is None or (encode is zstd_encode and not has_zstd()):
+        pytest.skip("Codec not available")
+    b1 = random_string(100).encode('utf-8') * 100
+    for level in levels:
+        assert decode(encode(b1, compresslevel=level)) == b1
+
+
+def test_gzip_level_zero():
+    # Level 0 stores the data uncompressed rather than using the default
+    b1 = b'a' * 10000
+    assert len(gzip_encode(b1, compresslevel=0)) > len(b1)
+    assert gzip_decode(gzip_encode(b1, compresslevel=0)) == b1
+    compressor = GzipStreamCompressor(compresslevel=0)
+    data = compressor.compress(b1) + compressor.flush()
+    assert len(data) > len(b1)
+    assert gzip_decode(data) == b1
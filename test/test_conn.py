@@ -11,7 +11,7 @@ import pytest
 from kafka.conn import BrokerConnection, ConnectionStates, collect_hosts
 from kafka.protocol.api import RequestHeader
 from kafka.protocol.metadata import MetadataRequest
-from kafka.protocol.produce import ProduceRequest
+from kafka.protocol.produce import ProduceRequest, ProduceResponse
 
 import kafka.errors as Errors
 
@@ -186,8 +186,8 @@ def test_recv_disconnected(_socket, conn):
     _socket.send.side_effect = [4, payload_bytes]
     conn.send(req)
 
-    # Empty data on recv means the socket is disconnected
-    _socket.recv.return_value = b''
+    # Reading no data means the socket is disconnected
+    _socket.recv_into.return_value = 0
 
     # Attempt to receive should mark connection as disconnected
     assert conn.connected()
@@ -195,6 +195,19 @@ def test_recv_disconnected(_socket, conn):
     assert conn.disconnected()
 
 
+def test_throttle_delay(conn):
+    assert conn.throttle_delay() == 0
+    conn._maybe_throttle(ProduceResponse[0]([]), time.time())
+    assert conn.throttle_delay() == 0
+
+    # A broker that already held the response back for the throttle time
+    conn._maybe_throttle(ProduceResponse[1]([], 500), time.time() - 0.5)
+    assert conn.throttle_delay() == 0
+
+    conn._maybe_throttle(ProduceResponse[1]([], 500), time.time())
+    assert 400 < conn.throttle_delay() <= 500
+
+
 def test_recv(_socket, conn):
     pass # TODO
 
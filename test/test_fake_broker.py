@@ -0,0 +1,298 @@
+from __future__ import absolute_import
+
+import os
+import time
+
+import pytest
+
+import kafka.errors as Errors
+from kafka import KafkaConsumer, KafkaProducer, TopicPartition
+from kafka.client_async import KafkaClient
+from kafka.partitioner import DefaultPartitioner
+from kafka.protocol.metadata import MetadataRequest
+from kafka.protocol.produce import ProduceRequest
+from kafka.record.memory_records import MemoryRecords, MemoryRecordsBuilder
+from test.fake_broker import FakeKafkaBroker, PartitionLog, build_response
+
+
+@pytest.fixture
+def fake_broker():
+    broker = FakeKafkaBroker(num_partitions=2).open()
+    yield broker
+    broker.close()
+
+
+def _records(values, magic=2, compression_type=0):
+    builder = MemoryRecordsBuilder(magic, compression_type, 1024 * 1024)
+    for value in values:
+        builder.append(None, None, value)
+    builder.close()
+    return builder.buffer()
+
+
+def test_build_response_projects_version_fields():
+    values = {
+        'topics': [{'topic': 'foo', 'partitions': [
+            {'partition': 0, 'error_code': 0, 'offset': 10,
+             'timestamp': -1, 'log_start_offset': 0}]}],
+        'throttle_time_ms': 5,
+    }
+    v0 = build_response(ProduceRequest[0].RESPONSE_TYPE, values)
+    assert v0.topics == [('foo', [(0, 0, 10)])]
+    v5 = build_response(ProduceRequest[5].RESPONSE_TYPE, values)
+    assert v5.topics == [('foo', [(0, 0, 10, -1, 0)])]
+    assert v5.throttle_time_ms == 5
+
+
+@pytest.mark.parametrize("magic, compression_type", [
+    (0, 0), (1, 0), (1, 1), (2, 0), (2, 1),
+])
+def test_partition_log_assigns_offsets(magic, compression_type):
+    log = PartitionLog()
+    assert log.append(_records([b'a', b'b', b'c'], magic, compression_type)) == 0
+    assert log.append(_records([b'd'], magic, compression_type)) == 3
+    assert log.next_offset == 4
+
+    records = MemoryRecords(log.read(3, 1024))
+    values = []
+    while records.has_next():
+        for record in records.next_batch():
+            values.append((record.offset, record.value))
+    assert (3, b'd') in values
+    assert values[-1] == (3, b'd')
+
+
+def test_api_versions_and_metadata(fake_broker):
+    client = KafkaClient(bootstrap_servers=fake_broker.bootstrap_server())
+    try:
+        assert client.config['api_version'] == (2, 1, 0)
+        future = client.send(client.least_loaded_node(),
+                             MetadataRequest[1](['foo']))
+        client.poll(future=future)
+        assert future.succeeded()
+        assert future.value.topics[0][1] == 'foo'
+        assert len(future.value.topics[0][3]) == 2
+    finally:
+        client.close()
+
+
+def test_latency_injection(fake_broker):
+    client = KafkaClient(bootstrap_servers=fake_broker.bootstrap_server())
+    try:
+        fake_broker.latency_ms = 200
+        node_id = client.least_loaded_node()
+        client.poll(future=client.send(node_id, MetadataRequest[1]([])))
+        start = time.time()
+        future = client.send(node_id, MetadataRequest[1]([]))
+        client.poll(future=future)
+        assert time.time() - start >= 0.2
+    finally:
+        client.close()
+
+
+def test_produce_consume_group(fake_broker):
+    bootstrap = fake_broker.bootstrap_server()
+    producer = KafkaProducer(bootstrap_servers=bootstrap)
+    for i in range(10):
+        producer.send('foo', value=str(i).encode(), partition=i % 2)
+    producer.flush()
+    producer.close()
+    assert fake_broker.partition_log('foo', 0).next_offset == 5
+
+    consumer = KafkaConsumer('foo', bootstrap_servers=bootstrap,
+                             group_id='bar', auto_offset_reset='earliest',
+                             consumer_timeout_ms=1000)
+    values = sorted(int(message.value) for message in consumer)
+    consumer.commit()
+    assert values == list(range(10))
+    assert consumer.committed(TopicPartition('foo', 0)) == 5
+    consumer.close()
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_produce_consume_compressed(fake_broker, workers):
+    bootstrap = fake_broker.bootstrap_server()
+    producer = KafkaProducer(bootstrap_servers=bootstrap,
+                             compression_type='gzip', batch_size=1024,
+                             compression_workers=workers)
+    futures = [producer.send('foo', value=b'%d' % i * 100, partition=i % 2)
+               for i in range(100)]
+    producer.flush()
+    producer.close()
+    assert all(future.succeeded() for future in futures)
+
+    consumer = KafkaConsumer('foo', bootstrap_servers=bootstrap,
+                             group_id=None, auto_offset_reset='earliest',
+                             consumer_timeout_ms=1000,
+                             decompression_workers=workers)
+    values = sorted(message.value for message in consumer)
+    consumer.close()
+    assert values == sorted(b'%d' % i * 100 for i in range(100))
+
+
+def test_produce_splits_too_large_batches():
+    broker = FakeKafkaBroker(num_partitions=1, message_max_bytes=2000).open()
+    try:
+        producer = KafkaProducer(bootstrap_servers=broker.bootstrap_server(),
+                                 compression_type='gzip', batch_size=100000,
+                                 linger_ms=50,
+                                 max_in_flight_requests_per_connection=1)
+        # Incompressible, so the batch exceeds the limit after compression
+        values = [os.urandom(100) for _ in range(200)]
+        futures = [producer.send('foo', value=value) for value in values]
+        producer.flush()
+        assert all(future.succeeded() for future in futures)
+        offsets = [future.get().offset for future in futures]
+        assert broker.request_counts[0] > 2  # rejected, then split
+        producer.close()
+        assert offsets == list(range(200))
+
+        records = MemoryRecords(broker.partition_log('foo', 0).read(0, 10000000))
+        logged = []
+        while records.has_next():
+            logged.extend(record.value for record in records.next_batch())
+        assert logged == values
+    finally:
+        broker.close()
+
+
+@pytest.mark.parametrize("partitioner", [
+    DefaultPartitioner(sticky=True), DefaultPartitioner(adaptive=True),
+])
+def test_produce_sticky_partitioner(partitioner):
+    broker = FakeKafkaBroker(num_partitions=16).open()
+    try:
+        producer = KafkaProducer(bootstrap_servers=broker.bootstrap_server(),
+                                 partitioner=partitioner,
+                                 batch_size=1000, linger_ms=1000)
+        futures = [producer.send('foo', value=b'x' * 90) for _ in range(100)]
+        producer.flush()
+        producer.close()
+        partitions = [future.get().partition for future in futures]
+        # Batches of ~10 records, each on a single partition
+        switches = sum(1 for a, b in zip(partitions, partitions[1:]) if a != b)
+        assert 5 <= switches <= 12
+        assert sum(broker.partition_log('foo', p).next_offset
+                   for p in range(16)) == 100
+    finally:
+        broker.close()
+
+
+def test_produce_non_sticky_partitioner_appends_once(fake_broker, mocker):
+    producer = KafkaProducer(bootstrap_servers=fake_broker.bootstrap_server(),
+                             batch_size=200, linger_ms=1000)
+    append = mocker.spy(producer._accumulator, 'append')
+    on_new_batch = mocker.spy(producer.config['partitioner'], 'on_new_batch')
+    futures = [producer.send('foo', value=b'x' * 90) for _ in range(20)]
+    producer.flush()
+    producer.close()
+    assert all(future.get().offset >= 0 for future in futures)
+    assert append.call_count == 20
+    assert not any(call[1]['abort_on_new_batch']
+                   for call in append.call_args_list)
+    assert not on_new_batch.called
+
+
+def test_produce_send_many(fake_broker):
+    producer = KafkaProducer(bootstrap_servers=fake_broker.bootstrap_server(),
+                             batch_size=1000, linger_ms=5)
+    records = [(b'%d' % (i % 7), b'%d' % i) for i in range(500)]
+    record_set, futures = producer.send_many('foo', records,
+                                             record_futures=True)
+    assert producer.send_many('foo', records[:100], partition=1).get(10) == 100
+    assert record_set.get(10) == 500
+    producer.close()
+
+    offsets = {0: [], 1: []}
+    for (key, value), future in zip(records, futures):
+        metadata = future.get(0)
+        assert metadata.partition == producer.config['partitioner'](
+            key, [0, 1], [0, 1])
+        offsets[metadata.partition].append(metadata.offset)
+    # Records of each partition are appended in order
+    for p in (0, 1):
+        assert offsets[p] == list(range(len(offsets[p])))
+    assert fake_broker.partition_log('foo', 1).next_offset == len(offsets[1]) + 100
+
+
+def test_produce_send_many_sticky_partitioner():
+    broker = FakeKafkaBroker(num_partitions=16).open()
+    try:
+        producer = KafkaProducer(bootstrap_servers=broker.bootstrap_server(),
+                                 partitioner=DefaultPartitioner(sticky=True),
+                                 batch_size=1000, linger_ms=1000)
+        records = [(None, b'x' * 90)] * 5
+        calls = [producer.send_many('foo', records, record_futures=True)[1]
+                 for _ in range(20)]
+        producer.flush()
+        producer.close()
+        partitions = [set(f.get().partition for f in futures)
+                      for futures in calls]
+        # Each call sticks to one partition, switching once batches fill
+        assert all(len(p) == 1 for p in partitions)
+        assert len(set.union(*partitions)) > 1
+    finally:
+        broker.close()
+
+
+def test_produce_send_many_fails_record_set(fake_broker, mocker):
+    producer = KafkaProducer(bootstrap_servers=fake_broker.bootstrap_server(),
+                             linger_ms=5)
+    append_many = producer._accumulator.append_many
+    calls = []
+
+    def first_then_timeout(*args):
+        # The first partition is appended, the second one times out
+        calls.append(args)
+        if len(calls) > 1:
+            raise Errors.KafkaTimeoutError()
+        return append_many(*args)
+
+    mocker.patch.object(producer._accumulator, 'append_many',
+                        side_effect=first_then_timeout)
+    records = [(b'%d' % (i % 7), b'%d' % i) for i in range(100)]
+    with pytest.raises(Errors.KafkaTimeoutError):
+        producer.send_many('foo', records)
+    record_set = calls[0][3]
+    assert record_set.failed()
+    with pytest.raises(Errors.KafkaTimeoutError):
+        record_set.get(0)
+    producer.close()
+
+
+def test_produce_delivery_callback(fake_broker):
+    delivered = []
+    producer = KafkaProducer(
+        bootstrap_servers=fake_broker.bootstrap_server(),
+        record_futures=False, linger_ms=5,
+        delivery_callback=lambda *args: delivered.append(args))
+    for i in range(100):
+        assert producer.send('foo', b'%d' % i, partition=i % 2) is None
+    producer.flush()
+    producer.close()
+    assert all(error is None for _, _, _, error in delivered)
+    for p in (0, 1):
+        batches = sorted((base_offset, count)
+                         for tp, base_offset, count, _ in delivered
+                         if tp.partition == p)
+        assert sum(count for _, count in batches) == 50
+        assert batches[0][0] == 0
+
+
+def test_produce_spill(fake_broker, tmpdir):
+    fake_broker.latency_ms = 100
+    producer = KafkaProducer(
+        bootstrap_servers=fake_broker.bootstrap_server(),
+        batch_size=1024, buffer_memory=4096,
+        max_in_flight_requests_per_connection=1,
+        buffer_overflow_policy='spill', spill_dir=str(tmpdir))
+    futures = [producer.send('foo', b'%03d' % i * 10, partition=i % 2)
+               for i in range(300)]
+    assert producer._spill.spilled_bytes() > 0
+    producer.flush()
+    producer.close()
+    assert not tmpdir.listdir()
+    for i, future in enumerate(futures):
+        assert future.get(0).offset == i // 2
+    for p in (0, 1):
+        assert fake_broker.partition_log('foo', p).next_offset == 150
@@ -5,6 +5,8 @@ import pytest
 
 from collections import OrderedDict
 import itertools
+import struct
+import threading
 import time
 
 from kafka.client_async import KafkaClient
@@ -22,11 +24,14 @@ from kafka.errors import (
 )
 from kafka.record.memory_records import MemoryRecordsBuilder, MemoryRecords
 from kafka.structs import TopicPartition
+from kafka.util import WorkerPool
 
 
 @pytest.fixture
 def client(mocker):
-    return mocker.Mock(spec=KafkaClient(bootstrap_servers=(), api_version=(0, 9)))
+    _cli = mocker.Mock(spec=KafkaClient(bootstrap_servers=(), api_version=(0, 9)))
+    _cli.throttle_delay.return_value = 0
+    return _cli
 
 
 @pytest.fixture
@@ -99,6 +104,16 @@ def test_create_fetch_requests(fetcher, mocker, api_version, fetch_version):
     assert all([isinstance(r, FetchRequest[fetch_version]) for r in requests])
 
 
+def test_create_fetch_requests_skips_throttled_nodes(fetcher, mocker):
+    fetcher._client.in_flight_request_count.return_value = 0
+    fetcher._client.cluster.leader_for_partition.side_effect = (
+        lambda tp: tp.partition % 2)
+    fetcher._client.throttle_delay.side_effect = (
+        lambda node_id: 100 if node_id == 1 else 0)
+    by_node = fetcher._create_fetch_requests()
+    assert list(by_node.keys()) == [0]
+
+
 def test_update_fetch_positions(fetcher, topic, mocker):
     mocker.patch.object(fetcher, '_reset_offset')
     partition = TopicPartition(topic, 0)
@@ -382,6 +397,80 @@ def test__handle_fetch_response(fetcher, fetch_request, fetch_response, num_part
     assert len(fetcher._completed_fetches) == num_partitions
 
 
+def test__handle_fetch_response_decodes_in_pool(fetcher, topic):
+    pool = WorkerPool(2)
+    fetcher.config['decompression_pool'] = pool
+    try:
+        partitions = []
+        for partition in range(3):
+            builder = MemoryRecordsBuilder(
+                magic=1, compression_type=1, batch_size=9999999)
+            for i in range(10):
+                builder.append(key=None, value=b'%d-%d' % (partition, i),
+                               timestamp=None)
+            builder.close()
+            partitions.append(
+                (partition, 0, 100, 0, [], builder.buffer()))
+        # an error response is not decoded
+        partitions.append((3, NotLeaderForPartitionError.errno, -1, -1, [], b''))
+        fetch_request = FetchRequest[4](
+            -1, 100, 100, 10000, 0,
+            [(topic, [(partition, 0, 1000) for partition in range(4)])])
+        fetch_response = FetchResponse[4](0, [(topic, partitions)])
+        fetcher._handle_fetch_response(fetch_request, time.time(), fetch_response)
+
+        decoded = dict((fetch.topic_partition.partition, fetch.decoded)
+                       for fetch in fetcher._completed_fetches)
+        assert decoded[3] is None
+        assert all(decoded[partition] is not None for partition in range(3))
+
+        records, partial = fetcher.fetched_records()
+        assert partial is False
+        for partition in range(3):
+            tp = TopicPartition(topic, partition)
+            assert [record.value for record in records[tp]] == [
+                b'%d-%d' % (partition, i) for i in range(10)]
+            assert fetcher._subscriptions.assignment[tp].position == 10
+    finally:
+        pool.close()
+
+
+def test_fetched_records_bounds_decode_wait(fetcher, topic):
+    pool = WorkerPool(1)
+    fetcher.config['decompression_pool'] = pool
+    blocked = threading.Event()
+    try:
+        # A stuck worker leaves the fetch undecoded
+        pool.submit(blocked.wait)
+        builder = MemoryRecordsBuilder(
+            magic=1, compression_type=1, batch_size=9999999)
+        builder.append(key=None, value=b'foo', timestamp=None)
+        builder.close()
+        fetch_request = FetchRequest[4](
+            -1, 100, 100, 10000, 0, [(topic, [(0, 0, 1000)])])
+        fetch_response = FetchResponse[4](
+            0, [(topic, [(0, 0, 100, 0, [], builder.buffer())])])
+        fetcher._handle_fetch_response(fetch_request, time.time(), fetch_response)
+
+        start = time.time()
+        records, partial = fetcher.fetched_records(timeout_ms=50)
+        assert time.time() - start < 5
+        assert records == {}
+        assert partial is True
+        assert len(fetcher._completed_fetches) == 1
+        assert list(fetcher) == []
+
+        blocked.set()
+        records, partial = fetcher.fetched_records(timeout_ms=5000)
+        assert partial is False
+        tp = TopicPartition(topic, 0)
+        assert [record.value for record in records[tp]] == [b'foo']
+        fetcher._client.wakeup.assert_called()
+    finally:
+        blocked.set()
+        pool.close()
+
+
 def test__unpack_message_set(fetcher):
     fetcher.config['check_crcs'] = False
     tp = TopicPartition('foo', 0)
@@ -555,3 +644,25 @@ def test_partition_records_compacted_offset():
     assert len(records) == batch_end - fetch_offset - 1
     msgs = records.take(1)
     assert msgs[0].offset == fetch_offset + 1
+
+
+def test__unpack_message_set_skips_batches_before_position(fetcher, mocker):
+    fetcher.config['check_crcs'] = False
+    tp = TopicPartition('foo', 0)
+    buffer = b''
+    for base_offset in (0, 3, 6):
+        builder = MemoryRecordsBuilder(2, 0, 1024)
+        for i in range(3):
+            builder.append(None, None, b'%d' % (base_offset + i))
+        builder.close()
+        batch = bytearray(builder.buffer())
+        batch[:8] = struct.pack('>q', base_offset)
+        buffer += bytes(batch)
+    memory_records = MemoryRecords(buffer)
+    next_batch = mocker.spy(memory_records, 'next_batch')
+
+    records = list(fetcher._unpack_message_set(tp, memory_records, 4))
+    assert [record.offset for record in records] == [4, 5, 6, 7, 8]
+    assert [record.value for record in records] == [b'4', b'5', b'6', b'7', b'8']
+    # The first batch is skipped without being parsed
+    assert next_batch.call_count == 3
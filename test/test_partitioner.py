@@ -68,3 +68,53 @@ def test_murmur2_not_ascii():
     # Verify no regression of murmur2() bug encoding py2 bytes that don't ascii encode
     murmur2(b'\xa4')
     murmur2(b'\x81' * 1000)
+
+
+def test_default_partitioner_sticky():
+    partitioner = DefaultPartitioner(sticky=True)
+    all_partitions = list(range(100))
+    available = all_partitions
+    # keyless records stick to one partition per topic
+    p1 = partitioner(None, all_partitions, available, topic='foo')
+    assert p1 in available
+    for _ in range(10):
+        assert partitioner(None, all_partitions, available, topic='foo') == p1
+
+    # until a new batch is started on that partition
+    partitioner.on_new_batch('foo', all_partitions, available, p1)
+    p2 = partitioner(None, all_partitions, available, topic='foo')
+    assert p2 != p1
+
+    # a new batch on any other partition does not switch
+    partitioner.on_new_batch('foo', all_partitions, available, p1)
+    assert partitioner(None, all_partitions, available, topic='foo') == p2
+
+    # keyed records are still hashed
+    assert (partitioner(b'foo', all_partitions, available, topic='foo') ==
+            DefaultPartitioner()(b'foo', all_partitions, available))
+
+    # with a single available partition
+    partitioner.on_new_batch('foo', all_partitions, [p2], p2)
+    assert partitioner(None, all_partitions, [p2], topic='foo') == p2
+
+
+def test_default_partitioner_adaptive():
+    partitioner = DefaultPartitioner(adaptive=True)
+    assert partitioner.sticky
+    all_partitions = list(range(4))
+    p1 = partitioner(None, all_partitions, all_partitions, topic='foo')
+
+    # partitions missing from the load (leader not ready) are skipped, and
+    # the most loaded partition is rarely chosen
+    load = {0: 100000, 1: 0, 2: 50000}
+    chosen = []
+    for _ in range(200):
+        partitioner.on_new_batch('foo', all_partitions, all_partitions, p1, load)
+        p1 = partitioner(None, all_partitions, all_partitions, topic='foo')
+        chosen.append(p1)
+    assert 3 not in chosen
+    assert chosen.count(1) > chosen.count(2) > chosen.count(0)
+
+    # without load, falls back to available partitions
+    partitioner.on_new_batch('foo', all_partitions, [3], p1, {})
+    assert partitioner(None, all_partitions, [3], topic='foo') == 3
@@ -6,21 +6,47 @@ import threading
 import pytest
 
 from kafka import KafkaConsumer, KafkaProducer, TopicPartition
-from kafka.producer.buffer import SimpleBufferPool
+from kafka.errors import KafkaTimeoutError
+from kafka.producer.buffer import BufferPool
 from test.conftest import version
 from test.testutil import random_string
 
 
 def test_buffer_pool():
-    pool = SimpleBufferPool(1000, 1000)
+    pool = BufferPool(1000, 1000)
 
     buf1 = pool.allocate(1000, 1000)
-    message = ''.join(map(str, range(100)))
-    buf1.write(message.encode('utf-8'))
+    assert len(buf1) == 1000
+    assert pool.available_memory() == 0
     pool.deallocate(buf1)
 
+    # Poolable buffers are recycled
     buf2 = pool.allocate(1000, 1000)
-    assert buf2.read() == b''
+    assert buf2 is buf1
+
+
+def test_buffer_pool_accounts_bytes():
+    pool = BufferPool(1000, 100)
+    small = [pool.allocate(100, 0) for _ in range(5)]
+    large = pool.allocate(500, 0)
+    assert len(large) == 500
+    assert pool.available_memory() == 0
+    with pytest.raises(KafkaTimeoutError):
+        pool.allocate(10, 0)
+
+    for buf in small:
+        pool.deallocate(buf)
+    assert pool.unallocated_memory() == 0
+    assert pool.available_memory() == 500
+    # Pooled buffers are freed for other sizes
+    pool.allocate(300, 0)
+    assert pool.unallocated_memory() == 0
+    assert pool.available_memory() == 200
+
+    # Waiters get memory as it is deallocated
+    threading.Timer(0.1, pool.deallocate, [large]).start()
+    assert len(pool.allocate(600, 1000)) == 600
+    assert pool.queued() == 0
 
 
 @pytest.mark.skipif(not version(), reason="No KAFKA_VERSION set")
@@ -128,3 +154,24 @@ def test_kafka_producer_proper_record_metadata(kafka_broker, compression):
         partition=0)
     record = future.get(timeout=5)
     assert abs(record.timestamp - send_time) <= 1000  # Allow 1s deviation
+
+
+def test_kafka_producer_compression_config():
+    producer = KafkaProducer(
+        api_version=(2, 1, 0), compression_type='gzip', compression_level=1,
+        topic_compression={'logs': ('zstd', 19), 'latency': None})
+    try:
+        assert producer.config['compression_attrs'] == 1
+        assert producer.config['topic_compression_attrs'] == {
+            'logs': (4, 19), 'latency': (0, None)}
+        assert producer._compression_type('logs') == 'zstd'
+        assert producer._compression_type('foo') == 'gzip'
+    finally:
+        producer.close()
+
+    with pytest.raises(ValueError):
+        KafkaProducer(api_version=(2, 1, 0), compression_type='snappy',
+                      compression_level=1)
+    with pytest.raises(ValueError):
+        KafkaProducer(api_version=(2, 1, 0),
+                      topic_compression={'logs': ('gzip', 10)})
@@ -0,0 +1,167 @@
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+import kafka.errors as Errors
+from kafka import KafkaProducerPool
+from kafka.future import Future
+from kafka.producer.future import RecordMetadata
+from kafka.producer.pool import (
+    RingBuffer, _ACK, _ACK_CLOSED, _ACK_CLOSED_TYPE, _ACK_TYPE, _CLOSE,
+    _CLOSE_TYPE, _SEND, _SEND_TYPE, _run_producer)
+from kafka.structs import TopicPartition
+from kafka.record.memory_records import MemoryRecords
+from test.fake_broker import FakeKafkaBroker
+
+
+@pytest.fixture
+def fake_broker():
+    broker = FakeKafkaBroker(num_partitions=4).open()
+    yield broker
+    broker.close()
+
+
+def test_ring_buffer_wraps_around():
+    ring = RingBuffer(64)
+    assert ring.get(timeout=0) is None
+    for i in range(100):
+        message = b'x' * (i % 20) + b'%d' % i
+        assert ring.put(message, timeout=0)
+        assert ring.get(timeout=0) == message
+    assert ring.get(timeout=0) is None
+
+
+def test_ring_buffer_full():
+    ring = RingBuffer(64)
+    assert ring.put(b'a' * 20, timeout=0)
+    assert ring.put(b'b' * 20, timeout=0)
+    assert not ring.put(b'c' * 20, timeout=0.01)
+    assert ring.get(timeout=0) == b'a' * 20
+    assert ring.put(b'c' * 20, timeout=0)
+    assert ring.get(timeout=0) == b'b' * 20
+    assert ring.get(timeout=0) == b'c' * 20
+    with pytest.raises(ValueError):
+        ring.put(b'd' * 64)
+
+
+def _echo(requests, acks):
+    while True:
+        message = requests.get()
+        acks.put(message)
+        if not message:
+            return
+
+
+def test_ring_buffer_across_processes():
+    requests, acks = RingBuffer(1024), RingBuffer(1024)
+    process = multiprocessing.Process(target=_echo, args=(requests, acks))
+    process.start()
+    messages = [b'%d' % i * (i % 50 + 1) for i in range(2000)]
+    received = []
+
+    def receive():
+        while True:
+            ack = acks.get()
+            if not ack:
+                return
+            received.append(ack)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    for message in messages:
+        requests.put(message)
+    requests.put(b'')
+    receiver.join()
+    process.join()
+    assert received == messages
+
+
+class _RacingFuture(Future):
+    """Completed by the sender thread while the first callback is added,
+    which the unlocked Future then misses."""
+    def __init__(self, metadata):
+        super(_RacingFuture, self).__init__()
+        self._metadata = metadata
+
+    def add_callback(self, f, *args, **kwargs):
+        if self.is_done:
+            return super(_RacingFuture, self).add_callback(f, *args, **kwargs)
+        self.success(self._metadata)
+        self._callbacks.append(f)
+        return self
+
+
+def test_run_producer_acks_racing_futures(mocker):
+    tp = TopicPartition('foo', 0)
+    metadata = RecordMetadata('foo', 0, tp, 42, 1000, None, -1, 3)
+    producer = mocker.patch('kafka.producer.pool.KafkaProducer').return_value
+    producer.send.side_effect = lambda *args, **kwargs: _RacingFuture(metadata)
+
+    requests, acks = RingBuffer(1024), RingBuffer(1024)
+    child = threading.Thread(target=_run_producer,
+                             args=({}, requests, acks, os.getppid()))
+    child.start()
+    requests.put(_SEND.pack(_SEND_TYPE, 7, 0, -1, 3, -1, 3) + b'foobar')
+    requests.put(_CLOSE.pack(_CLOSE_TYPE, -1))
+    child.join(5)
+    assert not child.is_alive()
+
+    received = b''
+    while not received.endswith(_ACK_CLOSED.pack(_ACK_CLOSED_TYPE)):
+        message = acks.get(timeout=5)
+        assert message is not None
+        received += message
+    assert received == (_ACK.pack(_ACK_TYPE, 7, 42, 1000) +
+                        _ACK_CLOSED.pack(_ACK_CLOSED_TYPE))
+
+
+def test_producer_pool(fake_broker):
+    pool = KafkaProducerPool(bootstrap_servers=fake_broker.bootstrap_server(),
+                             producer_processes=2, linger_ms=5,
+                             max_in_flight_requests_per_connection=1,
+                             value_serializer=lambda v: b'%d' % v)
+    try:
+        assert pool.partitions_for('foo') == [0, 1, 2, 3]
+        futures = [pool.send('foo', i, key=b'%d' % (i % 7)) for i in range(1000)]
+        pool.flush()
+        assert all(f.is_done for f in futures)
+        metadata = [f.get(timeout=0) for f in futures]
+
+        values = {}
+        for i, m in enumerate(metadata):
+            values.setdefault(m.partition, []).append(i)
+        assert len(values) > 1
+        for partition, sent in values.items():
+            assert [m.offset for m in metadata if m.partition == partition] == \
+                list(range(len(sent)))
+            records = MemoryRecords(fake_broker.partition_log('foo', partition).read(0, 1024 * 1024))
+            logged = []
+            while records.has_next():
+                logged.extend(int(r.value) for r in records.next_batch())
+            # Records of a partition were sent in order
+            assert logged == sent
+
+        future = pool.send('foo', 0, partition=1)
+        assert future.get(timeout=5).offset == len(values.get(1, []))
+        with pytest.raises(AssertionError):
+            pool.send('foo', 0, partition=4)
+    finally:
+        pool.close()
+    with pytest.raises(AssertionError):
+        pool.send('foo', 0)
+
+
+def test_producer_pool_metadata_timeout(fake_broker):
+    fake_broker.close()
+    pool = KafkaProducerPool(bootstrap_servers=fake_broker.bootstrap_server(),
+                             producer_processes=1, max_block_ms=500,
+                             api_version=(2, 0))
+    try:
+        with pytest.raises(Errors.KafkaTimeoutError):
+            pool.send('foo', b'a')
+    finally:
+        pool.close(timeout=0)
@@ -5,6 +5,7 @@ import struct
 import pytest
 import six
 
+from kafka.codec import has_snappy, snappy_encode
 from kafka.protocol.api import RequestHeader
 from kafka.protocol.commit import GroupCoordinatorRequest
 from kafka.protocol.fetch import FetchRequest, FetchResponse
@@ -160,6 +161,25 @@ def test_decode_message_set():
     assert decoded_message2 == message2
 
 
+@pytest.mark.skipif(not has_snappy(), reason="Snappy not available")
+def test_decompress_snappy_message():
+    messages = [
+        Message(b'v1', key=b'k1'),
+        Message(b'v2', key=b'k2')
+    ]
+    inner = MessageSet.encode([(i, msg.encode())
+                               for i, msg in enumerate(messages)],
+                              prepend_size=False)
+    message = Message(snappy_encode(inner), attributes=Message.CODEC_SNAPPY)
+
+    msgs = message.decompress()
+    assert len(msgs) == 2
+    for i, (offset, _, decoded_message) in enumerate(msgs):
+        assert offset == i
+        assert decoded_message.key == messages[i].key
+        assert decoded_message.value == messages[i].value
+
+
 def test_encode_message_header():
     expect = b''.join([
         struct.pack('>h', 10),             # API Key
@@ -3,15 +3,20 @@ from __future__ import absolute_import
 
 import pytest
 import io
+import threading
 
+import kafka.errors as Errors
 from kafka.client_async import KafkaClient
 from kafka.cluster import ClusterMetadata
 from kafka.metrics import Metrics
 from kafka.protocol.produce import ProduceRequest
+from kafka.producer.future import FutureRecordSet
 from kafka.producer.record_accumulator import RecordAccumulator, ProducerBatch
 from kafka.producer.sender import Sender
-from kafka.record.memory_records import MemoryRecordsBuilder
+from kafka.producer.spill import BatchSpill
+from kafka.record.memory_records import MemoryRecords, MemoryRecordsBuilder
 from kafka.structs import TopicPartition
+from kafka.util import WorkerPool
 
 
 @pytest.fixture
@@ -51,3 +56,456 @@ def test_produce_request(sender, mocker, api_version, produce_version):
     records.close()
     produce_request = sender._produce_request(0, 0, 0, [batch])
     assert isinstance(produce_request, ProduceRequest[produce_version])
+
+
+def test_ready_skips_throttled_nodes(accumulator, mocker):
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.side_effect = lambda tp: tp.partition
+    accumulator.config['linger_ms'] = 0
+    for partition in range(2):
+        accumulator.append(TopicPartition('foo', partition), 0, None, b'bar', 0)
+
+    ready_nodes, next_ready_check, _ = accumulator.ready(cluster)
+    assert ready_nodes == set([0, 1])
+
+    throttle_delay = lambda node_id: 2000 if node_id == 1 else 0
+    ready_nodes, next_ready_check, _ = accumulator.ready(cluster, throttle_delay)
+    assert ready_nodes == set([0])
+    assert next_ready_check == 2.0
+
+
+def test_append_uses_topic_compression():
+    accumulator = RecordAccumulator(
+        message_version=2, compression_attrs=1, compression_level=1,
+        topic_compression_attrs={'logs': (4, 19), 'latency': (0, None)})
+    batches = {}
+    for topic in ('foo', 'logs', 'latency'):
+        tp = TopicPartition(topic, 0)
+        accumulator.append(tp, 0, None, b'bar' * 100, 0)
+        batch = accumulator._batches[tp][0]
+        batch.records.close()
+        batches[topic] = MemoryRecords(batch.records.buffer()).next_batch()
+    assert batches['foo'].compression_type == 1
+    assert batches['logs'].compression_type == 4
+    assert batches['latency'].compression_type == 0
+
+
+def test_compression_pool(mocker):
+    pool = WorkerPool(1)
+    wakeup = mocker.Mock()
+    accumulator = RecordAccumulator(
+        message_version=2, compression_attrs=1, batch_size=1000,
+        compression_pool=pool, wakeup=wakeup)
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    try:
+        tp = TopicPartition('foo', 0)
+        # Fill the first batch: it is handed to the pool right away
+        while len(accumulator._batches[tp]) < 2:
+            accumulator.append(tp, 0, None, b'bar' * 100, 0)
+        first, second = accumulator._batches[tp]
+        assert first.closing is not None
+        assert second.closing is None
+        first.close()
+        assert wakeup.called
+
+        ready_nodes, _, _ = accumulator.ready(cluster)
+        assert ready_nodes == set([0])
+        batches = accumulator.drain(cluster, ready_nodes, 1000000)
+        assert batches[0] == [first]
+        assert first.records.buffer()
+    finally:
+        pool.close()
+
+
+def test_compression_pool_bounds_ready_check(mocker):
+    pool = WorkerPool(1)
+    blocked = threading.Event()
+    accumulator = RecordAccumulator(
+        message_version=2, compression_attrs=1, batch_size=1000,
+        linger_ms=60000, retry_backoff_ms=100, compression_pool=pool)
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    try:
+        # The batch stays compressing behind a stuck task
+        pool.submit(blocked.wait)
+        tp = TopicPartition('foo', 0)
+        while len(accumulator._batches[tp]) < 2:
+            accumulator.append(tp, 0, None, b'bar' * 100, 0)
+        ready_nodes, next_ready_check, _ = accumulator.ready(cluster)
+        assert ready_nodes == set()
+        assert next_ready_check <= 0.1
+    finally:
+        blocked.set()
+        pool.close()
+
+
+def test_compression_ratio_estimation(mocker):
+    accumulator = RecordAccumulator(
+        message_version=2, compression_attrs=1, batch_size=1000)
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    tp = TopicPartition('foo', 0)
+    estimator = accumulator._compression_ratios
+    assert estimator.estimation('foo', 1) == 1.0
+
+    def produce_batch():
+        while len(accumulator._batches[tp]) < 2:
+            accumulator.append(tp, 0, None, b'bar' * 100, 0)
+        batch, = accumulator.drain(cluster, [0], 1000000)[0]
+        return batch
+
+    first = produce_batch()
+    assert len(first.records.buffer()) < 1000
+    # Improves slowly towards the observed ratio
+    assert estimator.estimation('foo', 1) == 1.0 - estimator.IMPROVING_STEP
+    assert estimator.estimation('bar', 1) == 1.0
+    for _ in range(200):
+        batch = produce_batch()
+    # Batches grow by uncompressed size, staying within compressed batch_size
+    assert batch.record_count > 2 * first.record_count
+    assert batch.records.compression_rate() < 0.5
+    assert len(batch.records.buffer()) <= 1000
+
+    # ...and deteriorates quickly
+    ratio = estimator.estimation('foo', 1)
+    assert estimator.update('foo', 1, ratio + 0.01) == ratio + 0.05
+    assert estimator.update('foo', 1, 0.9) == 0.9
+
+
+def test_complete_batch_splits_too_large_batch(sender, accumulator, mocker):
+    tp = TopicPartition('foo', 0)
+    accumulator.config['message_version'] = 2
+    futures = [accumulator.append(tp, 0, None, b'%d' % i * 10, 0)[0]
+               for i in range(10)]
+    batch = accumulator._batches[tp].popleft()
+    batch.close()
+
+    sender._complete_batch(batch, Errors.MessageSizeTooLargeError, -1)
+    assert batch.produce_future.wait(0)
+    assert not batch.produce_future.is_done
+    split = list(accumulator._batches[tp])
+    assert split == batch.split_batches
+    assert len(split) >= 2
+    assert sum(b.record_count for b in split) == 10
+    assert all(b.record_count <= 5 for b in split)
+    assert batch not in accumulator._incomplete.all()
+
+    # Record futures complete with the batch they moved to, in order
+    expected = []
+    for i, split_batch in enumerate(split):
+        assert accumulator._batches[tp].popleft() is split_batch
+        sender._complete_batch(split_batch, Errors.NoError, 100 * i)
+        expected.extend(100 * i + j for j in range(split_batch.record_count))
+    assert [f.get(0).offset for f in futures] == expected
+
+    # Batches of a single record can not be split
+    accumulator.append(tp, 0, None, b'foo', 0)
+    batch = accumulator._batches[tp].popleft()
+    batch.close()
+    sender._complete_batch(batch, Errors.MessageSizeTooLargeError, -1)
+    assert batch.produce_future.failed()
+
+
+def test_append_abort_on_new_batch(accumulator):
+    tp = TopicPartition('foo', 0)
+    future, _, _ = accumulator.append(tp, None, None, b'a', 1000,
+                                      abort_on_new_batch=True)
+    assert future is None
+    assert not accumulator._batches[tp]
+
+    future, _, new_batch_created = accumulator.append(tp, None, None, b'a', 1000)
+    assert future is not None and new_batch_created
+    future, _, new_batch_created = accumulator.append(
+        tp, None, None, b'b', 1000, abort_on_new_batch=True)
+    assert future is not None and not new_batch_created
+
+
+def test_partition_load(accumulator, mocker):
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.partitions_for_topic.return_value = set([0, 1, 2])
+    cluster.leader_for_partition.side_effect = lambda tp: [0, 1, -1][tp.partition]
+    accumulator.append(TopicPartition('foo', 0), None, None, b'a' * 100, 1000)
+    load = accumulator.partition_load(cluster, 'foo')
+    assert load[0] > 100 and load[1] == 0
+    assert 2 not in load  # leader unknown
+
+    accumulator.update_node_readiness(1, False)
+    assert 1 not in accumulator.partition_load(cluster, 'foo')
+    accumulator.update_node_readiness(1, True)
+    assert 1 in accumulator.partition_load(cluster, 'foo')
+
+    # unready leaders are only skipped for retry_backoff_ms
+    accumulator.config['retry_backoff_ms'] = 0
+    accumulator.update_node_readiness(1, False)
+    assert 1 in accumulator.partition_load(cluster, 'foo')
+
+
+@pytest.mark.parametrize("record_futures", [False, True])
+def test_append_many(sender, accumulator, record_futures):
+    tp = TopicPartition('foo', 0)
+    accumulator.config['batch_size'] = 200
+    accumulator.config['message_version'] = 2
+    records = [(0, None, b'%03d' % i * 5, 30) for i in range(20)]
+    record_set = FutureRecordSet()
+    futures = [] if record_futures else None
+    batch_is_full, new_batch_created = accumulator.append_many(
+        tp, records, 1000, record_set, futures)
+    assert batch_is_full and new_batch_created
+    batches = list(accumulator._batches[tp])
+    assert len(batches) > 1
+    assert sum(batch.record_count for batch in batches) == 20
+
+    # Fills the last batch before creating another one
+    accumulator.append_many(tp, records[:1], 1000, record_set, futures)
+    assert list(accumulator._batches[tp]) == batches
+    record_set.seal()
+
+    for i, batch in enumerate(batches):
+        assert not record_set.is_done
+        assert accumulator._batches[tp].popleft() is batch
+        batch.close()
+        sender._complete_batch(batch, Errors.NoError, 100 * i)
+    assert record_set.get(0) == 21
+    if record_futures:
+        offsets = [f.get(0).offset for f in futures]
+        assert offsets == sorted(offsets) and len(offsets) == 21
+
+
+def test_append_many_split_and_failure(sender, accumulator):
+    tp = TopicPartition('foo', 0)
+    accumulator.config['message_version'] = 2
+    record_set = FutureRecordSet()
+    accumulator.append_many(tp, [(0, None, b'%d' % i * 10, 30)
+                                 for i in range(10)], 1000, record_set)
+    record_set.seal()
+    batch = accumulator._batches[tp].popleft()
+    batch.close()
+
+    # Records follow split batches, the first failure fails the set
+    sender._complete_batch(batch, Errors.MessageSizeTooLargeError, -1)
+    assert not record_set.is_done
+    split = [accumulator._batches[tp].popleft() for _ in batch.split_batches]
+    sender._complete_batch(split[0], Errors.NoError, 0)
+    assert not record_set.is_done
+    sender._complete_batch(split[1], Errors.CorruptRecordException, -1)
+    assert record_set.failed()
+    for split_batch in split[2:]:
+        sender._complete_batch(split_batch, Errors.CorruptRecordException, -1)
+    with pytest.raises(Errors.CorruptRecordException):
+        record_set.get(0)
+
+
+def test_delivery_callback_without_record_futures(sender, mocker):
+    callback = mocker.Mock()
+    accumulator = RecordAccumulator(message_version=2,
+                                    delivery_callback=callback)
+    sender._accumulator = accumulator
+    tp = TopicPartition('foo', 0)
+    for i in range(10):
+        future, _, _ = accumulator.append(tp, 0, None, b'%d' % i * 10, 0,
+                                          record_future=False)
+        assert future is True
+    batch = accumulator._batches[tp].popleft()
+    assert batch.produce_future._callbacks == []
+    batch.close()
+
+    # Split batches report their own records
+    sender._complete_batch(batch, Errors.MessageSizeTooLargeError, -1)
+    assert not callback.called
+    for i, split_batch in enumerate(batch.split_batches):
+        assert accumulator._batches[tp].popleft() is split_batch
+        sender._complete_batch(split_batch, Errors.NoError, 100 * i)
+    assert callback.call_count == len(batch.split_batches)
+    assert sum(call[0][2] for call in callback.call_args_list) == 10
+    assert callback.call_args_list[0][0] == (
+        tp, 0, batch.split_batches[0].record_count, None)
+
+    accumulator.append(tp, 0, None, b'foo', 0, record_future=False)
+    batch = accumulator._batches[tp].popleft()
+    batch.close()
+    sender._complete_batch(batch, Errors.CorruptRecordException, -1)
+    callback.assert_called_with(tp, -1, 1, Errors.CorruptRecordException)
+
+
+@pytest.mark.parametrize("policy", ['fail', 'drop_oldest'])
+def test_buffer_overflow_policy(policy, metrics):
+    accumulator = RecordAccumulator(
+        message_version=2, batch_size=100, buffer_memory=300,
+        buffer_overflow_policy=policy, metrics=metrics)
+    tps = [TopicPartition('foo', i) for i in range(4)]
+    futures = [accumulator.append(tp, 0, None, b'bar', 1000)[0]
+               for tp in tps[:3]]
+    utilization = metrics.metrics[metrics.metric_name(
+        'buffer-utilization', 'producer-metrics')]
+    assert utilization.value() == 1.0
+
+    if policy == 'fail':
+        with pytest.raises(Errors.BufferExhaustedError):
+            accumulator.append(tps[3], 0, None, b'bar', 1000)
+        assert not any(future.is_done for future in futures)
+        return
+
+    accumulator.append(tps[3], 0, None, b'bar', 1000)
+    assert isinstance(futures[0].exception, Errors.BufferExhaustedError)
+    assert not accumulator._batches[tps[0]]
+    assert len(accumulator._batches[tps[3]]) == 1
+    assert not any(future.is_done for future in futures[1:])
+    assert metrics.metrics[metrics.metric_name(
+        'record-drop-rate', 'producer-metrics')].value() > 0
+    assert utilization.value() == 1.0
+
+
+def test_buffer_memory_counts_batch_overflow(mocker):
+    accumulator = RecordAccumulator(
+        message_version=2, compression_attrs=1, batch_size=1000,
+        buffer_memory=100000)
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    tp = TopicPartition('foo', 0)
+    pool = accumulator._free
+
+    # Batches appended beyond batch_size on the compression estimate
+    accumulator._compression_ratios._ratios[('foo', 1)] = 0.1
+    while len(accumulator._batches[tp]) < 2:
+        accumulator.append(tp, 0, None, b'bar' * 100, 0)
+    batch = accumulator._batches[tp][0]
+    assert batch.records.size_in_bytes() <= 1000
+    assert batch.records.memory_size() > 1000
+    assert batch.reserved == batch.records.memory_size() - 1000
+    assert pool.available_memory() == 100000 - 2000 - batch.reserved
+
+    # ...only count their compressed size once drained
+    drained, = accumulator.drain(cluster, [0], 1000000)[0]
+    assert drained is batch
+    assert batch.reserved == 0
+    assert pool.available_memory() == 100000 - 2000
+    accumulator.deallocate(batch)
+    assert pool.available_memory() == 100000 - 1000
+
+
+def test_buffer_overflow_spill(tmpdir, mocker):
+    spill = BatchSpill(str(tmpdir))
+    accumulator = RecordAccumulator(
+        message_version=2, batch_size=200, buffer_memory=600,
+        buffer_overflow_policy='spill', spill=spill)
+    tp = TopicPartition('foo', 0)
+    futures = [accumulator.append(tp, 0, None, b'%02d' % i * 10, 1000)[0]
+               for i in range(20)]
+    batches = list(accumulator._batches[tp])
+    assert len(batches) == 4
+    assert [batch.spilled for batch in batches] == [True, False, False, False]
+    assert accumulator._free.available_memory() == 0
+    assert spill.spilled_bytes() == sum(batch.records.size_in_bytes()
+                                        for batch in batches[:1])
+
+    # Batches are drained in order, spilled ones are read back from disk
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    values = []
+    while accumulator._batches[tp]:
+        batch, = accumulator.drain(cluster, [0], 1)[0]
+        values.extend(record.value for record in
+                      MemoryRecords(bytes(batch.records.buffer())).next_batch())
+        batch.done(0)
+        accumulator.deallocate(batch)
+    assert values == [b'%02d' % i * 10 for i in range(20)]
+    assert all(future.is_done for future in futures)
+    assert spill.spilled_bytes() == 0
+    assert accumulator._free.available_memory() == 600
+    spill.close()
+
+
+def test_spill_candidates_bounded(tmpdir, mocker):
+    spill = BatchSpill(str(tmpdir))
+    accumulator = RecordAccumulator(
+        message_version=2, batch_size=200, buffer_overflow_policy='spill',
+        spill=spill)
+    tp = TopicPartition('foo', 0)
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    for _ in range(100):
+        for i in range(20):
+            accumulator.append(tp, 0, None, b'%02d' % i * 10, 1000)
+        # Each full batch is a candidate once
+        assert len(accumulator._spill_candidates) == len(accumulator._batches[tp]) - 1
+        while accumulator._batches[tp]:
+            for batch in accumulator.drain(cluster, [0], 1024 * 1024)[0]:
+                batch.done(0)
+                accumulator.deallocate(batch)
+        assert not accumulator._spill_candidates
+    spill.close()
+
+
+def test_ready_and_drain_only_check_partitions_with_data(mocker):
+    accumulator = RecordAccumulator(message_version=2, batch_size=100,
+                                    linger_ms=1000, retry_backoff_ms=500)
+    cluster = mocker.Mock(spec=ClusterMetadata())
+    cluster.leader_for_partition.return_value = 0
+    idle = [TopicPartition('foo', i) for i in range(2, 100)]
+    for tp in idle:
+        accumulator.append(tp, 0, None, b'a', 0)
+        accumulator.drain(cluster, [0], 1000000)
+    lingering, full = TopicPartition('foo', 0), TopicPartition('foo', 1)
+    accumulator.append(lingering, 0, None, b'a', 0)
+    while len(accumulator._batches[full]) < 2:
+        accumulator.append(full, 0, None, b'a' * 20, 0)
+
+    cluster.leader_for_partition.reset_mock()
+    ready_nodes, next_ready_check, _ = accumulator.ready(cluster)
+    assert ready_nodes == set([0])
+    assert 0.9 < next_ready_check <= 1.0
+    assert cluster.leader_for_partition.call_count == 1
+
+    cluster.leader_for_partition.reset_mock()
+    drained = accumulator.drain(cluster, [0], 1000000)[0]
+    assert set(b.topic_partition for b in drained) == set([lingering, full])
+    assert cluster.leader_for_partition.call_count == 2
+    batch, = [b for b in drained if b.topic_partition == full]
+
+    # Retried batches are due after retry_backoff_ms
+    accumulator.reenqueue(batch)
+    ready_nodes, next_ready_check, _ = accumulator.ready(cluster)
+    assert ready_nodes == set()
+    assert 0.4 < next_ready_check <= 0.5
+
+    # Flushes make all partitions with data sendable
+    accumulator.append(lingering, 0, None, b'a', 0)
+    accumulator.begin_flush()
+    ready_nodes, _, _ = accumulator.ready(cluster)
+    assert ready_nodes == set([0])
+    drained = accumulator.drain(cluster, [0], 1000000)[0]
+    assert [b.topic_partition for b in drained] == [lingering]
+    assert accumulator.has_unsent()
+
+
+def test_concurrent_appends_and_abort():
+    accumulator = RecordAccumulator(message_version=2, batch_size=200)
+    tps = [TopicPartition('foo', i) for i in range(100)]
+
+    def append(offset):
+        for i in range(1000):
+            accumulator.append(tps[(offset + i) % len(tps)], 0, None,
+                               b'%d' % i, 0)
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batches = [b for tp in tps for b in accumulator._batches[tp]]
+    for tp in tps:
+        records = 0
+        for batch in accumulator._batches[tp]:
+            batch.records.close()
+            records += len(list(MemoryRecords(
+                bytes(batch.records.buffer())).next_batch()))
+        assert records == 80
+    assert sum(b.records.next_offset() for b in batches) == 8000
+
+    accumulator.close()
+    accumulator.abort_incomplete_batches()
+    assert all(b.produce_future.failed() for b in batches)
+    assert not accumulator.has_unsent()
+    with pytest.raises(AssertionError):
+        accumulator.append(tps[0], 0, None, b'a', 0)
@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+
+import os
+
+from kafka.producer.spill import BatchSpill
+
+
+def test_batch_spill(tmpdir):
+    spill = BatchSpill(str(tmpdir), segment_bytes=100)
+    directory, = tmpdir.listdir()
+
+    handles = [(spill.write(b'%d' % i * 30), 30) for i in range(10)]
+    assert spill.spilled_bytes() == 300
+    # A new segment once segment_bytes were written
+    assert len(directory.listdir()) == 3
+    for i, ((segment, position), size) in enumerate(handles):
+        assert spill.read(segment, position, size) == b'%d' % i * 30
+
+    # Segments are deleted once all of their batches are released
+    first = handles[0][0][0]
+    for (segment, _), size in handles[:3]:
+        spill.release(segment, size)
+    assert os.path.exists(first.path)
+    spill.release(handles[3][0][0], 30)
+    assert not os.path.exists(first.path)
+    assert len(directory.listdir()) == 2
+    assert spill.spilled_bytes() == 180
+    segment, position = handles[9][0]
+    assert spill.read(segment, position, 30) == b'9' * 30
+
+    spill.close()
+    assert not directory.check()
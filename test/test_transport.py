@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+
+import socket
+import threading
+
+import pytest
+
+from kafka import KafkaConsumer, KafkaProducer
+from kafka.client_async import KafkaClient
+from kafka.protocol.metadata import MetadataRequest
+from kafka.transport import (
+    AF_UNIX, InMemoryTransport, TcpTransport, UnixSocketTransport)
+from test.fake_broker import FakeKafkaBroker
+
+
+@pytest.fixture
+def fake_broker():
+    broker = FakeKafkaBroker(num_partitions=2).open()
+    yield broker
+    broker.close()
+
+
+def test_tcp_transport_addresses():
+    addresses = TcpTransport().addresses('127.0.0.1', 9092, socket.AF_UNSPEC)
+    assert addresses == [(socket.AF_INET, ('127.0.0.1', 9092))]
+
+
+@pytest.mark.skipif(AF_UNIX is None, reason='no unix domain sockets')
+def test_unix_socket_transport_skips_tcp_options(mocker):
+    transport = UnixSocketTransport('/tmp/{host}-{port}.sock')
+    assert transport.addresses('foo', 9092, socket.AF_UNSPEC) == [
+        (AF_UNIX, '/tmp/foo-9092.sock')]
+    sock = mocker.MagicMock()
+    transport.configure(sock, [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)])
+    sock.setsockopt.assert_called_once_with(
+        socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+
+
+@pytest.mark.skipif(AF_UNIX is None, reason='no unix domain sockets')
+def test_unix_socket_transport(fake_broker, tmpdir):
+    path = str(tmpdir.join('kafka.sock'))
+    server = socket.socket(AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(5)
+
+    def accept():
+        while True:
+            try:
+                sock, _ = server.accept()
+            except socket.error:
+                return
+            fake_broker.serve_socket(sock, path)
+    thread = threading.Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+
+    client = KafkaClient(bootstrap_servers=fake_broker.bootstrap_server(),
+                         transport=UnixSocketTransport(path))
+    try:
+        node_id = client.least_loaded_node()
+        future = client.send(node_id, MetadataRequest[1](['foo']))
+        client.poll(future=future)
+        assert future.succeeded()
+        assert future.value.topics[0][1] == 'foo'
+        assert client._conns[node_id]._sock.family == AF_UNIX
+    finally:
+        client.close()
+        server.close()
+
+
+def test_in_memory_transport(fake_broker):
+    transport = InMemoryTransport(fake_broker.serve_socket)
+    # The advertised address is not listened on: every byte must go
+    # through the transport
+    bootstrap = 'kafka.invalid:9092'
+    fake_broker.host, fake_broker.port = 'kafka.invalid', 9092
+
+    producer = KafkaProducer(bootstrap_servers=bootstrap, transport=transport)
+    for i in range(10):
+        producer.send('foo', value=str(i).encode(), partition=i % 2)
+    producer.close()
+
+    consumer = KafkaConsumer('foo', bootstrap_servers=bootstrap,
+                             group_id=None, auto_offset_reset='earliest',
+                             consumer_timeout_ms=500, transport=transport)
+    values = sorted(int(message.value) for message in consumer)
+    consumer.close()
+    assert values == list(range(10))
+
@@ -83,3 +83,29 @@ class UtilTest(unittest.TestCase):
         t1 = t("a", 1)
         with self.assertRaises(AssertionError):
             kafka.util.group_by_topic_and_partition([t1, t1])
+
+    def test_worker_pool(self):
+        pool = kafka.util.WorkerPool(2)
+        try:
+            futures = [pool.submit(pow, 2, i) for i in range(10)]
+            failed = pool.submit(int, 'foo')
+        finally:
+            pool.close()
+        self.assertEqual([f.value for f in futures], [2 ** i for i in range(10)])
+        self.assertTrue(failed.failed())
+        self.assertIsInstance(failed.exception, ValueError)
+        with self.assertRaises(RuntimeError):
+            pool.submit(pow, 2, 2)
+
+    def test_worker_pool_callback(self):
+        pool = kafka.util.WorkerPool(1)
+        results = []
+        try:
+            pool.submit(pow, 2, 3, callback=results.append)
+            pool.submit(int, 'foo', callback=results.append)
+            with self.assertRaises(TypeError):
+                pool.submit(pow, 2, 3, foo=1)
+        finally:
+            pool.close()
+        self.assertEqual(results[0], 8)
+        self.assertIsInstance(results[1], ValueError)